@@ -0,0 +1,100 @@
+"""
+Benchmark of compositing weather overlay onto background GIF frames:
+Pillow (frame by frame) versus NumPy (all frames at once) engines.
+Results are printed (or written to file) as JSON.
+
+Usage:
+    python -m benchmarks.compositing --frames 10,50,120,240 --output results.json
+"""
+
+
+from argparse import ArgumentParser
+from json import dumps
+from statistics import median
+from time import perf_counter
+from PIL import Image, ImageDraw, ImageFont
+
+from benchmarks.cycle import FONT_FILE, git_revision
+from benchmarks.fakes import icon_png
+from src.services.background_frames import PreparedFrames
+from src.services.compositor import NumPyCompositor, PILCompositor
+
+
+def make_frames(count: int, size: int = 200) -> PreparedFrames:
+    """ Creates synthetic prepared background frames. """
+
+    frames = []
+    for i in range(count):
+        shift = i * 256 // count
+        frame = Image.linear_gradient("L").resize((size, size))
+        frame = frame.point(lambda v: (v + shift) % 256)
+        frames.append(Image.merge("RGB", (frame, frame.rotate(90), frame.rotate(180))).convert("RGBA"))
+    return PreparedFrames(frames=frames, durations=[40] * count)
+
+
+def make_overlay(size: int = 200) -> Image.Image:
+    """ Creates overlay similar to the one avatar generator draws. """
+
+    from io import BytesIO
+
+    overlay = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+    icon = Image.open(BytesIO(icon_png())).convert("RGBA")
+    overlay.paste(icon, (50, 15), icon)
+    canvas = ImageDraw.Draw(overlay)
+    canvas.text((65, 100), "+23 C", font=ImageFont.truetype(FONT_FILE, 30), fill=(255, 255, 255))
+    canvas.text((55, 130), "46%   0.67 m/c", font=ImageFont.truetype(FONT_FILE, 15), fill=(255, 255, 255))
+    return overlay
+
+
+def measure(compositor, prepared: PreparedFrames, overlay: Image.Image, iterations: int) -> float:
+    """ Returns median time (milliseconds) of compositing all frames. """
+
+    times = []
+    for _ in range(iterations):
+        started_at = perf_counter()
+        for _ in compositor.composite(prepared, overlay, key=len(prepared.frames)):
+            pass
+        times.append((perf_counter() - started_at) * 1000)
+    return round(median(times), 3)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", default="10,50,120,240", help="frame counts")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    args = parser.parse_args()
+
+    overlay = make_overlay()
+    results = []
+    for count in (int(f) for f in args.frames.split(",")):
+        prepared = make_frames(count)
+        pil, numpy = PILCompositor(), NumPyCompositor()
+        # The first NumPy call stacks frames (once per GIF)
+        started_at = perf_counter()
+        numpy_frames = [
+            bytes(frame) for frame in numpy.composite(prepared, overlay, key=count)
+        ]
+        numpy_first_ms = round((perf_counter() - started_at) * 1000, 3)
+        identical = numpy_frames == list(pil.composite(prepared, overlay))
+        pil_ms = measure(pil, prepared, overlay, args.iterations)
+        numpy_ms = measure(numpy, prepared, overlay, args.iterations)
+        results.append({
+            "frames": count,
+            "pil_ms": pil_ms,
+            "numpy_ms": numpy_ms,
+            "numpy_first_ms": numpy_first_ms,
+            "speedup": round(pil_ms / numpy_ms, 2),
+            "identical": identical,
+        })
+    report = dumps({"revision": git_revision(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,277 @@
+"""
+Offline benchmark of fetch -> render -> encode -> upload cycle.
+OpenWeatherMap API and Telegram are replaced with local fakes, every
+scenario runs in a fresh process so its peak RSS is measured separately.
+Results are printed (or written to file) as JSON.
+
+With --prerender every scenario is also run with forecast pre-rendering
+between cycles (fake forecast predicts observations exactly, so cycles
+measure upload-only updates).
+
+Usage:
+    python -m benchmarks.cycle --iterations 10 --output results.json
+    python -m benchmarks.cycle --prerender --sizes 200 --frames 50
+"""
+
+
+import os
+from argparse import ArgumentParser
+from asyncio import run
+from concurrent.futures import ProcessPoolExecutor
+from json import dumps
+from logging import WARNING
+from multiprocessing import get_context
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from statistics import mean, quantiles
+from subprocess import DEVNULL, check_output
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from PIL import Image
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_FILE = os.path.join(ROOT, "src", "data", "OpenSans-Regular.ttf")
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """ Returns summary of latencies in milliseconds. """
+
+    if len(values) > 1:
+        cuts = quantiles(values, n=100, method="inclusive")
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = values[0]
+    return {
+        "p50": round(p50, 3),
+        "p90": round(p90, 3),
+        "p99": round(p99, 3),
+        "mean": round(mean(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def make_gif(path: str, size: int, frames: int, duration: int = 40):
+    """ Creates synthetic background GIF. """
+
+    images = []
+    for i in range(frames):
+        shift = i * 256 // frames
+        frame = Image.linear_gradient("L").resize((size, size))
+        frame = frame.point(lambda v: (v + shift) % 256)
+        images.append(Image.merge("RGB", (frame, frame.rotate(90), frame.rotate(180))))
+    images[0].save(
+        path,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+    )
+
+
+async def run_cycles(scenario: dict, workdir: str) -> dict:
+    """ Runs benchmark cycles of scenario inside working directory. """
+
+    from benchmarks.fakes import FakeOpenWeatherMap, FakeTelegramClient
+    from src.application import Application
+    from src.config import ApplicationConfig
+    from src.schemas import AccountContext, ApplicationContext
+    from src.services import (
+        AvatarGenerator, IconStore, OpenWeatherMapAPI, PrerenderCache, Prerenderer,
+    )
+    from src.utils import (
+        CustomJSONLogger, Metrics, StateStore, create_client_session,
+    )
+
+    bg_gif = None
+    if scenario["mode"] == "animated":
+        bg_gif = os.path.join(workdir, "bg.gif")
+        make_gif(bg_gif, scenario["gif_size"], scenario["frames"])
+    icons_folder = os.path.join(workdir, "icons")
+    os.mkdir(icons_folder)
+
+    fake_owm = FakeOpenWeatherMap()
+    await fake_owm.start()
+    logger = CustomJSONLogger(name="benchmark", level=WARNING)
+    icon_store = IconStore(icons_folder)
+    tg_client = FakeTelegramClient(latency=scenario["telegram_latency"])
+    metrics = Metrics(logger)
+    session = create_client_session(metrics=metrics)
+    open_weather_map = OpenWeatherMapAPI(
+        api_token="benchmark",
+        api_url=fake_owm.api_url,
+        image_url_template=fake_owm.image_url_template,
+        cache_folder_path=icons_folder,
+        city_id=524901,
+        logger=logger,
+        client_session=session,
+        group_api_url=fake_owm.group_api_url,
+        icon_store=icon_store,
+        metrics=metrics,
+        forecast_api_url=fake_owm.forecast_api_url,
+    )
+    account = AccountContext(
+        name="benchmark",
+        city_id=524901,
+        phone="",
+        password="",
+        tg_client=tg_client,
+        avatar_generator=AvatarGenerator(
+            font_file=FONT_FILE,
+            image_folder=icons_folder,
+            text_color=(255, 255, 255),
+            bg_gif=bg_gif,
+            icon_store=icon_store,
+        ),
+    )
+    prerenderer = Prerenderer(
+        open_weather_map=open_weather_map,
+        accounts=[account],
+        logger=logger,
+        metrics=metrics,
+        cache=PrerenderCache(),
+    ) if scenario["prerender"] else None
+    application = Application(ApplicationContext(
+        accounts=[account],
+        open_weather_map=open_weather_map,
+        config=ApplicationConfig,
+        logger=logger,
+        state=StateStore(os.path.join(workdir, "state.json")),
+        metrics=metrics,
+        http_session=session,
+        prerenderer=prerenderer,
+    ))
+
+    fetch_ms, render_ms, cycle_ms, output_bytes = [], [], [], []
+    try:
+        for _ in range(scenario["iterations"]):
+            if prerenderer is not None:
+                # Idle time between cycles (fake forecast starts at the
+                # next observation)
+                await prerenderer.prerender(now=1725724090)
+            calls_before = len(tg_client.calls)
+            started_at = perf_counter()
+            weather = await open_weather_map.get_weather_data_many([account.city_id])
+            fetched_at = perf_counter()
+            await application.update_account(account, weather[account.city_id])
+            finished_at = perf_counter()
+            fetch_ms.append((fetched_at - started_at) * 1000)
+            cycle_ms.append((finished_at - started_at) * 1000)
+            output_bytes.extend(
+                size
+                for name, size in tg_client.calls[calls_before:]
+                if name == "upload_file"
+            )
+            # Render only (same weather, no upload)
+            started_at = perf_counter()
+            account.avatar_generator.generate(weather[account.city_id])
+            render_ms.append((perf_counter() - started_at) * 1000)
+    finally:
+        await application.teardown()
+        await fake_owm.stop()
+
+    calls = {}
+    for name, _ in tg_client.calls:
+        calls[name] = calls.get(name, 0) + 1
+    return {
+        "prerender_hit_rate": (
+            round(prerenderer.cache.hit_rate, 3) if prerenderer else None
+        ),
+        "fetch_ms": percentiles(fetch_ms),
+        "render_ms": percentiles(render_ms),
+        "cycle_ms": percentiles(cycle_ms),
+        "output_bytes": round(mean(output_bytes)) if output_bytes else 0,
+        "owm_requests": len(fake_owm.requests),
+        "telegram_calls": calls,
+        "http_connections": {
+            event: int(metrics.http_connections.value(host="127.0.0.1", event=event))
+            for event in ("create", "reuse")
+        },
+    }
+
+
+def run_scenario(scenario: dict) -> dict:
+    """ Runs scenario (inside fresh worker process). """
+
+    with TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            result = run(run_cycles(scenario, workdir))
+        finally:
+            os.chdir(cwd)
+    result.update(scenario)
+    result["peak_rss_kb"] = getrusage(RUSAGE_SELF).ru_maxrss
+    result["peak_children_rss_kb"] = getrusage(RUSAGE_CHILDREN).ru_maxrss
+    return result
+
+
+def git_revision() -> str | None:
+    try:
+        return check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=DEVNULL, text=True,
+        ).strip()
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--sizes", default="200,500", help="GIF sizes (px)")
+    parser.add_argument("--frames", default="10,50,120", help="GIF frame counts")
+    parser.add_argument(
+        "--telegram-latency",
+        type=float,
+        default=0.05,
+        help="latency of every fake Telegram call (seconds)",
+    )
+    parser.add_argument(
+        "--prerender",
+        action="store_true",
+        help="also run every scenario with forecast pre-rendering",
+    )
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    args = parser.parse_args()
+
+    scenarios = [{
+        "name": "static",
+        "mode": "static",
+        "gif_size": None,
+        "frames": None,
+        "iterations": args.iterations,
+        "telegram_latency": args.telegram_latency,
+    }]
+    for size in (int(s) for s in args.sizes.split(",")):
+        for frames in (int(f) for f in args.frames.split(",")):
+            scenarios.append({
+                "name": f"animated_{size}px_{frames}f",
+                "mode": "animated",
+                "gif_size": size,
+                "frames": frames,
+                "iterations": args.iterations,
+                "telegram_latency": args.telegram_latency,
+            })
+
+    for scenario in scenarios:
+        scenario["prerender"] = False
+    if args.prerender:
+        scenarios += [
+            dict(scenario, name=scenario["name"] + "_prerender", prerender=True)
+            for scenario in scenarios
+        ]
+
+    results = []
+    for scenario in scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            results.append(pool.submit(run_scenario, scenario).result())
+    report = dumps({"revision": git_revision(), "scenarios": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,222 @@
+""" Local fakes of OpenWeatherMap API and Telethon client for benchmarks. """
+
+
+from aiohttp import web
+from asyncio import sleep
+from io import BytesIO
+from itertools import count
+from PIL import Image, ImageDraw
+from datetime import datetime
+from telethon.tl.types import InputFile, Photo
+from telethon.tl.types.photos import Photo as PhotosPhoto
+
+
+def weather_payload(city_id: int, n: int) -> dict:
+    """
+    Returns OpenWeatherMap current weather response for city.
+    Temperature changes with n so that every response renders a new avatar.
+    """
+
+    return {
+        "coord": {"lon": 37.6156, "lat": 55.7522},
+        "weather": [{
+            "id": 800,
+            "main": "Clear",
+            "description": "clear sky",
+            "icon": ("01d", "02d", "10n")[n % 3],
+        }],
+        "base": "stations",
+        "main": {
+            "temp": -30 + n % 60,
+            "feels_like": 22.1,
+            "temp_min": 21.4,
+            "temp_max": 24.2,
+            "pressure": 1029,
+            "humidity": 46,
+        },
+        "visibility": 10000,
+        "wind": {"speed": 0.67, "deg": 50},
+        "clouds": {"all": 5},
+        "dt": 1725724090 + n,
+        "sys": {
+            "type": 2,
+            "id": 2095214,
+            "country": "RU",
+            "sunrise": 1725677189,
+            "sunset": 1725725334,
+        },
+        "timezone": 10800,
+        "id": city_id,
+        "name": f"City {city_id}",
+        "cod": 200,
+    }
+
+
+def icon_png() -> bytes:
+    """ Returns 100x100 RGBA PNG similar to OpenWeatherMap icons. """
+
+    icon = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+    ImageDraw.Draw(icon).ellipse((15, 15, 85, 85), fill=(255, 200, 0, 255))
+    buffer = BytesIO()
+    icon.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def forecast_payload(city_id: int, n: int, cnt: int) -> dict:
+    """
+    Returns OpenWeatherMap forecast response for city which predicts the
+    next cnt current weather responses exactly.
+    """
+
+    items = []
+    for i in range(n, n + cnt):
+        item = weather_payload(city_id, i)
+        items.append({
+            key: item[key]
+            for key in ("dt", "main", "weather", "clouds", "wind", "visibility")
+        })
+    return {
+        "cod": "200",
+        "message": 0,
+        "cnt": cnt,
+        "list": items,
+        "city": {"id": city_id, "name": f"City {city_id}", "timezone": 10800},
+    }
+
+
+class FakeOpenWeatherMap:
+    """
+    Local HTTP server which imitates OpenWeatherMap current weather,
+    group, forecast and icon endpoints.
+    """
+
+    def __init__(self, forecast_items: int = 8):
+        # Number of issued current weather responses
+        self._issued = 0
+        self._forecast_items = forecast_items
+        self._icon = icon_png()
+        self._runner: web.AppRunner | None = None
+        self.requests: list[str] = []
+        self.base_url = ""
+
+    async def _weather(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path)
+        city_id = int(request.query["id"])
+        return web.json_response(weather_payload(city_id, self._next()))
+
+    async def _group(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path)
+        items = []
+        for city_id in request.query["id"].split(","):
+            item = weather_payload(int(city_id), self._next())
+            for key in ("base", "cod", "timezone"):
+                del item[key]
+            items.append(item)
+        return web.json_response({"cnt": len(items), "list": items})
+
+    async def _forecast(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path)
+        city_id = int(request.query["id"])
+        return web.json_response(
+            forecast_payload(city_id, self._issued, self._forecast_items)
+        )
+
+    def _next(self) -> int:
+        self._issued += 1
+        return self._issued - 1
+
+    async def _image(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path)
+        return web.Response(body=self._icon, content_type="image/png")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", self._weather)
+        app.router.add_get("/data/2.5/group", self._group)
+        app.router.add_get("/data/2.5/forecast", self._forecast)
+        app.router.add_get("/img/wn/{name}", self._image)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @property
+    def api_url(self) -> str:
+        return self.base_url + "/data/2.5/weather"
+
+    @property
+    def group_api_url(self) -> str:
+        return self.base_url + "/data/2.5/group"
+
+    @property
+    def forecast_api_url(self) -> str:
+        return self.base_url + "/data/2.5/forecast"
+
+    @property
+    def image_url_template(self) -> str:
+        return self.base_url + "/img/wn/{}@2x.png"
+
+
+class FakeTelegramClient:
+    """
+    Imitation of TelegramClient which records calls instead of talking to
+    Telegram. Every call takes the given latency (seconds), so that
+    overlapping of calls can be measured.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.calls: list[tuple[str, int]] = []
+        self._ids = count(1)
+        self._latency = latency
+
+    async def start(self, *args, **kwargs):
+        return self
+
+    async def disconnect(self):
+        pass
+
+    async def upload_file(self, file, **kwargs) -> InputFile:
+        if isinstance(file, (bytes, bytearray)):
+            size = len(file)
+        elif hasattr(file, "getbuffer"):
+            size = file.getbuffer().nbytes
+        else:
+            with open(file, "rb") as uploaded_file:
+                size = len(uploaded_file.read())
+        self.calls.append(("upload_file", size))
+        await sleep(self._latency)
+        return InputFile(
+            id=next(self._ids),
+            parts=1,
+            name=kwargs.get("file_name") or "avatar",
+            md5_checksum="",
+        )
+
+    async def get_profile_photos(self, *args, **kwargs) -> list:
+        self.calls.append(("get_profile_photos", 0))
+        await sleep(self._latency)
+        return []
+
+    async def __call__(self, request, *args, **kwargs):
+        name = type(request).__name__
+        self.calls.append((name, 0))
+        await sleep(self._latency)
+        if name == "UploadProfilePhotoRequest":
+            photo = Photo(
+                id=next(self._ids),
+                access_hash=0,
+                file_reference=b"ref",
+                date=datetime.now(),
+                sizes=[],
+                dc_id=2,
+            )
+            return PhotosPhoto(photo=photo, users=[])
+        if name == "DeletePhotosRequest":
+            return [photo.id for photo in request.id]
+        return None
@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of OpenWeatherMap response parsing: decoding JSON and
+validating full model (previous way) versus validating raw bytes into
+full or render model with pydantic JSON validator.
+Payloads are sample responses in benchmarks/data, results are printed
+(or written to file) as JSON.
+
+Usage:
+    python -m benchmarks.parsing --number 20000 --output results.json
+"""
+
+
+import os
+from argparse import ArgumentParser
+from json import dumps, loads
+from timeit import repeat
+
+from benchmarks.cycle import ROOT, git_revision
+from src.schemas import (
+    OpenWeatherMapGroupResponse, OpenWeatherMapRenderData,
+    OpenWeatherMapRenderGroup, OpenWeatherMapResponse,
+)
+
+
+DATA_FOLDER = os.path.join(ROOT, "benchmarks", "data")
+
+# Payload file, number of cities in it and parsers
+PAYLOADS = {
+    "weather": ("owm_weather.json", 1, {
+        "dict_full": lambda data: OpenWeatherMapResponse(**loads(data)),
+        "json_full": OpenWeatherMapResponse.model_validate_json,
+        "json_render": OpenWeatherMapRenderData.from_json,
+    }),
+    "group": ("owm_group.json", 20, {
+        "dict_full": lambda data: OpenWeatherMapGroupResponse(**loads(data)),
+        "json_full": OpenWeatherMapGroupResponse.model_validate_json,
+        "json_render": OpenWeatherMapRenderGroup.from_json,
+    }),
+}
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="parses per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for payload, (file_name, cities, parsers) in PAYLOADS.items():
+        with open(os.path.join(DATA_FOLDER, file_name), "rb") as payload_file:
+            data = payload_file.read()
+        number = max(args.number // cities, 1)
+        baseline = None
+        for name, parse in parsers.items():
+            best = min(repeat(lambda: parse(data), number=number, repeat=args.repeat))
+            per_parse = best / number
+            baseline = baseline or per_parse
+            results.append({
+                "payload": payload,
+                "parser": name,
+                "us_per_response": round(per_parse * 1e6, 2),
+                "cities_per_second": round(cities / per_parse),
+                "speedup": round(baseline / per_parse, 2),
+            })
+    report = dumps({"revision": git_revision(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark of avatar overlay rendering: drawing icon and texts with
+ImageDraw on every generation (previous way) versus compiled render plan
+with cached glyphs (overlay cache miss) and cached overlay (hit), at
+several avatar sizes. Results are printed (or written to file) as JSON.
+
+Usage:
+    python -m benchmarks.rendering --sizes 200,640 --output results.json
+"""
+
+
+from argparse import ArgumentParser
+from itertools import cycle
+from json import dumps
+from tempfile import TemporaryDirectory
+from timeit import repeat
+from PIL import Image, ImageDraw
+
+from benchmarks.cycle import FONT_FILE, git_revision
+from benchmarks.fakes import icon_png
+from src.schemas import AvatarLayout
+from src.services import IconStore
+from src.services.render_plan import RenderPlan, _load_font
+
+
+# Drawn values: icon, temperature and humidity with wind speed
+VALUES = [
+    ("01d", f"{sign}{temp} C", f"{humidity}%   {wind} m/c")
+    for sign, temp, humidity, wind in (
+        ("+", 23, 46, 0.67), ("-", 7, 81, 3.1), ("+", 0, 100, 12.5),
+        ("-", 31, 5, 0.0), ("+", 14, 63, 7.25),
+    )
+]
+
+
+def draw_overlay(layout: AvatarLayout, icons: IconStore, values: tuple[str, str, str]):
+    """ Renders overlay the way generator did before render plans. """
+
+    icon_name, temperature, details = values
+    overlay = Image.new("RGBA", (layout.size, layout.size), (255, 255, 255, 0))
+    canvas = ImageDraw.Draw(overlay)
+    icon = icons.get(icon_name)
+    side = layout.icon.size
+    if icon.size != (side, side):
+        icon = icon.resize((side, side), Image.Resampling.LANCZOS)
+    overlay.paste(im=icon, box=(layout.icon.x, layout.icon.y), mask=icon)
+    for element, text in ((layout.temperature, temperature), (layout.details, details)):
+        canvas.text(
+            xy=(element.x, element.y),
+            text=text,
+            font=_load_font(FONT_FILE, element.font_size),
+            fill=(255, 255, 255),
+        )
+    return overlay
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="200,640", help="avatar sizes (px)")
+    parser.add_argument("--number", type=int, default=500, help="renders per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    with TemporaryDirectory() as icons_folder:
+        icons = IconStore(icons_folder)
+        icons.save("01d", icon_png())
+        for size in (int(s) for s in args.sizes.split(",")):
+            layout = AvatarLayout().scaled(size)
+
+            def plan_miss(values=cycle(VALUES)):
+                # Every render misses overlay cache, glyphs are cached
+                plan = RenderPlan(layout, FONT_FILE, icons, transparent=True, cache_size=0)
+                return lambda: plan.overlay(*next(values))
+
+            plan_hit = RenderPlan(layout, FONT_FILE, icons, transparent=True)
+            values = cycle(VALUES)
+            renderers = {
+                "imagedraw": lambda: draw_overlay(layout, icons, next(values)),
+                "plan_miss": plan_miss(),
+                "plan_hit": lambda: plan_hit.overlay(*next(values)),
+            }
+            baseline = None
+            for name, render in renderers.items():
+                best = min(repeat(render, number=args.number, repeat=args.repeat))
+                per_render = best / args.number
+                baseline = baseline or per_render
+                results.append({
+                    "size": size,
+                    "renderer": name,
+                    "us_per_overlay": round(per_render * 1e6, 2),
+                    "speedup": round(baseline / per_render, 2),
+                })
+    report = dumps({"revision": git_revision(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+
+    main()
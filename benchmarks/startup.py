@@ -0,0 +1,157 @@
+"""
+Benchmark of application cold start: every scenario imports the
+application and creates avatar generator in a fresh interpreter started
+with "-X importtime", import time is broken down by top-level package.
+Results are printed (or written to file) as JSON, with --baseline they
+are compared to saved ones and the exit code is 1 on regression.
+
+Usage:
+    python -m benchmarks.startup --repeat 5 --output startup.json
+    python -m benchmarks.startup --baseline benchmarks/startup_baseline.json
+"""
+
+
+import os
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from json import dumps, load
+from statistics import median
+from subprocess import run
+from tempfile import TemporaryDirectory
+
+from benchmarks.cycle import ROOT, git_revision
+
+
+# Code of measured start: import of entry point and generator creation
+SNIPPET = """
+from time import perf_counter
+started_at = perf_counter()
+import src.__main__
+from src.config import ApplicationConfig
+from src.services import AvatarGenerator
+AvatarGenerator(
+    font_file=ApplicationConfig.FONT_FILE_NAME,
+    image_folder={icons!r},
+    bg_gif=ApplicationConfig.BG_GIF_PATH or None,
+)
+print((perf_counter() - started_at) * 1000)
+"""
+
+# Modules which static avatars don't need
+WATCHLIST = (
+    "aiohttp.web",
+    "concurrent.futures.process",
+    "moviepy",
+    "src.services.background_frames",
+    "src.services.compositor",
+    "src.services.video_encoder",
+)
+
+SCENARIOS = {
+    "static": {"BG_GIF_PATH": ""},
+    "animated": {"BG_GIF_PATH": "src/data/bg_gif.gif"},
+}
+
+
+def parse_importtime(output: str) -> tuple[dict[str, float], set[str]]:
+    """
+    Parses "-X importtime" output.
+    Returns:
+        Self import time (milliseconds) by top-level package and names of
+        imported modules.
+    """
+
+    by_package = defaultdict(float)
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        modules.add(name)
+        by_package[name.split(".")[0]] += int(self_us) / 1000
+    return by_package, modules
+
+
+def measure(scenario: str, repeat: int, icons: str) -> dict:
+    """ Starts scenario several times and returns median results. """
+
+    env = dict(os.environ, **SCENARIOS[scenario])
+    totals, imports, packages = [], [], defaultdict(list)
+    modules = set()
+    for _ in range(repeat):
+        result = run(
+            [sys.executable, "-X", "importtime", "-c", SNIPPET.format(icons=icons)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+        by_package, modules = parse_importtime(result.stderr)
+        totals.append(float(result.stdout.split()[-1]))
+        imports.append(sum(by_package.values()))
+        for package, duration in by_package.items():
+            packages[package].append(duration)
+    top = sorted(packages.items(), key=lambda item: -median(item[1]))[:15]
+    return {
+        "scenario": scenario,
+        "total_ms": round(median(totals), 1),
+        "import_ms": round(median(imports), 1),
+        "modules": len(modules),
+        "packages_ms": {name: round(median(values), 1) for name, values in top},
+        "watchlist": sorted(name for name in WATCHLIST if name in modules),
+    }
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """ Returns regressions of results against baseline. """
+
+    regressions = []
+    saved = {item["scenario"]: item for item in baseline["results"]}
+    for item in results:
+        base = saved.get(item["scenario"])
+        if base is None:
+            continue
+        if item["total_ms"] > base["total_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{item['scenario']}: total {item['total_ms']} ms, "
+                f"baseline {base['total_ms']} ms"
+            )
+        for name in set(item["watchlist"]) - set(base["watchlist"]):
+            regressions.append(f"{item['scenario']}: {name} is imported at start")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    parser.add_argument("--baseline", help="JSON file to compare results with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="allowed relative growth of start time",
+    )
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as icons:
+        results = [
+            measure(scenario, args.repeat, icons)
+            for scenario in args.scenarios.split(",")
+        ]
+    report = dumps({"revision": git_revision(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -1,17 +1,57 @@
-from aiohttp import ClientSession
-from asyncio import Future
+import os
+from argparse import ArgumentParser, Namespace
+from asyncio import gather
+from logging import getLevelName
 from socks import SOCKS5
 from telethon import TelegramClient
+from typing import TYPE_CHECKING
 from uvloop import run
 
 from src.application import Application
 from src.config import ApplicationConfig
-from src.schemas import ApplicationContext
-from src.services import AvatarGenerator, OpenWeatherMapAPI
-from src.utils import CustomJSONLogger
+from src.schemas import (
+    AccountConfig, AccountContext, AccountsConfig, ApplicationContext,
+    AvatarLayout,
+)
+from src.services import (
+    AvatarGenerator, IconStore, OpenWeatherMapAPI, PrerenderCache, Prerenderer,
+    WeatherCache,
+)
+from src.utils import (
+    CircuitBreaker, CustomJSONLogger, LoopLagMonitor, Metrics, MetricsServer,
+    RetryPolicy, StateStore, Supervisor, create_client_session,
+    socks5_proxy_url,
+)
 
+if TYPE_CHECKING:
+    from src.services import VideoEncoder
 
-async def create_context() -> ApplicationContext:
+
+def create_video_encoder() -> "VideoEncoder":
+    # Video modules are loaded only for animated avatars
+    from src.services import VideoEncoder
+
+    return VideoEncoder(
+        ffmpeg_binary=ApplicationConfig.FFMPEG_BINARY or None,
+        profile=ApplicationConfig.VIDEO_PROFILE,
+        target_bytes=ApplicationConfig.VIDEO_TARGET_BYTES,
+        max_encode_time=ApplicationConfig.VIDEO_MAX_ENCODE_TIME,
+        max_duration=ApplicationConfig.VIDEO_MAX_DURATION,
+    )
+
+
+def load_layout() -> AvatarLayout | None:
+    # Avatar layout from file (the default one if not set)
+    if not ApplicationConfig.AVATAR_LAYOUT_PATH:
+        return None
+    return AvatarLayout.from_file(ApplicationConfig.AVATAR_LAYOUT_PATH)
+
+
+def create_account_context(
+        account: AccountConfig,
+        icon_store: IconStore,
+        layout: AvatarLayout | None = None,
+) -> AccountContext:
     # Creating an instance of TelegramClient class
     if not all((
             ApplicationConfig.PROXY_IP,
@@ -29,20 +69,84 @@ async def create_context() -> ApplicationContext:
             ApplicationConfig.PROXY_PASS,
         )
     client = TelegramClient(
-        'TG_Avatar',  # Session name
+        account.session,                               # Session name
         api_id=ApplicationConfig.TELEGRAM_API_ID,      # Telegram API ID
         api_hash=ApplicationConfig.TELEGRAM_API_HASH,  # Telegram API hash
         proxy=proxy,                                   # Proxy data
     )
-    # Create Logger
-    logger = CustomJSONLogger(name="tg_avatar")
     # Create avatar generator instance
     avatar_generator = AvatarGenerator(
-        font_file=ApplicationConfig.FONT_FILE_NAME,
+        font_file=account.font_file,
         image_folder=ApplicationConfig.WEATHER_ICONS_FOLDER_NAME,
-        text_color=ApplicationConfig.TEXT_COLOR,
-        bg_color=ApplicationConfig.BACKGROUND_COLOR,
-        bg_gif=ApplicationConfig.BG_GIF_PATH,
+        text_color=account.text_color,
+        bg_color=account.bg_color,
+        bg_gif=account.bg_gif,
+        video_encoder=create_video_encoder() if account.bg_gif else None,
+        render_executor=ApplicationConfig.RENDER_EXECUTOR,
+        render_workers=ApplicationConfig.RENDER_WORKERS,
+        render_queue_size=ApplicationConfig.RENDER_QUEUE_SIZE,
+        icon_store=icon_store,
+        compositor=ApplicationConfig.COMPOSITOR,
+        bg_gif_streaming=ApplicationConfig.BG_GIF_STREAMING,
+        bg_gif_max_frames=ApplicationConfig.BG_GIF_MAX_FRAMES,
+        bg_gif_max_duration=ApplicationConfig.BG_GIF_MAX_DURATION,
+        layout=layout,
+        avatar_size=ApplicationConfig.AVATAR_SIZE,
+        overlay_cache_size=ApplicationConfig.OVERLAY_CACHE_SIZE,
+    )
+    return AccountContext(
+        name=account.name,
+        city_id=account.city_id,
+        phone=account.phone,
+        password=account.password,
+        tg_client=client,
+        avatar_generator=avatar_generator,
+    )
+
+
+def get_http_proxy_url() -> str | None:
+    # Reuse Telegram proxy settings if necessary
+    if ApplicationConfig.OPENWEATHER_PROXY != "telegram":
+        return ApplicationConfig.OPENWEATHER_PROXY or None
+    if not all((ApplicationConfig.PROXY_IP, ApplicationConfig.PROXY_PORT)):
+        return None
+    return socks5_proxy_url(
+        ApplicationConfig.PROXY_IP,
+        ApplicationConfig.PROXY_PORT,
+        ApplicationConfig.PROXY_PASS,
+        ApplicationConfig.PROXY_PASS,
+    )
+
+
+async def create_context() -> ApplicationContext:
+    # Load accounts (single account from env if config file isn't set)
+    accounts_config = AccountsConfig.load()
+    # Create Logger
+    logger = CustomJSONLogger(
+        name="tg_avatar",
+        level=getLevelName(ApplicationConfig.LOG_LEVEL),
+        queue_size=ApplicationConfig.LOG_QUEUE_SIZE,
+        serializer=ApplicationConfig.LOG_SERIALIZER,
+    )
+    # Load application state
+    state = StateStore(ApplicationConfig.STATE_FILE_PATH)
+    # Create per-stage metrics
+    metrics = Metrics(logger)
+    # Create weather icons store shared by all services
+    icon_store = IconStore(
+        folder=ApplicationConfig.WEATHER_ICONS_FOLDER_NAME,
+        capacity=ApplicationConfig.WEATHER_ICONS_CACHE_SIZE,
+    )
+    # Create pooled HTTP session (closed on teardown)
+    http_session = create_client_session(
+        limit=ApplicationConfig.HTTP_LIMIT,
+        limit_per_host=ApplicationConfig.HTTP_LIMIT_PER_HOST,
+        dns_cache_ttl=ApplicationConfig.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=ApplicationConfig.HTTP_KEEPALIVE_TIMEOUT,
+        connect_timeout=ApplicationConfig.HTTP_CONNECT_TIMEOUT,
+        proxy_url=get_http_proxy_url(),
+        metrics=metrics,
+        logger=logger,
     )
     # Create service for OpenWeatherMap API calls
     open_weather_map = OpenWeatherMapAPI(
@@ -52,14 +156,74 @@ async def create_context() -> ApplicationContext:
         cache_folder_path=ApplicationConfig.WEATHER_ICONS_FOLDER_NAME,
         city_id=ApplicationConfig.OPENWEATHER_API_CITYID,
         logger=logger,
-        client_session=ClientSession(),
+        client_session=http_session,
+        group_api_url=ApplicationConfig.OPENWEATHER_API_GROUP_URL or None,
+        forecast_api_url=ApplicationConfig.OPENWEATHER_API_FORECAST_URL or None,
+        icon_store=icon_store,
+        cache=WeatherCache(
+            state=state,
+            logger=logger,
+            ttl=ApplicationConfig.OPENWEATHER_CACHE_TTL,
+        ) if ApplicationConfig.OPENWEATHER_CACHE_TTL > 0 else None,
+        metrics=metrics,
+        retry_policy=RetryPolicy(
+            attempts=ApplicationConfig.OPENWEATHER_RETRY_ATTEMPTS,
+            base_delay=ApplicationConfig.OPENWEATHER_RETRY_BASE_DELAY,
+            max_delay=ApplicationConfig.OPENWEATHER_RETRY_MAX_DELAY,
+            deadline=ApplicationConfig.OPENWEATHER_DEADLINE,
+            request_timeout=ApplicationConfig.OPENWEATHER_REQUEST_TIMEOUT,
+            logger=logger,
+            metrics=metrics,
+        ),
+        circuit_breaker=CircuitBreaker(
+            name="openweathermap",
+            failure_threshold=ApplicationConfig.OPENWEATHER_CIRCUIT_FAILURES,
+            reset_timeout=ApplicationConfig.OPENWEATHER_CIRCUIT_RESET,
+            logger=logger,
+            metrics=metrics,
+        ),
     )
+    # Create supervisor of background tasks (its health is served with metrics)
+    supervisor = Supervisor(
+        logger=logger,
+        metrics=metrics,
+        max_restarts=ApplicationConfig.SUPERVISOR_MAX_RESTARTS,
+        max_staleness=ApplicationConfig.HEALTH_MAX_STALENESS,
+    )
+    layout = load_layout()
+    accounts = [
+        create_account_context(account, icon_store, layout)
+        for account in accounts_config.accounts
+    ]
     return ApplicationContext(
-        avatar_generator=avatar_generator,
+        accounts=accounts,
         open_weather_map=open_weather_map,
-        tg_client=client,
         config=ApplicationConfig,
         logger=logger,
+        state=state,
+        metrics=metrics,
+        accounts_concurrency=accounts_config.concurrency,
+        loop_lag_monitor=LoopLagMonitor(
+            logger=logger,
+            interval=ApplicationConfig.LOOP_LAG_PROBE_INTERVAL,
+            metrics=metrics,
+        ) if ApplicationConfig.LOOP_LAG_PROBE_INTERVAL > 0 else None,
+        metrics_server=MetricsServer(
+            metrics=metrics,
+            host=ApplicationConfig.METRICS_HOST,
+            port=ApplicationConfig.METRICS_PORT,
+            health=supervisor.health,
+        ) if ApplicationConfig.METRICS_PORT > 0 else None,
+        http_session=http_session,
+        prerenderer=Prerenderer(
+            open_weather_map=open_weather_map,
+            accounts=accounts,
+            logger=logger,
+            metrics=metrics,
+            cache=PrerenderCache(ApplicationConfig.PRERENDER_CACHE_SIZE),
+            horizon=ApplicationConfig.PRERENDER_HORIZON,
+        ) if ApplicationConfig.PRERENDER else None,
+        supervisor=supervisor,
     )
 
 
@@ -68,11 +232,140 @@ async def main():
     application = Application(context)
     try:
         await application.setup()
-        await Future()
+        # Runs until supervised tasks fail too many times in a row
+        await application.supervisor.wait()
+    finally:
+        await application.teardown()
+        context.logger.close()
+
+
+async def cleanup(all_but_current: bool):
+    context = await create_context()
+    application = Application(context)
+    try:
+        await application.cleanup(all_but_current)
+    finally:
+        await application.teardown()
+        context.logger.close()
+
+
+async def fetch_weather_icons(names: list[str], logger: CustomJSONLogger):
+    # Icons are downloaded once in the main process before workers start
+    os.makedirs(ApplicationConfig.WEATHER_ICONS_FOLDER_NAME, exist_ok=True)
+    http_session = create_client_session(proxy_url=get_http_proxy_url(), logger=logger)
+    try:
+        open_weather_map = OpenWeatherMapAPI(
+            api_token=ApplicationConfig.OPENWEATHER_API_KEY,
+            api_url=ApplicationConfig.OPENWEATHER_API_URL,
+            image_url_template=ApplicationConfig.OPENWEATHER_API_IMAGE_URL,
+            cache_folder_path=ApplicationConfig.WEATHER_ICONS_FOLDER_NAME,
+            city_id=ApplicationConfig.OPENWEATHER_API_CITYID,
+            logger=logger,
+            client_session=http_session,
+        )
+        await gather(*(open_weather_map.get_weather_image(name) for name in names))
+    finally:
+        await http_session.close()
+
+
+def render_batch(args: Namespace):
+    from src.services import BatchRenderer
+
+    logger = CustomJSONLogger(
+        name="tg_avatar",
+        level=getLevelName(ApplicationConfig.LOG_LEVEL),
+        serializer=ApplicationConfig.LOG_SERIALIZER,
+    )
+    renderer = BatchRenderer(
+        generator_kwargs={
+            "font_file": args.font_file,
+            "image_folder": ApplicationConfig.WEATHER_ICONS_FOLDER_NAME,
+            "text_color": args.text_color,
+            "bg_color": args.bg_color,
+            "bg_gif": args.bg_gif or None,
+            "video_encoder": create_video_encoder() if args.bg_gif else None,
+            "compositor": ApplicationConfig.COMPOSITOR,
+            "bg_gif_streaming": ApplicationConfig.BG_GIF_STREAMING,
+            "bg_gif_max_frames": ApplicationConfig.BG_GIF_MAX_FRAMES,
+            "bg_gif_max_duration": ApplicationConfig.BG_GIF_MAX_DURATION,
+            "layout": load_layout(),
+            "avatar_size": args.size,
+            "overlay_cache_size": ApplicationConfig.OVERLAY_CACHE_SIZE,
+        },
+        logger=logger,
+        workers=args.workers,
+        fetch_icons=lambda names: run(fetch_weather_icons(names, logger)),
+    )
+    try:
+        renderer.run(args.input, args.output)
     finally:
-        application.teardown()
+        logger.close()
+
+
+def parse_color(value: str) -> tuple[int, int, int]:
+    return tuple(int(n) for n in value.split(","))
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(
+        prog="python -m src",
+        description="Updates Telegram avatar with current weather.",
+    )
+    commands = parser.add_subparsers(dest="command")
+    cleanup_parser = commands.add_parser(
+        "cleanup",
+        help="delete generated profile photos left after failed deletions",
+    )
+    cleanup_parser.add_argument(
+        "--all-but-current",
+        action="store_true",
+        help="delete all profile photos except the current one",
+    )
+    batch_parser = commands.add_parser(
+        "render-batch",
+        help="render avatars from recorded OpenWeatherMap responses",
+    )
+    batch_parser.add_argument(
+        "input",
+        help="JSONL file with one current weather response per line",
+    )
+    batch_parser.add_argument(
+        "--output",
+        default="renders",
+        help="folder where directory of the run is created",
+    )
+    batch_parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of worker processes (number of CPUs by default)",
+    )
+    batch_parser.add_argument("--font-file", default=ApplicationConfig.FONT_FILE_NAME)
+    batch_parser.add_argument(
+        "--size",
+        type=int,
+        default=ApplicationConfig.AVATAR_SIZE,
+        help="side of avatars in pixels (0 - size of layout)",
+    )
+    batch_parser.add_argument(
+        "--bg-gif",
+        default=ApplicationConfig.BG_GIF_PATH,
+        help="background GIF (empty - static PNG avatars)",
+    )
+    batch_parser.add_argument(
+        "--text-color", type=parse_color, default=ApplicationConfig.TEXT_COLOR,
+    )
+    batch_parser.add_argument(
+        "--bg-color", type=parse_color, default=ApplicationConfig.BACKGROUND_COLOR,
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
 
-    run(main())
+    args = parse_args()
+    if args.command == "cleanup":
+        run(cleanup(args.all_but_current))
+    elif args.command == "render-batch":
+        render_batch(args)
+    else:
+        run(main())
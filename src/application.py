@@ -1,62 +1,470 @@
 import os
-from asyncio import sleep as aio_sleep, Task, create_task
+from asyncio import Semaphore, gather, wait_for
+from contextlib import nullcontext
 from telethon.tl.functions.photos import (
     UploadProfilePhotoRequest, DeletePhotosRequest
 )
+from telethon.tl.types import InputPhoto, Photo
+from telethon.utils import get_appropriated_part_size
 from traceback import format_exception
 from sys import exc_info
+from typing import Awaitable, TypeVar
+from functools import partial
+from math import ceil
+from time import perf_counter
+from zlib import crc32
 
 from src.config import ApplicationConfig
 from src.exceptions import OpenWeatherMapAPIError
-from src.schemas import ApplicationContext
+from src.schemas import AccountContext, ApplicationContext, OpenWeatherMapRenderData
+from src.services import AvatarUpdateQueue, OwnedPhotos
+from src.services.owned_photos import DELETE_BATCH_SIZE
+from src.utils import ScheduledJob, Scheduler, Supervisor
+
+
+T = TypeVar("T")
 
 
 class Application:
 
     def __init__(self,context: ApplicationContext):
         self.context = context
-        self.task: Task | None = None
+        self.skipped_cycles = 0
+        # Start of the current update cycle (perf_counter)
+        self.tick_started_at: float | None = None
+        # The latest weather observation time (UNIX timestamp)
+        self.observed_at: int | None = None
+        # The first cycle renders persisted weather before fetching
+        self._warm_started = False
+        config = context.config
+        self.supervisor = context.supervisor or Supervisor(
+            logger=context.logger,
+            metrics=context.metrics,
+            max_restarts=config.SUPERVISOR_MAX_RESTARTS,
+            max_staleness=config.HEALTH_MAX_STALENESS,
+        )
+        # Scheduler loop beats, so that watchdog notices if it hangs
+        self.scheduler = Scheduler(
+            logger=context.logger,
+            metrics=context.metrics,
+            heartbeat=partial(self.supervisor.beat, "scheduler"),
+            heartbeat_interval=config.WATCHDOG_TIMEOUT / 4,
+        )
+        self._updates_limit = Semaphore(context.accounts_concurrency)
+        # Profile photos uploaded by the application
+        self.owned_photos = {
+            account.name: OwnedPhotos(context.state, account.name)
+            for account in context.accounts
+        }
+        # Avatar updates of every account go through its own queue
+        self.update_queues = {
+            account.name: AvatarUpdateQueue(
+                name=account.name,
+                update=partial(self.update_account, account),
+                logger=context.logger,
+                metrics=context.metrics,
+                calls=account.telegram_calls,
+                max_attempts=context.config.TELEGRAM_UPDATE_ATTEMPTS,
+                calls_per_hour=context.config.TELEGRAM_CALLS_PER_HOUR,
+            )
+            for account in context.accounts
+        }
+
+    async def update_account(
+            self,
+            account: AccountContext,
+            weather: OpenWeatherMapRenderData,
+    ):
+        """
+        Updates avatar of one account if it would change.
+        Args:
+            account: account context.
+            weather: current weather in account's city.
+        """
+
+        # Skip update if avatar wouldn't change
+        state_key = f"render_key:{account.name}"
+        render_key = account.avatar_generator.render_key(weather)
+        if render_key == self.context.state.get(state_key):
+            self.skipped_cycles += 1
+            self.context.metrics.skipped_cycles.inc(account=account.name)
+            self.context.logger.info({
+                "event": "skip_update",
+                "account": account.name,
+                "render_key": render_key,
+                "skipped_cycles": self.skipped_cycles,
+            })
+            # The last known weather served during outage doesn't prove
+            # avatar is up to date
+            if not weather.is_stale:
+                self.supervisor.success(account.name)
+            return
+        metrics = self.context.metrics
+        generator = account.avatar_generator
+        tg_client = account.tg_client
+        prerenderer = self.context.prerenderer
+        # Pre-rendering waits while avatar is updated
+        pause = prerenderer.pause() if prerenderer else nullcontext()
+        async with self._updates_limit:
+            with metrics.span("update", account=account.name), pause:
+                timings, encoding = {}, {}
+                prerendered = self._get_prerendered(account, render_key)
+                if prerendered is not None:
+                    # Avatar has been rendered beforehand, only upload it
+                    avatar, encoding = prerendered
+                else:
+                    with metrics.span("render", account=account.name) as span:
+                        avatar = await self._with_timeout(
+                            generator.generate_async(weather, timings, encoding),
+                            self.context.config.RENDER_TIMEOUT,
+                        )
+                        span.bytes = len(avatar)
+                    for stage in ("composite", "encode"):
+                        metrics.record(stage, timings[stage], account=account.name)
+                if encoding:
+                    self.context.logger.info({
+                        "event": "video_encoding",
+                        "account": account.name,
+                        **encoding,
+                    })
+                # Avatar is uploaded from memory (one call per part)
+                part_size = get_appropriated_part_size(len(avatar)) * 1024
+                new = await self._telegram_call(
+                    "upload", account,
+                    tg_client.upload_file(avatar, file_name=generator.file_name),
+                    calls=ceil(len(avatar) / part_size),
+                    size=len(avatar),
+                )
+                # Setting new avatar and deleting leftovers of ours
+                # (independent requests); the current photo is deleted only
+                # once the new one is set, so failed update keeps avatar
+                owned = self.owned_photos[account.name]
+                previous = owned.current
+                leftovers = owned.to_delete()
+                key = "video" if generator.is_animated else "file"
+                requests = [self._telegram_call(
+                    "set_photo", account,
+                    tg_client(UploadProfilePhotoRequest(**{key: new})),
+                )]
+                if leftovers:
+                    requests.append(self._delete_photos(account, leftovers))
+                result, *batches = await gather(*requests, return_exceptions=True)
+                deleted = [
+                    photo for batch in batches if isinstance(batch, list) for photo in batch
+                ]
+                if isinstance(result, BaseException):
+                    owned.replace(photo=None, deleted=deleted)
+                    raise result
+                if previous is not None:
+                    deleted += await self._delete_photos(account, [previous])
+                owned.replace(
+                    photo=result.photo if isinstance(result.photo, Photo) else None,
+                    deleted=deleted,
+                )
+        self.context.state.set(state_key, render_key)
+        if not weather.is_stale:
+            self.supervisor.success(account.name)
+        if self.tick_started_at is not None:
+            latency = perf_counter() - self.tick_started_at
+            metrics.tick_latency.observe(
+                latency,
+                account=account.name,
+                prerendered=str(prerendered is not None).lower(),
+            )
+            self.context.logger.info({
+                "event": "tick_latency",
+                "account": account.name,
+                "latency_ms": round(latency * 1000, 3),
+                "prerendered": prerendered is not None,
+            })
+
+    async def _delete_photos(
+            self,
+            account: AccountContext,
+            photos: list[InputPhoto],
+    ) -> list[InputPhoto]:
+        """
+        Deletes profile photos of account, failure is only logged (photos
+        are deleted next time or by cleanup).
+        Returns:
+            Deleted photos (empty if deletion has failed).
+        """
+
+        try:
+            await self._telegram_call(
+                "delete_photos", account,
+                account.tg_client(DeletePhotosRequest(photos)),
+            )
+        except Exception as e:
+            self.context.logger.warning({
+                "event": "delete_photos_failed",
+                "account": account.name,
+                "photo_ids": [photo.id for photo in photos],
+                "error": str(e) or type(e).__name__,
+            })
+            return []
+        return photos
+
+    def _get_prerendered(
+            self,
+            account: AccountContext,
+            render_key: str,
+    ) -> tuple[bytes, dict] | None:
+        """ Returns pre-rendered avatar and its encoding (if any). """
+
+        prerenderer = self.context.prerenderer
+        if prerenderer is None:
+            return None
+        cache = prerenderer.cache
+        prerendered = cache.get(render_key)
+        hit = prerendered is not None
+        self.context.metrics.prerender_lookups.inc(
+            account=account.name, result="hit" if hit else "miss",
+        )
+        self.context.logger.info({
+            "event": "prerender_lookup",
+            "account": account.name,
+            "hit": hit,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_rate": round(cache.hit_rate, 3),
+        })
+        return prerendered
+
+    async def cleanup(self, all_but_current: bool = False):
+        """
+        Deletes profile photos which have been uploaded by the application,
+        but haven't been deleted (except current ones).
+        Args:
+            all_but_current: delete all profile photos except current one
+                (including photos uploaded before photos were tracked and
+                by the user).
+        """
+
+        for account in self.context.accounts:
+            await account.tg_client.start(
+                phone=lambda: account.phone,
+                password=lambda: account.password,
+            )
+            await self._cleanup_account(account, all_but_current)
+            await account.tg_client.disconnect()
+
+    async def cleanup_leftovers(self):
+        """ Deletes leftover photos of all accounts (periodic job). """
+
+        for account in self.context.accounts:
+            if self.owned_photos[account.name].leftovers:
+                await self._cleanup_account(account)
+
+    async def _cleanup_account(self, account: AccountContext, all_but_current: bool = False):
+        """ Deletes leftover (or all but current) photos of started account. """
+
+        owned = self.owned_photos[account.name]
+        # Listing gives fresh file references
+        photos = await self._telegram_call(
+            "get_photos", account,
+            account.tg_client.get_profile_photos("me"),
+        )
+        if all_but_current:
+            to_delete = photos[1:]
+        else:
+            leftover_ids = {photo.id for photo in owned.leftovers}
+            to_delete = [photo for photo in photos if photo.id in leftover_ids]
+        for i in range(0, len(to_delete), DELETE_BATCH_SIZE):
+            batch = to_delete[i:i + DELETE_BATCH_SIZE]
+            await self._telegram_call(
+                "delete_photos", account,
+                account.tg_client(DeletePhotosRequest(batch)),
+            )
+            owned.forget({photo.id for photo in batch})
+        # Leftovers which are already gone aren't tracked anymore
+        owned.forget({photo.id for photo in owned.leftovers})
+        self.context.logger.info({
+            "event": "cleanup",
+            "account": account.name,
+            "deleted": len(to_delete),
+            "profile_photos": len(photos),
+        })
+
+    async def _telegram_call(
+            self,
+            stage: str,
+            account: AccountContext,
+            coro: Awaitable[T],
+            calls: int = 1,
+            size: int | None = None,
+    ) -> T:
+        """
+        Awaits Telegram API call measuring it as stage of account update.
+        Args:
+            stage: stage name.
+            account: account context.
+            coro: coroutine which makes the call.
+            calls: number of API requests the call makes.
+            size: bytes transferred by the call (if any).
+        """
+
+        account.telegram_calls.add(calls)
+        self.context.metrics.telegram_calls.inc(calls, account=account.name, method=stage)
+        with self.context.metrics.span(
+                stage,
+                account=account.name,
+                calls_last_hour=account.telegram_calls.count(),
+        ) as span:
+            span.bytes = size
+            return await self._with_timeout(coro, self.context.config.TELEGRAM_CALL_TIMEOUT)
 
-    async def main_task(self):
-        while True:
+    @staticmethod
+    async def _with_timeout(coro: Awaitable[T], timeout: float) -> T:
+        """
+        Awaits coroutine within timeout.
+        Args:
+            coro: awaited coroutine.
+            timeout: timeout in seconds (0 - none).
+        Raises:
+            TimeoutError: if coroutine hasn't finished in time.
+        """
+
+        if timeout <= 0:
+            return await coro
+        return await wait_for(coro, timeout)
+
+    async def update_cycle(self):
+        """
+        Requests weather for all cities and queues avatar updates
+        (periodic job).
+        """
+
+        accounts = self.context.accounts
+        self.context.metrics.new_cycle()
+        self.tick_started_at = perf_counter()
+        open_weather_map = self.context.open_weather_map
+        # After restart avatars are rendered from persisted weather right
+        # away, the current one replaces it in queues once it is fetched
+        if not self._warm_started:
+            self._warm_started = True
+            last_known = open_weather_map.get_last_known(
+                account.city_id for account in accounts
+            )
+            if last_known is not None:
+                for account in accounts:
+                    self.update_queues[account.name].submit(last_known[account.city_id])
+        # Request weather data for all cities (icons load inside)
+        with self.context.metrics.span("weather_fetch"):
+            weather = await open_weather_map.get_weather_data_many(
+                account.city_id for account in accounts
+            )
+        self.observed_at = max(item.dt for item in weather.values())
+        # Queue updates, accounts are updated concurrently and stalled
+        # accounts (FloodWait) don't hold others
+        for account in accounts:
+            self.update_queues[account.name].submit(weather[account.city_id])
+
+    def _update_offset(self) -> float:
+        """
+        Returns offset of update ticks. Automatic offset is derived from
+        accounts (stable between restarts), so that instances with the
+        same schedule spread over the period instead of updating at once.
+        """
+
+        config = self.context.config
+        if config.UPDATE_OFFSET != "auto":
+            return float(config.UPDATE_OFFSET)
+        identity = ",".join(sorted(
+            account.phone or account.name for account in self.context.accounts
+        ))
+        return crc32(identity.encode()) % 1000 / 1000 * config.UPDATE_INTERVAL
+
+    def schedule_jobs(self):
+        """ Adds periodic jobs of the application to scheduler. """
+
+        config = self.context.config
+        if config.UPDATE_ALIGN not in ("wall", "dt"):
+            raise ValueError(f"Unknown update alignment: {config.UPDATE_ALIGN}")
+        # Failed cycles (OpenWeatherMap errors and unexpected ones) are
+        # retried sooner
+        self.scheduler.add(ScheduledJob(
+            name="update",
+            func=self.update_cycle,
+            period=config.UPDATE_INTERVAL,
+            offset=self._update_offset(),
+            jitter=config.UPDATE_JITTER,
+            anchor=(lambda: self.observed_at) if config.UPDATE_ALIGN == "dt" else None,
+            retry_delay=config.UPDATE_RETRY_DELAY,
+            run_at_start=True,
+            timeout=config.JOB_TIMEOUT or None,
+        ))
+        if self.context.prerenderer is not None:
+            self.scheduler.add(ScheduledJob(
+                name="prerender",
+                func=self.context.prerenderer.refresh,
+                period=config.PRERENDER_INTERVAL,
+                jitter=config.UPDATE_JITTER,
+                run_at_start=True,
+                # Hung pre-rendering gives way to the next one
+                timeout=config.PRERENDER_INTERVAL,
+            ))
+        if config.CLEANUP_INTERVAL > 0:
+            self.scheduler.add(ScheduledJob(
+                name="cleanup",
+                func=self.cleanup_leftovers,
+                period=config.CLEANUP_INTERVAL,
+                jitter=config.UPDATE_JITTER,
+                timeout=config.JOB_TIMEOUT or None,
+            ))
+
+    async def setup(self):
+        self.context.logger.info({"event": "startup"})
+        # Create folder for weather images if not exists
+        if not os.path.exists(ApplicationConfig.WEATHER_ICONS_FOLDER_NAME):
+            os.mkdir(ApplicationConfig.WEATHER_ICONS_FOLDER_NAME)
+        # Download all weather icons beforehand if necessary
+        if self.context.config.PREFETCH_WEATHER_ICONS:
             try:
-                # Request weather data (icon loads inside)
-                weather = await self.context.open_weather_map.get_weather_data()
-                # Generate and upload new avatar
-                new_file_path = self.context.avatar_generator.generate(weather)
-                new = await self.context.tg_client.upload_file(new_file_path)
-                # Deleting Telegram avatar
-                current = await self.context.tg_client.get_profile_photos("me")
-                await self.context.tg_client(DeletePhotosRequest(current))
-                # Updating Telegram avatar
-                key = "video" if self.context.config.BG_GIF_PATH else "file"
-                await self.context.tg_client(UploadProfilePhotoRequest(**{key: new}))
+                await self.context.open_weather_map.prefetch_weather_images()
             except OpenWeatherMapAPIError as e:
                 self.context.logger.error({
                     "event": "error",
                     "error": str(e),
                     "traceback": format_exception(*exc_info()),
                 })
-                await aio_sleep(60)
-            else:
-                await aio_sleep(600)
-
-    async def setup(self):
-        self.context.logger.info({"event": "startup"})
-        # Create folder for weather images if not exists
-        if not os.path.exists(ApplicationConfig.WEATHER_ICONS_FOLDER_NAME):
-            os.mkdir(ApplicationConfig.WEATHER_ICONS_FOLDER_NAME)
-        # Start Telethon client
-        await self.context.tg_client.start(
-            phone=lambda: self.context.config.TELEGRAM_PHONE,
-            password=lambda: self.context.config.TELEGRAM_PASSWORD,
+        # Start Telethon clients (one by one as they may ask for login code)
+        for account in self.context.accounts:
+            await account.tg_client.start(
+                phone=lambda: account.phone,
+                password=lambda: account.password,
+            )
+        # Start metrics endpoint
+        if self.context.metrics_server is not None:
+            await self.context.metrics_server.start()
+        # Start event loop lag probe
+        if self.context.loop_lag_monitor is not None:
+            self.context.loop_lag_monitor.start()
+        # Start update queues and periodic jobs under supervision: they
+        # are restarted if they fail, scheduler also if its heartbeat stops
+        for account in self.context.accounts:
+            self.supervisor.expect(account.name)
+        for name, queue in self.update_queues.items():
+            self.supervisor.add(f"update_queue:{name}", queue.run)
+        self.schedule_jobs()
+        self.supervisor.add(
+            "scheduler",
+            self.scheduler.run,
+            stall_timeout=self.context.config.WATCHDOG_TIMEOUT,
         )
-        # Start background task
-        self.task = create_task(self.main_task())
+        self.supervisor.start()
         self.context.logger.info({"event": "startup complete"})
 
-    def teardown(self):
+    async def teardown(self):
         self.context.logger.info({"event": "teardown"})
-        if self.task is not None:
-            self.task.cancel()
+        self.supervisor.stop()
+        self.scheduler.stop()
+        for account in self.context.accounts:
+            account.avatar_generator.shutdown()
+        if self.context.loop_lag_monitor is not None:
+            self.context.loop_lag_monitor.stop()
+        if self.context.metrics_server is not None:
+            await self.context.metrics_server.stop()
+        if self.context.http_session is not None:
+            await self.context.http_session.close()
         self.context.logger.info({"event": "teardown complete"})
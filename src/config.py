@@ -7,12 +7,27 @@ class ApplicationConfig:
 
     # A folder name where weather icons will be collecting.
     WEATHER_ICONS_FOLDER_NAME = environ.get("WEATHER_ICONS_FOLDER_NAME", "cache")
+    # How many decoded weather icons are kept in memory.
+    WEATHER_ICONS_CACHE_SIZE: int = int(environ.get("WEATHER_ICONS_CACHE_SIZE", "18"))
+    # Download all known weather icons at startup.
+    PREFETCH_WEATHER_ICONS: bool = environ.get("PREFETCH_WEATHER_ICONS", "") == "1"
+    # A file where application state is kept between restarts.
+    STATE_FILE_PATH = environ.get("STATE_FILE_PATH", "tg_avatar_state.json")
+    # JSON file with accounts (keep it empty to use single account from env)
+    ACCOUNTS_CONFIG_PATH = environ.get("ACCOUNTS_CONFIG_PATH", "")
 
     # Telegram API constants
     TELEGRAM_API_ID:    int = int(environ.get("TG_AVATAR_TELEGRAM_API_ID", "0"))
     TELEGRAM_API_HASH:  str = environ.get("TG_AVATAR_TELEGRAM_API_HASH", "")
     TELEGRAM_PHONE:     str = environ.get("TG_AVATAR_TELEGRAM_PHONE", "")
     TELEGRAM_PASSWORD:  str = environ.get("TG_AVATAR_TELEGRAM_PASSWORD", "")
+    # Attempts of avatar update on transient Telegram errors (FloodWait is
+    # waited out and not counted) and budget of API calls per account and
+    # hour (0 - unlimited)
+    TELEGRAM_UPDATE_ATTEMPTS:  int = int(environ.get("TG_AVATAR_TELEGRAM_UPDATE_ATTEMPTS", "3"))
+    TELEGRAM_CALLS_PER_HOUR:   int = int(environ.get("TG_AVATAR_TELEGRAM_CALLS_PER_HOUR", "60"))
+    # Timeout of one Telegram API call, e.g. upload (seconds, 0 - none)
+    TELEGRAM_CALL_TIMEOUT:     float = float(environ.get("TG_AVATAR_TELEGRAM_CALL_TIMEOUT", "120"))
 
     # Proxy data (keep it empty if not necessary)
     PROXY_IP:    str = environ.get("TG_AVATAR_PROXY_IP", "")
@@ -20,10 +35,40 @@ class ApplicationConfig:
     PROXY_PASS:  str = environ.get("TG_AVATAR_PROXY_PASSWORD", "")
 
     # OpenWeather API
-    OPENWEATHER_API_KEY:       str = environ.get("TG_AVATAR_OPENWEATHER_API_KEY", "")
-    OPENWEATHER_API_URL:       str = environ.get("TG_AVATAR_OPENWEATHER_API_URL", "http://api.openweathermap.org/data/2.5/weather")
-    OPENWEATHER_API_CITYID:    int = int(environ.get("TG_AVATAR_OPENWEATHER_API_CITY_ID", "524901"))
-    OPENWEATHER_API_IMAGE_URL: str = environ.get("TG_AVATAR_OPENWEATHER_API_IMAGE_URL", "http://openweathermap.org/img/wn/{}@2x.png")
+    OPENWEATHER_API_KEY:          str = environ.get("TG_AVATAR_OPENWEATHER_API_KEY", "")
+    OPENWEATHER_API_URL:          str = environ.get("TG_AVATAR_OPENWEATHER_API_URL", "http://api.openweathermap.org/data/2.5/weather")
+    OPENWEATHER_API_GROUP_URL:    str = environ.get("TG_AVATAR_OPENWEATHER_API_GROUP_URL", "http://api.openweathermap.org/data/2.5/group")
+    OPENWEATHER_API_CITYID:       int = int(environ.get("TG_AVATAR_OPENWEATHER_API_CITY_ID", "524901"))
+    OPENWEATHER_API_IMAGE_URL:    str = environ.get("TG_AVATAR_OPENWEATHER_API_IMAGE_URL", "http://openweathermap.org/img/wn/{}@2x.png")
+    OPENWEATHER_API_FORECAST_URL: str = environ.get("TG_AVATAR_OPENWEATHER_API_FORECAST_URL", "http://api.openweathermap.org/data/2.5/forecast")
+    # Cadence of OpenWeatherMap observations: observation is reused until a
+    # newer one can be published ('dt' + TTL seconds, 0 - disabled). With
+    # UPDATE_INTERVAL not shorter than TTL it only saves requests on retries;
+    # persisted observations are rendered at startup before fetching
+    OPENWEATHER_CACHE_TTL:        int = int(environ.get("TG_AVATAR_OPENWEATHER_CACHE_TTL", "600"))
+    # Retries: attempts, backoff before the second attempt (doubles, up to
+    # max), total time of one update and timeout of one request (seconds)
+    OPENWEATHER_RETRY_ATTEMPTS:    int = int(environ.get("TG_AVATAR_OPENWEATHER_RETRY_ATTEMPTS", "3"))
+    OPENWEATHER_RETRY_BASE_DELAY:  float = float(environ.get("TG_AVATAR_OPENWEATHER_RETRY_BASE_DELAY", "1"))
+    OPENWEATHER_RETRY_MAX_DELAY:   float = float(environ.get("TG_AVATAR_OPENWEATHER_RETRY_MAX_DELAY", "30"))
+    OPENWEATHER_DEADLINE:          float = float(environ.get("TG_AVATAR_OPENWEATHER_DEADLINE", "60"))
+    OPENWEATHER_REQUEST_TIMEOUT:   float = float(environ.get("TG_AVATAR_OPENWEATHER_REQUEST_TIMEOUT", "10"))
+    # Circuit breaker: failed attempts in a row which stop requests and
+    # for how long (seconds); the last known weather is served meanwhile
+    OPENWEATHER_CIRCUIT_FAILURES:  int = int(environ.get("TG_AVATAR_OPENWEATHER_CIRCUIT_FAILURES", "5"))
+    OPENWEATHER_CIRCUIT_RESET:     float = float(environ.get("TG_AVATAR_OPENWEATHER_CIRCUIT_RESET", "300"))
+
+    # HTTP connection pool of OpenWeatherMap requests: connections limit
+    # (total and per host), DNS cache TTL, how long idle connection is kept
+    # (should outlive interval between updates) and connect timeout (seconds)
+    HTTP_LIMIT:              int = int(environ.get("HTTP_LIMIT", "10"))
+    HTTP_LIMIT_PER_HOST:     int = int(environ.get("HTTP_LIMIT_PER_HOST", "4"))
+    HTTP_DNS_CACHE_TTL:      int = int(environ.get("HTTP_DNS_CACHE_TTL", "600"))
+    HTTP_KEEPALIVE_TIMEOUT:  float = float(environ.get("HTTP_KEEPALIVE_TIMEOUT", "630"))
+    HTTP_CONNECT_TIMEOUT:    float = float(environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+    # Proxy of OpenWeatherMap requests: empty - direct, "telegram" - the same
+    # proxy as Telegram, or proxy URL (socks5://..., http://...)
+    OPENWEATHER_PROXY: str = environ.get("TG_AVATAR_OPENWEATHER_PROXY", "")
 
     # Customization
     BACKGROUND_COLOR: tuple[int] = tuple([
@@ -36,3 +81,82 @@ class ApplicationConfig:
     ])
     FONT_FILE_NAME = environ.get("FONT_FILE_NAME", "src/data/OpenSans-Regular.ttf")
     BG_GIF_PATH = environ.get("BG_GIF_PATH", "src/data/bg_gif.gif")
+
+    # Avatar layout: JSON file (empty - the original 200x200 layout), side of
+    # avatar in pixels the layout is scaled to (0 - size of layout, Telegram
+    # shows profile photos up to 640x640) and how many rendered overlays
+    # (icon and texts) are kept in memory
+    AVATAR_LAYOUT_PATH:   str = environ.get("AVATAR_LAYOUT_PATH", "")
+    AVATAR_SIZE:          int = int(environ.get("AVATAR_SIZE", "0"))
+    OVERLAY_CACHE_SIZE:   int = int(environ.get("OVERLAY_CACHE_SIZE", "32"))
+
+    # Engine compositing overlay onto GIF frames ("pil", "numpy" or "auto" -
+    # NumPy if it is installed; NumPy keeps a second copy of frames)
+    COMPOSITOR: str = environ.get("COMPOSITOR", "pil")
+
+    # Background GIF: streaming (frames are decoded one by one on every
+    # generation instead of being kept in memory), maximum number of frames
+    # and maximum duration in milliseconds (0 - unlimited)
+    BG_GIF_STREAMING:     bool = environ.get("BG_GIF_STREAMING", "") == "1"
+    BG_GIF_MAX_FRAMES:    int = int(environ.get("BG_GIF_MAX_FRAMES", "0"))
+    BG_GIF_MAX_DURATION:  int = int(environ.get("BG_GIF_MAX_DURATION", "0"))
+
+    # Video encoding (ffmpeg is searched in PATH if not set)
+    FFMPEG_BINARY: str = environ.get("FFMPEG_BINARY", "")
+    # Encoding profile ("fast", "balanced", "small" or "auto" - the best one
+    # which fits target size and maximum encoding time in seconds, 0 -
+    # unlimited) and maximum video duration in milliseconds (Telegram
+    # accepts video avatars up to 10 seconds and 2 MB)
+    VIDEO_PROFILE:          str = environ.get("VIDEO_PROFILE", "auto")
+    VIDEO_TARGET_BYTES:     int = int(environ.get("VIDEO_TARGET_BYTES", "2097152"))
+    VIDEO_MAX_ENCODE_TIME:  float = float(environ.get("VIDEO_MAX_ENCODE_TIME", "0"))
+    VIDEO_MAX_DURATION:     int = int(environ.get("VIDEO_MAX_DURATION", "10000"))
+
+    # Rendering pool ("thread" or "process")
+    RENDER_EXECUTOR:    str = environ.get("RENDER_EXECUTOR", "thread")
+    RENDER_WORKERS:     int = int(environ.get("RENDER_WORKERS", "1"))
+    RENDER_QUEUE_SIZE:  int = int(environ.get("RENDER_QUEUE_SIZE", "1"))
+
+    # Schedule of avatar updates: period, alignment of ticks ("wall" - to
+    # multiples of period on wall clock, "dt" - to time of the latest weather
+    # observation), offset from alignment ("auto" - stable offset derived from
+    # accounts, so instances don't update at the same time), maximum random
+    # delay of every tick and retry delay of failed update (seconds); period
+    # of leftover profile photos cleanup (seconds, 0 - disabled)
+    UPDATE_INTERVAL:     float = float(environ.get("UPDATE_INTERVAL", "600"))
+    UPDATE_ALIGN:        str = environ.get("UPDATE_ALIGN", "wall")
+    UPDATE_OFFSET:       str = environ.get("UPDATE_OFFSET", "auto")
+    UPDATE_JITTER:       float = float(environ.get("UPDATE_JITTER", "0"))
+    UPDATE_RETRY_DELAY:  float = float(environ.get("UPDATE_RETRY_DELAY", "60"))
+    CLEANUP_INTERVAL:    float = float(environ.get("CLEANUP_INTERVAL", "0"))
+
+    # Supervision: timeouts of avatar rendering and of one run of periodic
+    # job (seconds, 0 - none), how long scheduler may go without heartbeat
+    # before it is restarted (seconds), failed restarts of task in a row
+    # after which the process exits (0 - never) and how long avatar may stay
+    # not updated before /health reports it as stale (seconds, 0 - never)
+    RENDER_TIMEOUT:           float = float(environ.get("RENDER_TIMEOUT", "120"))
+    JOB_TIMEOUT:              float = float(environ.get("JOB_TIMEOUT", "300"))
+    WATCHDOG_TIMEOUT:         float = float(environ.get("WATCHDOG_TIMEOUT", "60"))
+    SUPERVISOR_MAX_RESTARTS:  int = int(environ.get("SUPERVISOR_MAX_RESTARTS", "5"))
+    HEALTH_MAX_STALENESS:     float = float(environ.get("HEALTH_MAX_STALENESS", "1800"))
+
+    # Pre-rendering of forecast: enabled, how far ahead forecast is rendered
+    # and how often it is requested (seconds), how many avatars are kept
+    PRERENDER:             bool = environ.get("PRERENDER", "") == "1"
+    PRERENDER_HORIZON:     int = int(environ.get("PRERENDER_HORIZON", "10800"))
+    PRERENDER_INTERVAL:    int = int(environ.get("PRERENDER_INTERVAL", "3600"))
+    PRERENDER_CACHE_SIZE:  int = int(environ.get("PRERENDER_CACHE_SIZE", "16"))
+
+    # Event loop lag probe interval in seconds (0 - disabled)
+    LOOP_LAG_PROBE_INTERVAL: float = float(environ.get("LOOP_LAG_PROBE_INTERVAL", "0"))
+
+    # Logging: level, queue size (0 - write synchronously) and JSON
+    # serializer ("json", "orjson" or "auto")
+    LOG_LEVEL:       str = environ.get("LOG_LEVEL", "INFO")
+    LOG_QUEUE_SIZE:  int = int(environ.get("LOG_QUEUE_SIZE", "10000"))
+    LOG_SERIALIZER:  str = environ.get("LOG_SERIALIZER", "auto")
+
+    # Prometheus metrics endpoint (0 - disabled)
+    METRICS_HOST: str = environ.get("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT: int = int(environ.get("METRICS_PORT", "0"))
@@ -8,3 +8,15 @@ class ImageDownloadError(OpenWeatherMapAPIError):
 
 class WeatherDataDownloadError(OpenWeatherMapAPIError):
     pass
+
+
+class AvatarGenerationError(Exception):
+    pass
+
+
+class VideoEncodingError(AvatarGenerationError):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
@@ -1,8 +1,24 @@
-from .context import ApplicationContext
-from .open_weather_map import OpenWeatherMapResponse
+from .accounts import AccountConfig, AccountsConfig
+from .context import AccountContext, ApplicationContext
+from .layout import AvatarLayout, LayoutIcon, LayoutText
+from .open_weather_map import (
+    OpenWeatherMapGroupResponse, OpenWeatherMapRenderData,
+    OpenWeatherMapRenderForecast, OpenWeatherMapRenderGroup,
+    OpenWeatherMapResponse,
+)
 
 
 __all__ = [
+    "AccountConfig",
+    "AccountsConfig",
+    "AccountContext",
     "ApplicationContext",
+    "AvatarLayout",
+    "LayoutIcon",
+    "LayoutText",
+    "OpenWeatherMapGroupResponse",
+    "OpenWeatherMapRenderData",
+    "OpenWeatherMapRenderForecast",
+    "OpenWeatherMapRenderGroup",
     "OpenWeatherMapResponse",
 ]
@@ -0,0 +1,59 @@
+from pydantic import BaseModel, Field
+
+from src.config import ApplicationConfig
+
+
+class AccountConfig(BaseModel):
+    """
+    Model which represents settings of one Telegram account.
+    Style settings default to the global ones from ApplicationConfig.
+    """
+
+    name: str
+    session: str
+    phone: str
+    password: str = ""
+    city_id: int = ApplicationConfig.OPENWEATHER_API_CITYID
+    text_color: tuple[int, int, int] = ApplicationConfig.TEXT_COLOR
+    bg_color: tuple[int, int, int] = ApplicationConfig.BACKGROUND_COLOR
+    font_file: str = ApplicationConfig.FONT_FILE_NAME
+    bg_gif: str = ApplicationConfig.BG_GIF_PATH
+
+
+class AccountsConfig(BaseModel):
+    """
+    Model which represents accounts config file.
+    """
+
+    accounts: list[AccountConfig] = Field(min_length=1)
+    # How many accounts may update avatar at the same time
+    concurrency: int = Field(default=4, ge=1)
+
+    @classmethod
+    def from_file(cls, path: str) -> "AccountsConfig":
+        """ Loads accounts from JSON file. """
+
+        with open(path, "rb") as config_file:
+            return cls.model_validate_json(config_file.read())
+
+    @classmethod
+    def from_env(cls) -> "AccountsConfig":
+        """ Creates single account config from environment variables. """
+
+        return cls(
+            accounts=[AccountConfig(
+                name="default",
+                session="TG_Avatar",
+                phone=ApplicationConfig.TELEGRAM_PHONE,
+                password=ApplicationConfig.TELEGRAM_PASSWORD,
+            )],
+            concurrency=1,
+        )
+
+    @classmethod
+    def load(cls) -> "AccountsConfig":
+        """ Loads accounts from config file if it is set, else from env. """
+
+        if ApplicationConfig.ACCOUNTS_CONFIG_PATH:
+            return cls.from_file(ApplicationConfig.ACCOUNTS_CONFIG_PATH)
+        return cls.from_env()
@@ -1,16 +1,40 @@
-from dataclasses import dataclass
+from aiohttp import ClientSession
+from dataclasses import dataclass, field
 from telethon import TelegramClient
 from typing import Type
 
 from src.config import ApplicationConfig
-from src.utils import CustomJSONLogger
+from src.utils import (
+    CustomJSONLogger, LoopLagMonitor, Metrics, MetricsServer, RateWindow,
+    StateStore, Supervisor,
+)
 
 
 @dataclass
-class ApplicationContext:
+class AccountContext:
 
+    name: str
+    city_id: int
+    phone: str
+    password: str
+    tg_client: TelegramClient
     avatar_generator: "AvatarGenerator"
+    # Telegram API calls made for account during the last hour
+    telegram_calls: RateWindow = field(default_factory=RateWindow)
+
+
+@dataclass
+class ApplicationContext:
+
+    accounts: list[AccountContext]
     open_weather_map: "OpenWeatherMapAPI"
-    tg_client: TelegramClient
     config: Type[ApplicationConfig]
     logger: CustomJSONLogger
+    state: StateStore
+    metrics: Metrics
+    accounts_concurrency: int = 1
+    loop_lag_monitor: LoopLagMonitor | None = None
+    metrics_server: MetricsServer | None = None
+    http_session: ClientSession | None = None
+    prerenderer: "Prerenderer | None" = None
+    supervisor: Supervisor | None = None
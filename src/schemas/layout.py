@@ -0,0 +1,75 @@
+from pydantic import BaseModel, Field
+
+
+class LayoutIcon(BaseModel):
+    """
+    Model which represents weather icon element of avatar layout: top left
+    corner and side of square the icon is resized to.
+    """
+
+    x: int
+    y: int
+    size: int = Field(default=100, gt=0)
+
+
+class LayoutText(BaseModel):
+    """
+    Model which represents text element of avatar layout: top left corner
+    of text, font size and optional font file and color (the account's
+    ones are used if not set).
+    """
+
+    x: int
+    y: int
+    font_size: int = Field(gt=0)
+    font_file: str | None = None
+    color: tuple[int, int, int] | None = None
+
+
+class AvatarLayout(BaseModel):
+    """
+    Model which represents layout of avatar: side of square avatar and
+    positions of weather icon, temperature and humidity/wind speed texts.
+    Defaults repeat the original 200x200 avatar.
+    """
+
+    size: int = Field(default=200, gt=0)
+    icon: LayoutIcon = LayoutIcon(x=50, y=15)
+    temperature: LayoutText = LayoutText(x=65, y=100, font_size=30)
+    details: LayoutText = LayoutText(x=55, y=130, font_size=15)
+
+    @classmethod
+    def from_file(cls, path: str) -> "AvatarLayout":
+        """ Loads layout from JSON file. """
+
+        with open(path, "rb") as layout_file:
+            return cls.model_validate_json(layout_file.read())
+
+    def scaled(self, size: int) -> "AvatarLayout":
+        """
+        Returns layout for avatar of another size, positions and sizes of
+        elements are scaled proportionally.
+        """
+
+        if size == self.size:
+            return self
+        factor = size / self.size
+        return self.model_copy(update={
+            "size": size,
+            "icon": self.icon.model_copy(update={
+                "x": round(self.icon.x * factor),
+                "y": round(self.icon.y * factor),
+                "size": max(round(self.icon.size * factor), 1),
+            }),
+            **{
+                name: element.model_copy(update={
+                    "x": round(element.x * factor),
+                    "y": round(element.y * factor),
+                    "font_size": max(round(element.font_size * factor), 1),
+                })
+                for name, element in (
+                    ("temperature", self.temperature),
+                    ("details", self.details),
+                )
+            },
+        })
@@ -1,4 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import (
+    AliasChoices, AliasPath, BaseModel, Field, PrivateAttr, field_validator,
+)
 
 
 class OpenWeatherMapCoordinates(BaseModel):
@@ -40,7 +42,8 @@ class OpenWeatherMapWind(BaseModel):
     """
 
     speed: float
-    deg: int
+    deg: int | None = None
+    gust: float | None = None
 
 
 class OpeWeatherMapClouds(BaseModel):
@@ -56,12 +59,13 @@ class OpenWeatherMapSys(BaseModel):
     Model which represents 'sys' field in OpenWeatherMap API response.
     """
 
-    type: int
-    id: int
+    type: int | None = None
+    id: int | None = None
     message: float | None = None
-    country: str
-    sunrise: int
-    sunset: int
+    country: str | None = None
+    sunrise: int | None = None
+    sunset: int | None = None
+    timezone: int | None = None
 
 
 class OpenWeatherMapRain(BaseModel):
@@ -69,8 +73,8 @@ class OpenWeatherMapRain(BaseModel):
     Model which represents 'rain' field in OpenWeatherMap API response.
     """
 
-    one_h: int | str | float = Field(alias="1h")
-    three_h: int | str | float = Field(alias="3h")
+    one_h: int | str | float | None = Field(default=None, alias="1h")
+    three_h: int | str | float | None = Field(default=None, alias="3h")
 
 
 class OpenWeatherMapSnow(BaseModel):
@@ -78,8 +82,8 @@ class OpenWeatherMapSnow(BaseModel):
     Model which represents 'snow' field in OpenWeatherMap API response.
     """
 
-    one_h: int | str | float = Field(alias="1h")
-    three_h: int | str | float = Field(alias="3h")
+    one_h: int | str | float | None = Field(default=None, alias="1h")
+    three_h: int | str | float | None = Field(default=None, alias="3h")
 
 
 class OpenWeatherMapResponse(BaseModel):
@@ -91,14 +95,192 @@ class OpenWeatherMapResponse(BaseModel):
     weather: list[OpenWeatherMapWeather]
     base: str
     main: OpenWeatherMapMain
-    visibility: int
+    visibility: int | None = None
     wind: OpenWeatherMapWind | None = None
     clouds: OpeWeatherMapClouds | None = None
     rain: OpenWeatherMapRain | None = None
-    show: OpenWeatherMapSnow | None = None
+    snow: OpenWeatherMapSnow | None = None
     dt: int
     sys: OpenWeatherMapSys | None = None
     timezone: int
     id: int
     name: str
     cod: int
+
+
+class OpenWeatherMapGroupResponse(BaseModel):
+    """
+    Model which represents response from OpenWeatherMap group API (current
+    weather for several cities). Items of the list miss some fields of
+    single city response, they are filled before validation.
+    """
+
+    cnt: int
+    items: list[OpenWeatherMapResponse] = Field(alias="list")
+
+    @field_validator("items", mode="before")
+    @classmethod
+    def fill_missing_fields(cls, items):
+        if isinstance(items, list):
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                item.setdefault("base", "stations")
+                item.setdefault("cod", 200)
+                item.setdefault("timezone", (item.get("sys") or {}).get("timezone", 0))
+        return items
+
+
+class OpenWeatherMapRenderWeather(BaseModel):
+    """
+    Model which represents 'weather' field with only fields avatar
+    generator needs.
+    """
+
+    icon: str
+
+
+class OpenWeatherMapRenderMain(BaseModel):
+    """
+    Model which represents 'main' field with only fields avatar generator
+    needs.
+    """
+
+    temp: float
+    humidity: int
+
+
+class OpenWeatherMapRenderWind(BaseModel):
+    """
+    Model which represents 'wind' field with only fields avatar generator
+    needs (calm wind may be omitted).
+    """
+
+    speed: float = 0.0
+
+
+class OpenWeatherMapRenderData(BaseModel):
+    """
+    Model which represents OpenWeatherMap API response with only fields
+    which are rendered and cached. Unused fields aren't validated, full
+    model of response parsed from JSON can be built on demand.
+    """
+
+    id: int
+    dt: int
+    # Group API items have time zone in 'sys' field
+    timezone: int = Field(
+        default=0,
+        validation_alias=AliasChoices("timezone", AliasPath("sys", "timezone")),
+    )
+    weather: list[OpenWeatherMapRenderWeather] = Field(min_length=1)
+    main: OpenWeatherMapRenderMain
+    wind: OpenWeatherMapRenderWind = Field(default_factory=OpenWeatherMapRenderWind)
+
+    # Raw JSON the data was parsed from and index in group response list
+    _source: tuple[bytes, int | None] | None = PrivateAttr(default=None)
+    # The last known weather served while OpenWeatherMap is unavailable
+    _stale: bool = PrivateAttr(default=False)
+
+    @property
+    def is_stale(self) -> bool:
+        """ Checks if data is the last known weather, not a fresh one. """
+
+        return self._stale
+
+    def as_stale(self) -> "OpenWeatherMapRenderData":
+        """ Returns copy of data marked as the last known weather. """
+
+        snapshot = self.model_copy()
+        snapshot._stale = True
+        return snapshot
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "OpenWeatherMapRenderData":
+        """ Validates raw current weather response. """
+
+        item = cls.model_validate_json(data)
+        item._source = (data, None)
+        return item
+
+    def full(self) -> OpenWeatherMapResponse:
+        """
+        Validates full response the data was parsed from.
+        Raises:
+            ValueError: if the data wasn't parsed from JSON (e.g. it was
+                loaded from state file).
+            ValidationError: if response doesn't match full model.
+        """
+
+        if self._source is None:
+            raise ValueError("Raw response isn't available")
+        data, index = self._source
+        if index is None:
+            return OpenWeatherMapResponse.model_validate_json(data)
+        return OpenWeatherMapGroupResponse.model_validate_json(data).items[index]
+
+
+class OpenWeatherMapRenderGroup(BaseModel):
+    """
+    Model which represents response from OpenWeatherMap group API with only
+    fields which are rendered and cached.
+    """
+
+    cnt: int
+    items: list[OpenWeatherMapRenderData] = Field(alias="list")
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "OpenWeatherMapRenderGroup":
+        """ Validates raw group response. """
+
+        group = cls.model_validate_json(data)
+        for index, item in enumerate(group.items):
+            item._source = (data, index)
+        return group
+
+
+class OpenWeatherMapForecastCity(BaseModel):
+    """
+    Model which represents 'city' field of OpenWeatherMap forecast API
+    response with only fields avatar generator needs.
+    """
+
+    id: int
+    timezone: int = 0
+
+
+class OpenWeatherMapForecastItem(BaseModel):
+    """
+    Model which represents item of 'list' field of OpenWeatherMap forecast
+    API response with only fields avatar generator needs.
+    """
+
+    dt: int
+    weather: list[OpenWeatherMapRenderWeather] = Field(min_length=1)
+    main: OpenWeatherMapRenderMain
+    wind: OpenWeatherMapRenderWind = Field(default_factory=OpenWeatherMapRenderWind)
+
+
+class OpenWeatherMapRenderForecast(BaseModel):
+    """
+    Model which represents response from OpenWeatherMap forecast API (5 day
+    / 3 hour forecast) with only fields which are rendered.
+    """
+
+    city: OpenWeatherMapForecastCity
+    items: list[OpenWeatherMapForecastItem] = Field(alias="list")
+
+    def snapshots(self) -> list[OpenWeatherMapRenderData]:
+        """ Returns forecast items as weather data of the city. """
+
+        return [
+            OpenWeatherMapRenderData.model_construct(
+                id=self.city.id,
+                dt=item.dt,
+                timezone=self.city.timezone,
+                weather=item.weather,
+                main=item.main,
+                wind=item.wind,
+            )
+            for item in self.items
+        ]
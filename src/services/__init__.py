@@ -1,8 +1,65 @@
-from .avatar_generator import AvatarGenerator
-from .open_weather_map_api import OpenWeatherMapAPI
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+# Submodules are imported on first access to their names, so heavy
+# dependencies of unused services (e.g. video encoding of animated avatars)
+# aren't loaded at startup
+_EXPORTS = {
+    "AvatarGenerator": ".avatar_generator",
+    "AvatarUpdateQueue": ".avatar_update_queue",
+    "BatchRenderer": ".batch_renderer",
+    "IconStore": ".icon_store",
+    "NumPyCompositor": ".compositor",
+    "OpenWeatherMapAPI": ".open_weather_map_api",
+    "OwnedPhotos": ".owned_photos",
+    "PILCompositor": ".compositor",
+    "PrerenderCache": ".prerender",
+    "Prerenderer": ".prerender",
+    "RenderPlan": ".render_plan",
+    "VideoEncoder": ".video_encoder",
+    "WeatherCache": ".weather_cache",
+    "create_compositor": ".compositor",
+}
+
+if TYPE_CHECKING:
+    from .avatar_generator import AvatarGenerator
+    from .avatar_update_queue import AvatarUpdateQueue
+    from .batch_renderer import BatchRenderer
+    from .compositor import NumPyCompositor, PILCompositor, create_compositor
+    from .icon_store import IconStore
+    from .open_weather_map_api import OpenWeatherMapAPI
+    from .owned_photos import OwnedPhotos
+    from .prerender import PrerenderCache, Prerenderer
+    from .render_plan import RenderPlan
+    from .video_encoder import VideoEncoder
+    from .weather_cache import WeatherCache
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_EXPORTS))
 
 
 __all__ = [
     "AvatarGenerator",
+    "AvatarUpdateQueue",
+    "BatchRenderer",
+    "IconStore",
+    "NumPyCompositor",
     "OpenWeatherMapAPI",
+    "OwnedPhotos",
+    "PILCompositor",
+    "PrerenderCache",
+    "Prerenderer",
+    "RenderPlan",
+    "VideoEncoder",
+    "WeatherCache",
+    "create_compositor",
 ]
@@ -1,8 +1,41 @@
 import os
-from moviepy.editor import VideoFileClip
-from PIL import Image, ImageDraw, ImageFont, ImageSequence
+from asyncio import Future, Semaphore, get_running_loop, shield
+from concurrent.futures import Executor, ThreadPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from json import dumps
+from time import perf_counter
+from typing import TYPE_CHECKING
+from PIL import Image
 
-from src.schemas import OpenWeatherMapResponse
+from src.schemas import AvatarLayout, OpenWeatherMapRenderData
+from src.services.icon_store import IconStore
+from src.services.render_plan import RenderPlan
+
+# Modules of animated avatars are loaded only if background GIF is set
+if TYPE_CHECKING:
+    from src.services.video_encoder import VideoEncoder
+
+
+# Generator instance of render worker process
+_worker_generator: "AvatarGenerator | None" = None
+
+
+def _init_worker(generator_kwargs: dict):
+    """ Creates avatar generator inside render worker process. """
+
+    global _worker_generator
+    _worker_generator = AvatarGenerator(**generator_kwargs)
+
+
+def _generate_in_worker(
+        weather_data: OpenWeatherMapRenderData,
+) -> tuple[bytes, dict[str, float], dict]:
+    """ Generates avatar inside render worker process. """
+
+    timings, encoding = {}, {}
+    avatar = _worker_generator.generate(weather_data, timings, encoding)
+    return avatar, timings, encoding
 
 
 class AvatarGenerator:
@@ -18,6 +51,18 @@ class AvatarGenerator:
             text_color: tuple[int] = (0, 0, 0),
             bg_color: tuple[int] = (255, 255, 255),
             bg_gif: str | None = None,
+            video_encoder: "VideoEncoder | None" = None,
+            render_executor: str = "thread",
+            render_workers: int = 1,
+            render_queue_size: int = 1,
+            icon_store: IconStore | None = None,
+            compositor: str = "pil",
+            bg_gif_streaming: bool = False,
+            bg_gif_max_frames: int = 0,
+            bg_gif_max_duration: int = 0,
+            layout: AvatarLayout | None = None,
+            avatar_size: int = 0,
+            overlay_cache_size: int = 32,
     ):
         """
         Initializer.
@@ -27,15 +72,104 @@ class AvatarGenerator:
             text_color: text color in RGB format.
             bg_color: background color in RGB format.
             bg_gif: path to background gif file.
+            video_encoder: encoder for animated avatars.
+            render_executor: type of pool for asynchronous rendering
+                ("thread" or "process").
+            render_workers: number of render workers.
+            render_queue_size: number of renders which may wait for a free
+                worker, other callers wait before submitting.
+            icon_store: store of weather icons, created for image folder
+                if not set (worker processes always create own store).
+            compositor: engine compositing overlay onto GIF frames ("pil",
+                "numpy" or "auto" - NumPy if it is installed; NumPy keeps
+                a second copy of frames).
+            bg_gif_streaming: if True, GIF frames are decoded, composited
+                and encoded one by one on every generation instead of being
+                kept in memory (compositor isn't used then).
+            bg_gif_max_frames: maximum number of used GIF frames (0 -
+                unlimited).
+            bg_gif_max_duration: maximum duration of used GIF frames in
+                milliseconds (0 - unlimited).
+            layout: layout of avatar (the original 200x200 one if not set).
+            avatar_size: side of avatar in pixels, layout is scaled to it
+                (0 - size of layout).
+            overlay_cache_size: number of rendered overlays (icon and
+                texts) kept in memory.
         """
 
+        if render_executor not in ("thread", "process"):
+            raise ValueError(f"Unknown render executor: {render_executor}")
+        self._init_kwargs = {
+            "font_file": font_file,
+            "image_folder": image_folder,
+            "text_color": text_color,
+            "bg_color": bg_color,
+            "bg_gif": bg_gif,
+            "video_encoder": video_encoder,
+            "compositor": compositor,
+            "bg_gif_streaming": bg_gif_streaming,
+            "bg_gif_max_frames": bg_gif_max_frames,
+            "bg_gif_max_duration": bg_gif_max_duration,
+            "layout": layout,
+            "avatar_size": avatar_size,
+            "overlay_cache_size": overlay_cache_size,
+        }
+        self._render_executor = render_executor
+        self._render_workers = render_workers
+        self._render_slots = Semaphore(render_workers + render_queue_size)
+        self._executor: Executor | None = None
+        self._font_file = font_file
+        self._bg_gif_path = bg_gif
         self._text_color = text_color
         self._bg_color = bg_color
-        self._folder = image_folder
-        self._font_temperature = ImageFont.truetype(font_file, 30)
-        self._font_min_max_temperature = ImageFont.truetype(font_file, 15)
-        # Open base GIF is necessary
-        self._bg_gif = Image.open(bg_gif) if bg_gif else None
+        self._icons = icon_store or IconStore(image_folder)
+        layout = layout or AvatarLayout()
+        # Layout is compiled once (fonts, glyphs), overlays are cached
+        self._plan = RenderPlan(
+            layout=layout.scaled(avatar_size or layout.size),
+            font_file=font_file,
+            icon_store=self._icons,
+            text_color=text_color,
+            bg_color=bg_color,
+            transparent=bool(bg_gif),
+            cache_size=overlay_cache_size,
+        )
+        self._bg_gif = None
+        self._bg_gif_streaming = bg_gif_streaming
+        self._video_encoder = video_encoder
+        self._compositor = None
+        if bg_gif:
+            from src.services.background_frames import shared_background_frames
+            from src.services.compositor import create_compositor
+            from src.services.video_encoder import VideoEncoder
+
+            # Prepare base GIF frames (worker processes have own)
+            self._bg_gif = shared_background_frames(
+                bg_gif,
+                size=self._plan.size,
+                max_frames=bg_gif_max_frames,
+                max_duration=bg_gif_max_duration,
+            )
+            if render_executor == "thread":
+                if bg_gif_streaming:
+                    self._bg_gif.durations()
+                else:
+                    self._bg_gif.get()
+            self._video_encoder = video_encoder or VideoEncoder()
+            if not bg_gif_streaming:
+                self._compositor = create_compositor(compositor)
+
+    @property
+    def is_animated(self) -> bool:
+        """ True if generator makes video avatars. """
+
+        return self._bg_gif is not None
+
+    @property
+    def file_name(self) -> str:
+        """ File name of generated avatar (its extension tells format). """
+
+        return "avatar.mp4" if self.is_animated else "avatar.png"
 
     @staticmethod
     def _format_temperature(n: int | float) -> str:
@@ -47,68 +181,178 @@ class AvatarGenerator:
             result = "+" + result
         return result
 
+    def _render_values(self, weather_data: OpenWeatherMapRenderData) -> tuple[str, str, str]:
+        """
+        Returns values which are drawn on avatar: icon name, temperature
+        text and humidity/wind speed text.
+        """
+
+        return (
+            weather_data.weather[0].icon,
+            self._format_temperature(weather_data.main.temp),
+            f"{weather_data.main.humidity}%   {weather_data.wind.speed} m/c",
+        )
+
+    def render_key(self, weather_data: OpenWeatherMapRenderData) -> str:
+        """
+        Method which calculates a key of avatar that would be generated for
+        weather data. Avatars with equal keys are identical.
+        Returns:
+            Hex digest of drawn values and style settings.
+        """
+
+        style = {
+            "font_file": self._font_file,
+            "text_color": self._text_color,
+            "bg_color": self._bg_color,
+            "bg_gif": self._bg_gif_path,
+            "bg_gif_signature": self._bg_gif.signature() if self._bg_gif else None,
+            "bg_gif_limits": self._bg_gif.limits if self._bg_gif else None,
+            "layout": self._plan.layout.model_dump(),
+        }
+        payload = dumps([self._render_values(weather_data), style])
+        return sha256(payload.encode()).hexdigest()
+
     def generate(
             self,
-            weather_data: OpenWeatherMapResponse,
-    ) -> os.path:
+            weather_data: OpenWeatherMapRenderData,
+            timings: dict[str, float] | None = None,
+            encoding: dict | None = None,
+    ) -> bytes:
         """
         Method which generates avatar image with time and current weather data
         or only with current time if weather data is not available.
+        Args:
+            weather_data: current weather data.
+            timings: if set, seconds spent on compositing ("composite") and
+                encoding ("encode") are written to it.
+            encoding: if set, video encoding parameters and result are
+                written to it (animated avatars only).
         Returns:
-            os.path object - absolute path to the generated avatar image.
+            Content of avatar file (MP4 video if background GIF is set,
+            otherwise PNG image).
         """
 
-        # Create background
-        bg_color = self._bg_color + ((0,) if self._bg_gif else (255,))
-        bg = Image.new(mode="RGBA", size=(200, 200), color=bg_color)
-        canvas = ImageDraw.Draw(bg)
-        # Prepare weather icon
-        icon_path = os.path.join(
-            self._folder,
-            weather_data.weather[0].icon + ".png",
-        )
-        icon = Image.open(icon_path, "r")
-        # Draw icon on background
-        bg.paste(im=icon, box=(50, 15), mask=icon)
-        # Draw temperature on background
-        canvas.text(
-            xy=(65, 100),
-            text=self._format_temperature(weather_data.main.temp),
-            font=self._font_temperature,
-            fill=self._text_color,
-        )
-        # Draw humidity and wind speed info
-        canvas.text(
-            xy=(55, 130),
-            text=f"{weather_data.main.humidity}%   {weather_data.wind.speed} m/c",
-            font=self._font_min_max_temperature,
-            fill=self._text_color,
-        )
+        started_at = perf_counter()
+        encode_time = 0.0
+        # Background with icon and texts (shared, rendered once per values)
+        bg = self._plan.overlay(*self._render_values(weather_data))
         if self._bg_gif:
+            # Taken before frames, so changed GIF never gets stale key
+            source = (self._bg_gif.signature(), self._bg_gif.limits)
             # Set gif if necessary
-            result_file = "avatar.mp4"
-            frames = []
-            to_frame = bg.copy()
-            for frame in ImageSequence.Iterator(self._bg_gif):
-                new_frame = frame.copy()
-                new_frame = new_frame.resize((200, 200))
-                new_frame = new_frame.convert("RGBA")
-                new_frame.alpha_composite(to_frame)
-                frames.append(new_frame)
-            frames[0].save(
-                "avatar.gif",
-                save_all=True,
-                append_images=frames[1:-1],
-            )
-            # Convert to MP4
-            clip = VideoFileClip("avatar.gif")
-            clip.write_videofile(result_file, logger=None, audio=False)
+            if self._bg_gif_streaming:
+                durations = self._bg_gif.durations()
+                frames = (
+                    Image.alpha_composite(frame, bg).tobytes()
+                    for frame, _ in self._bg_gif.stream()
+                )
+            else:
+                prepared = self._bg_gif.get()
+                durations = prepared.durations
+                frames = self._compositor.composite(prepared, bg, key=source)
+            encoder = self._video_encoder
+            # Frames are composited and piped to encoder one by one
+            with encoder.session(bg.size, durations, source) as session:
+                for frame, duration in zip(frames, durations):
+                    encode_started_at = perf_counter()
+                    session.add_raw_frame(frame, duration)
+                    encode_time += perf_counter() - encode_started_at
+                    # The rest doesn't fit in maximum video duration
+                    if session.trimmed:
+                        break
+                encode_started_at = perf_counter()
+                result = session.finish()
+                encode_time += perf_counter() - encode_started_at
+            if encoding is not None:
+                encoding.update(encoder.describe(session, len(result)))
         else:
             # Saving new avatar
-            result_file = "avatar.png"
-            bg.save(result_file)
+            encode_started_at = perf_counter()
+            buffer = BytesIO()
+            bg.save(buffer, format="PNG")
+            result = buffer.getvalue()
+            encode_time += perf_counter() - encode_started_at
+
+        if timings is not None:
+            timings["composite"] = perf_counter() - started_at - encode_time
+            timings["encode"] = encode_time
+        return result
+
+    def _get_executor(self) -> Executor:
+        """ Returns render pool, creating it on first use. """
+
+        if self._executor is None:
+            if self._render_executor == "process":
+                from concurrent.futures import ProcessPoolExecutor
+                from multiprocessing import get_context
+
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._render_workers,
+                    mp_context=get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self._init_kwargs,),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._render_workers,
+                    thread_name_prefix="avatar_render",
+                )
+        return self._executor
+
+    async def generate_async(
+            self,
+            weather_data: OpenWeatherMapRenderData,
+            timings: dict[str, float] | None = None,
+            encoding: dict | None = None,
+    ) -> bytes:
+        """
+        Asynchronous version of generate method. Rendering runs in render
+        pool so event loop isn't blocked. If awaiting is cancelled (e.g. by
+        timeout), render slot is held until the render really finishes, so
+        abandoned renders don't oversubscribe the pool.
+        Returns:
+            Content of avatar file.
+        """
+
+        await self._render_slots.acquire()
+        try:
+            executor = self._get_executor()
+            loop = get_running_loop()
+            if self._render_executor == "process":
+                future = loop.run_in_executor(executor, _generate_in_worker, weather_data)
+            else:
+                future = loop.run_in_executor(
+                    executor, self.generate, weather_data, timings, encoding,
+                )
+        except BaseException:
+            self._render_slots.release()
+            raise
+        future.add_done_callback(self._release_render_slot)
+        result = await shield(future)
+        if self._render_executor != "process":
+            return result
+        avatar, worker_timings, worker_encoding = result
+        if timings is not None:
+            timings.update(worker_timings)
+        if encoding is not None:
+            encoding.update(worker_encoding)
+        return avatar
+
+    def _release_render_slot(self, future: Future):
+        """ Releases render slot once render has finished. """
+
+        self._render_slots.release()
+        # Error of abandoned render isn't awaited by anyone
+        if not future.cancelled():
+            future.exception()
+
+    def shutdown(self):
+        """ Stops render pool cancelling renders which haven't started. """
 
-        return os.path.abspath(result_file)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 
 
 if __name__ == "__main__":
@@ -142,5 +386,7 @@ if __name__ == "__main__":
         bg_gif="../data/bg_gif.gif",
         text_color=(255,255,255),
     )
-    path = ag.generate(weather_data=OpenWeatherMapResponse(**data))
-    print(path)
\ No newline at end of file
+    avatar = ag.generate(weather_data=OpenWeatherMapRenderData.model_validate(data))
+    with open(ag.file_name, "wb") as avatar_file:
+        avatar_file.write(avatar)
+    print(os.path.abspath(ag.file_name))
\ No newline at end of file
@@ -0,0 +1,183 @@
+from asyncio import Event, Task, create_task, sleep as aio_sleep
+from telethon.errors import FloodError, ServerError, TimedOutError
+from traceback import format_exception
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from src.utils import CustomJSONLogger, Metrics, RateWindow, RetryPolicy
+
+
+T = TypeVar("T")
+
+# Telegram errors which may go away if request is repeated
+TRANSIENT_ERRORS = (ServerError, TimedOutError, ConnectionError, TimeoutError)
+
+
+class AvatarUpdateQueue(Generic[T]):
+    """
+    Queue of avatar updates of one Telegram account with "latest wins"
+    coalescing: only the newest submitted update is kept, so after a stall
+    (FloodWait, call budget, slow upload) the newest avatar is uploaded
+    and stale ones are dropped. FloodWait durations are honored, transient
+    errors are retried a bounded number of times.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            update: Callable[[T], Awaitable[None]],
+            logger: CustomJSONLogger,
+            metrics: Metrics,
+            calls: RateWindow,
+            max_attempts: int = 3,
+            calls_per_hour: int = 0,
+            calls_per_update: int = 4,
+            retry_policy: RetryPolicy | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            name: account name (used in logs and metrics).
+            update: coroutine function which performs update.
+            logger: logger object.
+            metrics: metrics object.
+            calls: Telegram API calls of account (counted by update).
+            max_attempts: maximum number of attempts of one update
+                (waiting for FloodWait isn't counted).
+            calls_per_hour: budget of Telegram API calls (0 - unlimited),
+                updates wait until they fit in it.
+            calls_per_update: expected number of calls of one update.
+            retry_policy: backoff between attempts.
+        """
+
+        self.name = name
+        self._update = update
+        self._logger = logger
+        self._metrics = metrics
+        self._calls = calls
+        self._max_attempts = max_attempts
+        self._calls_per_hour = calls_per_hour
+        self._calls_per_update = calls_per_update
+        self._retry = retry_policy or RetryPolicy(base_delay=5, max_delay=120)
+        # Pending update and ID of cycle which has submitted it
+        self._pending: tuple[T, str | None] | None = None
+        self._submitted = Event()
+        self._task: Task | None = None
+        self.coalesced = 0
+
+    def submit(self, item: T):
+        """ Schedules update, replacing update which hasn't started yet. """
+
+        if self._pending is not None:
+            self.coalesced += 1
+            self._metrics.coalesced_updates.inc(account=self.name)
+            self._logger.info({
+                "event": "update_coalesced",
+                "account": self.name,
+                "coalesced": self.coalesced,
+            })
+        self._pending = (item, self._metrics.cycle_id.get())
+        self._submitted.set()
+
+    def _take_pending(self) -> T | None:
+        pending, self._pending = self._pending, None
+        self._submitted.clear()
+        if pending is None:
+            return None
+        item, cycle_id = pending
+        # Update spans belong to the cycle which has submitted it
+        self._metrics.cycle_id.set(cycle_id)
+        return item
+
+    async def _wait_for_budget(self):
+        """ Waits until the next update fits in calls budget. """
+
+        if not self._calls_per_hour:
+            return
+        delay = self._calls.wait_time(self._calls_per_hour, self._calls_per_update)
+        if delay > 0:
+            self._logger.warning({
+                "event": "telegram_calls_budget",
+                "account": self.name,
+                "calls_last_hour": self._calls.count(),
+                "calls_per_hour": self._calls_per_hour,
+                "delay": round(delay, 3),
+            })
+            await aio_sleep(delay)
+
+    async def _process(self, item: T):
+        """ Performs update with retries (newer update replaces it). """
+
+        attempt = 0
+        while True:
+            await self._wait_for_budget()
+            if self._pending is not None:
+                item, attempt = self._take_pending(), 0
+            attempt += 1
+            try:
+                await self._update(item)
+                return
+            except FloodError as e:
+                delay = getattr(e, "seconds", 0) + 1
+                attempt -= 1
+                self._metrics.flood_waits.inc(account=self.name)
+                self._metrics.flood_wait_seconds.inc(delay, account=self.name)
+                self._logger.warning({
+                    "event": "flood_wait",
+                    "account": self.name,
+                    "seconds": delay,
+                    "error": str(e),
+                })
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self._max_attempts:
+                    self._metrics.dropped_updates.inc(account=self.name)
+                    self._logger.error({
+                        "event": "update_dropped",
+                        "account": self.name,
+                        "attempts": attempt,
+                        "error": str(e) or type(e).__name__,
+                        "traceback": format_exception(e),
+                    })
+                    return
+                delay = self._retry.backoff(attempt)
+                self._metrics.retries.inc(operation="telegram")
+                self._logger.warning({
+                    "event": "retry",
+                    "operation": "telegram",
+                    "account": self.name,
+                    "attempt": attempt,
+                    "delay_ms": round(delay * 1000, 3),
+                    "error": str(e) or type(e).__name__,
+                })
+            # Updates submitted meanwhile replace this one
+            await aio_sleep(delay)
+
+    async def run(self):
+        """ Performs submitted updates one by one until cancelled. """
+
+        while True:
+            await self._submitted.wait()
+            item = self._take_pending()
+            if item is None:
+                continue
+            try:
+                await self._process(item)
+            except Exception as e:
+                self._logger.error({
+                    "event": "error",
+                    "account": self.name,
+                    "error": str(e),
+                    "traceback": format_exception(e),
+                })
+
+    def start(self):
+        """ Starts processing updates in background task. """
+
+        if self._task is None:
+            self._task = create_task(self.run())
+
+    def stop(self):
+        """ Stops processing, pending update is dropped. """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,160 @@
+import os
+from dataclasses import dataclass
+from threading import Lock
+from typing import Iterator
+from PIL import Image, ImageSequence
+
+
+# Frame duration used when GIF doesn't declare one (milliseconds).
+DEFAULT_FRAME_DURATION = 100
+
+
+@dataclass(frozen=True)
+class PreparedFrames:
+    """
+    Background GIF frames resized and converted to RGBA, ready for
+    compositing, together with per-frame durations in milliseconds.
+    """
+
+    frames: list[Image.Image]
+    durations: list[int]
+
+
+class BackgroundFrames:
+    """
+    Store of prepared background GIF frames.
+    Frames are decoded, resized and converted once and reused by every
+    avatar generation until GIF file is changed on disk (its mtime or
+    size differs from the ones frames were built from).
+    Alternatively frames may be streamed: decoded and prepared one by one
+    on every generation, so memory doesn't depend on GIF length.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            size: tuple[int, int] = (200, 200),
+            max_frames: int = 0,
+            max_duration: int = 0,
+    ):
+        """
+        Initializer.
+        Args:
+            path: path to background GIF file.
+            size: size of prepared frames.
+            max_frames: maximum number of used frames (0 - unlimited).
+            max_duration: maximum total duration of used frames in
+                milliseconds (0 - unlimited), the first frame is always
+                used.
+        """
+
+        self._path = path
+        self._size = size
+        self._max_frames = max_frames
+        self._max_duration = max_duration
+        self._signature: tuple[int, int] | None = None
+        self._prepared: PreparedFrames | None = None
+        self._durations: list[int] | None = None
+        self._durations_signature: tuple[int, int] | None = None
+        self._lock = Lock()
+
+    @property
+    def limits(self) -> tuple[int, int]:
+        """ Maximum number of frames and maximum duration. """
+
+        return self._max_frames, self._max_duration
+
+    def signature(self) -> tuple[int, int]:
+        """ Returns (mtime, size) pair of GIF file. """
+
+        stat = os.stat(self._path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _iterate(self, gif: Image.Image) -> Iterator[tuple[Image.Image, int]]:
+        """ Yields source frames with their durations within limits. """
+
+        elapsed = 0
+        for index, frame in enumerate(ImageSequence.Iterator(gif)):
+            duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+            if self._max_duration and index and elapsed + duration > self._max_duration:
+                return
+            elapsed += duration
+            yield frame, duration
+            # Stop before the next frame is decoded
+            if self._max_frames and index + 1 >= self._max_frames:
+                return
+
+    def _prepare_frame(self, frame: Image.Image) -> Image.Image:
+        new_frame = frame.copy()
+        new_frame = new_frame.resize(self._size)
+        return new_frame.convert("RGBA")
+
+    def _prepare(self) -> PreparedFrames:
+        """ Decodes GIF file and prepares all its frames. """
+
+        frames, durations = [], []
+        with Image.open(self._path) as gif:
+            for frame, duration in self._iterate(gif):
+                frames.append(self._prepare_frame(frame))
+                durations.append(duration)
+        return PreparedFrames(frames=frames, durations=durations)
+
+    def get(self) -> PreparedFrames:
+        """
+        Returns prepared frames, rebuilding them if GIF file was changed
+        since the last call.
+        """
+
+        signature = self.signature()
+        with self._lock:
+            if self._prepared is None or signature != self._signature:
+                self._prepared = self._prepare()
+                self._signature = signature
+            return self._prepared
+
+    def durations(self) -> list[int]:
+        """
+        Returns durations of frames which stream method yields (they are
+        read once per GIF file change, frames aren't kept).
+        """
+
+        signature = self.signature()
+        with self._lock:
+            if self._durations is None or signature != self._durations_signature:
+                with Image.open(self._path) as gif:
+                    self._durations = [duration for _, duration in self._iterate(gif)]
+                self._durations_signature = signature
+            return self._durations
+
+    def stream(self) -> Iterator[tuple[Image.Image, int]]:
+        """
+        Decodes GIF file lazily, only one source and one prepared frame
+        are held at once.
+        Returns:
+            Iterator of prepared frames with their durations.
+        """
+
+        with Image.open(self._path) as gif:
+            for frame, duration in self._iterate(gif):
+                yield self._prepare_frame(frame), duration
+
+
+# Stores shared between avatar generators with the same background
+_shared_stores: dict[tuple[str, tuple[int, int], int, int], BackgroundFrames] = {}
+
+
+def shared_background_frames(
+        path: str,
+        size: tuple[int, int] = (200, 200),
+        max_frames: int = 0,
+        max_duration: int = 0,
+) -> BackgroundFrames:
+    """
+    Returns frame store for GIF file, one store is created per file, size
+    and limits within a process.
+    """
+
+    key = (os.path.abspath(path), size, max_frames, max_duration)
+    if key not in _shared_stores:
+        _shared_stores[key] = BackgroundFrames(path, size, max_frames, max_duration)
+    return _shared_stores[key]
@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from tempfile import mkdtemp
+from time import perf_counter, strftime
+from traceback import format_exception
+from typing import Callable, Iterator
+from pydantic import ValidationError
+
+from src.exceptions import ImageDownloadError
+from src.schemas import OpenWeatherMapRenderData
+from src.services.avatar_generator import AvatarGenerator
+from src.services.icon_store import IconStore
+from src.utils import CustomJSONLogger
+
+
+# Generator instance of batch worker process
+_worker_generator: AvatarGenerator | None = None
+
+
+def _init_worker(generator_kwargs: dict):
+    """ Creates avatar generator (fonts, icons, GIF frames) once per worker. """
+
+    global _worker_generator
+    _worker_generator = AvatarGenerator(**generator_kwargs)
+
+
+def _render_to_file(payload: bytes, path_prefix: str) -> str:
+    """
+    Renders avatar from OpenWeatherMap response inside worker process.
+    Args:
+        payload: raw JSON of current weather response.
+        path_prefix: output path without city ID, time and extension.
+    Returns:
+        Path to written avatar file.
+    """
+
+    weather_data = OpenWeatherMapRenderData.model_validate_json(payload)
+    avatar = _worker_generator.generate(weather_data)
+    extension = os.path.splitext(_worker_generator.file_name)[1]
+    path = f"{path_prefix}-{weather_data.id}-{weather_data.dt}{extension}"
+    with open(path, "wb") as avatar_file:
+        avatar_file.write(avatar)
+    return path
+
+
+def read_payloads(path: str) -> Iterator[tuple[int, bytes]]:
+    """ Yields line numbers and non-empty lines of JSONL file lazily. """
+
+    with open(path, "rb") as payloads_file:
+        for line_number, line in enumerate(payloads_file, start=1):
+            line = line.strip()
+            if line:
+                yield line_number, line
+
+
+class BatchRenderer:
+    """
+    Renders avatars from recorded OpenWeatherMap responses (JSONL file)
+    in a pool of worker processes. Every worker creates avatar generator
+    once, so fonts, icons and background frames are loaded once per
+    worker. Weather icons responses need are made sure to be stored
+    before workers start. Outputs of every run are written to a new
+    directory.
+    """
+
+    def __init__(
+            self,
+            generator_kwargs: dict,
+            logger: CustomJSONLogger,
+            workers: int | None = None,
+            max_pending: int | None = None,
+            fetch_icons: Callable[[list[str]], None] | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            generator_kwargs: arguments of AvatarGenerator.
+            logger: logger object.
+            workers: number of worker processes (number of CPUs if not set).
+            max_pending: maximum number of submitted renders (4 per worker
+                if not set), the input file is read as renders complete.
+            fetch_icons: function which downloads missing weather icons
+                (by names) to image folder of generator.
+        """
+
+        self._generator_kwargs = generator_kwargs
+        self._logger = logger
+        self._workers = workers or os.cpu_count() or 1
+        self._max_pending = max_pending or self._workers * 4
+        self._fetch_icons = fetch_icons
+
+    def _prepare_icons(self, input_path: str):
+        """
+        Makes sure all weather icons of responses are stored (downloading
+        missing ones once), so that workers don't fail line by line.
+        Raises:
+            ImageDownloadError: if some icons are missing and can't be
+                downloaded.
+        """
+
+        names = set()
+        for _, payload in read_payloads(input_path):
+            try:
+                names.add(OpenWeatherMapRenderData.model_validate_json(payload).weather[0].icon)
+            except ValidationError:
+                # Invalid lines are reported by workers
+                continue
+        folder = self._generator_kwargs["image_folder"]
+        icon_store = IconStore(folder)
+        missing = sorted(name for name in names if not icon_store.exists(name))
+        if missing and self._fetch_icons is not None:
+            self._fetch_icons(missing)
+            missing = [name for name in missing if not icon_store.exists(name)]
+        if missing:
+            raise ImageDownloadError(
+                f"Weather icons are missing in {folder}: {', '.join(missing)}"
+            )
+
+    def _collect(self, done: set[Future], pending: dict[Future, int], summary: dict):
+        for future in done:
+            line_number = pending.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                summary["failed"] += 1
+                self._logger.error({
+                    "event": "render_batch_error",
+                    "line": line_number,
+                    "error": str(e) or type(e).__name__,
+                    "traceback": format_exception(e),
+                })
+            else:
+                summary["rendered"] += 1
+
+    def run(self, input_path: str, output_folder: str) -> dict:
+        """
+        Renders all responses of JSONL file.
+        Args:
+            input_path: path to JSONL file with one current weather
+                response per line.
+            output_folder: folder where directory of this run is created.
+        Raises:
+            ImageDownloadError: if weather icons are missing and can't be
+                downloaded.
+        Returns:
+            Summary: output directory, number of rendered and failed
+            avatars, duration and throughput.
+        """
+
+        self._prepare_icons(input_path)
+        os.makedirs(output_folder, exist_ok=True)
+        run_folder = mkdtemp(prefix=strftime("%Y%m%d-%H%M%S-"), dir=output_folder)
+        summary = {
+            "output": run_folder,
+            "workers": self._workers,
+            "rendered": 0,
+            "failed": 0,
+        }
+        started_at = perf_counter()
+        pending: dict[Future, int] = {}
+        with ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self._generator_kwargs,),
+        ) as executor:
+            for index, (line_number, payload) in enumerate(read_payloads(input_path)):
+                if len(pending) >= self._max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done, pending, summary)
+                path_prefix = os.path.join(run_folder, f"{index:06d}")
+                future = executor.submit(_render_to_file, payload, path_prefix)
+                pending[future] = line_number
+            done, _ = wait(pending)
+            self._collect(done, pending, summary)
+        duration = perf_counter() - started_at
+        summary["seconds"] = round(duration, 3)
+        summary["avatars_per_second"] = round(summary["rendered"] / duration, 2)
+        self._logger.info({"event": "render_batch", **summary})
+        return summary
+
@@ -0,0 +1,146 @@
+from threading import Lock
+from typing import Hashable, Iterator
+from PIL import Image
+
+from src.services.background_frames import PreparedFrames
+
+
+class PILCompositor:
+    """ Composites overlay onto every background frame with Pillow. """
+
+    name = "pil"
+
+    def composite(
+            self,
+            prepared: PreparedFrames,
+            overlay: Image.Image,
+            key: Hashable | None = None,
+    ) -> Iterator[bytes]:
+        """
+        Composites overlay onto background frames one by one.
+        Args:
+            prepared: prepared background frames.
+            overlay: RGBA overlay of the same size as frames.
+            key: identity of frames (unused).
+        Returns:
+            Iterator of raw RGBA frames.
+        """
+
+        for frame in prepared.frames:
+            yield Image.alpha_composite(frame, overlay).tobytes()
+
+
+class NumPyCompositor:
+    """
+    Composites overlay onto all background frames at once with NumPy.
+    Background frames are stacked into one contiguous uint8 array, only
+    the stack of the latest frames is kept (it is a second copy of
+    frames), semi-transparent overlay pixels are blended into
+    all frames at once with batched integer operations and opaque ones are
+    copied as is.
+    The arithmetic repeats Pillow's alpha_composite, so results are
+    pixel-identical.
+    """
+
+    name = "numpy"
+
+    # Pillow's alpha compositing precision
+    PRECISION_BITS = 7
+
+    def __init__(self):
+        import numpy
+        self._np = numpy
+        # Key of the latest frames and their stack (frames themselves
+        # aren't referenced, so replaced ones can be collected)
+        self._stack_key: Hashable | None = None
+        self._stack_cache: "numpy.ndarray | None" = None
+        self._lock = Lock()
+
+    def _stack(self, prepared: PreparedFrames, key: Hashable | None):
+        """ Returns frames stacked into (frames, height, width, 4) array. """
+
+        with self._lock:
+            if key is not None and key == self._stack_key:
+                return self._stack_cache
+            stack = self._np.stack([
+                self._np.asarray(frame, dtype=self._np.uint8)
+                for frame in prepared.frames
+            ])
+            if key is not None:
+                self._stack_key, self._stack_cache = key, stack
+            return stack
+
+    def _shift_div_255(self, value):
+        return ((value >> 8) + value) >> 8
+
+    def composite(
+            self,
+            prepared: PreparedFrames,
+            overlay: Image.Image,
+            key: Hashable | None = None,
+    ) -> Iterator[bytes]:
+        """
+        Composites overlay onto all background frames.
+        Args:
+            prepared: prepared background frames.
+            overlay: RGBA overlay of the same size as frames.
+            key: identity of frames (e.g. GIF signature), the stack is
+                reused while it is the same (None - stacked every time).
+        Returns:
+            Iterator of raw RGBA frames.
+        """
+
+        np = self._np
+        stack = self._stack(prepared, key)
+        count, height, width, _ = stack.shape
+        # Every pixel is one uint32 element, so pixels are copied at once
+        frames = stack.view(np.uint32).reshape(count, height * width)
+        src = np.asarray(overlay, dtype=np.uint8).reshape(height * width, 4)
+        src_a = src[:, 3]
+        # Opaque overlay pixels replace background pixels as they are
+        opaque = np.flatnonzero(src_a == 255)
+        opaque_pixels = src.view(np.uint32).ravel()[opaque]
+        # Only semi-transparent pixels (antialiased edges) are blended,
+        # for all frames at once
+        partial = np.flatnonzero((src_a != 0) & (src_a != 255))
+        if partial.size:
+            src = src[partial].astype(np.uint32)
+            dst = stack.reshape(count, height * width, 4)[:, partial].astype(np.uint32)
+            src_a = src[:, 3]
+            outa255 = src_a * 255 + dst[..., 3] * (255 - src_a)
+            coef1 = (src_a * (255 * 255 << self.PRECISION_BITS)) // outa255
+            coef2 = (255 << self.PRECISION_BITS) - coef1
+            rgb = src[:, :3] * coef1[..., None] + dst[..., :3] * coef2[..., None]
+            rgb = self._shift_div_255(rgb + (0x80 << self.PRECISION_BITS)) >> self.PRECISION_BITS
+            alpha = self._shift_div_255(outa255 + 0x80)
+            blended = np.concatenate((rgb, alpha[..., None]), axis=-1).astype(np.uint8)
+            blended = blended.view(np.uint32)[..., 0]
+        # Output frames are assembled one by one (a frame fits in CPU cache)
+        for index in range(count):
+            frame = frames[index].copy()
+            frame[opaque] = opaque_pixels
+            if partial.size:
+                frame[partial] = blended[index]
+            yield frame.view(np.uint8).data
+
+
+def create_compositor(name: str = "pil") -> PILCompositor | NumPyCompositor:
+    """
+    Creates compositor.
+    Args:
+        name: "pil", "numpy" or "auto" (NumPy if it is installed).
+    Raises:
+        ImportError: if NumPy compositor is requested, but NumPy isn't
+            installed.
+        ValueError: if compositor is unknown.
+    """
+
+    if name not in ("pil", "numpy", "auto"):
+        raise ValueError(f"Unknown compositor: {name}")
+    if name in ("numpy", "auto"):
+        try:
+            return NumPyCompositor()
+        except ImportError:
+            if name == "numpy":
+                raise
+    return PILCompositor()
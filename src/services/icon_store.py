@@ -0,0 +1,135 @@
+import os
+from asyncio import CancelledError, Future, get_running_loop, shield
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Awaitable, Callable
+from PIL import Image
+
+
+# All weather icons OpenWeatherMap uses (day and night variants)
+KNOWN_ICONS = tuple(
+    code + time_of_day
+    for code in ("01", "02", "03", "04", "09", "10", "11", "13", "50")
+    for time_of_day in ("d", "n")
+)
+
+
+class IconStore:
+    """
+    Store of weather icons. Icons are kept on disk in a folder and
+    decoded ones are cached in memory (LRU). Concurrent downloads of the
+    same icon are coalesced into one.
+    """
+
+    def __init__(self, folder: str, capacity: int = len(KNOWN_ICONS)):
+        """
+        Initializer.
+        Args:
+            folder: path to folder with icons.
+            capacity: maximum number of decoded icons kept in memory.
+        """
+
+        self._folder = folder
+        self._capacity = capacity
+        self._cache: OrderedDict[str, Image.Image] = OrderedDict()
+        self._lock = Lock()
+        self._on_disk: set[str] = set()
+        self._downloads: dict[str, Future] = {}
+
+    def path(self, name: str) -> str:
+        """ Returns path to icon file. """
+
+        return os.path.join(self._folder, name + ".png")
+
+    def exists(self, name: str) -> bool:
+        """ Checks if icon is stored on disk (file is checked only once). """
+
+        if name not in self._on_disk and os.path.exists(self.path(name)):
+            self._on_disk.add(name)
+        return name in self._on_disk
+
+    def get(self, name: str) -> Image.Image:
+        """
+        Returns decoded icon. The image is shared, it must not be changed.
+        Args:
+            name: name of icon (w/o extension).
+        Returns:
+            Icon image.
+        """
+
+        with self._lock:
+            icon = self._cache.get(name)
+            if icon is not None:
+                self._cache.move_to_end(name)
+                return icon
+        icon = Image.open(self.path(name), "r")
+        icon.load()
+        with self._lock:
+            self._cache[name] = icon
+            while len(self._cache) > self._capacity:
+                self._cache.popitem(last=False)
+        return icon
+
+    def save(self, name: str, data: bytes) -> str:
+        """
+        Writes icon file atomically (through temporary file and rename).
+        Args:
+            name: name of icon (w/o extension).
+            data: content of PNG file.
+        Returns:
+            Path to icon file.
+        """
+
+        path = self.path(name)
+        with NamedTemporaryFile(
+                "wb",
+                dir=self._folder,
+                prefix=f".{name}-",
+                suffix=".tmp",
+                delete=False,
+        ) as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_file.name, path)
+        self._on_disk.add(name)
+        with self._lock:
+            self._cache.pop(name, None)
+        return path
+
+    async def ensure(
+            self,
+            name: str,
+            download: Callable[[str], Awaitable[bytes]],
+    ) -> str:
+        """
+        Makes sure icon is stored on disk, downloading it if necessary.
+        Only one download per icon runs at a time, other callers wait
+        for it.
+        Args:
+            name: name of icon (w/o extension).
+            download: coroutine function which downloads icon content.
+        Returns:
+            Path to icon file.
+        """
+
+        if self.exists(name):
+            return self.path(name)
+        if name in self._downloads:
+            return await shield(self._downloads[name])
+        future = get_running_loop().create_future()
+        self._downloads[name] = future
+        try:
+            path = self.save(name, await download(name))
+        except CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Don't warn about exception nobody waits for
+            future.exception()
+            raise
+        else:
+            future.set_result(path)
+            return path
+        finally:
+            del self._downloads[name]
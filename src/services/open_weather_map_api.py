@@ -1,13 +1,39 @@
-import os
-from aiohttp import ClientSession, ClientOSError
-from asyncio import sleep as aio_sleep
+from aiohttp import ClientError, ClientResponseError, ClientSession, ClientTimeout
+from asyncio import gather
+from functools import partial
+from json import loads
 from pydantic import ValidationError
 from sys import exc_info
 from traceback import format_exception
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
 
-from src.schemas import OpenWeatherMapResponse
-from src.exceptions import WeatherDataDownloadError, ImageDownloadError
-from src.utils import CustomJSONLogger
+from src.schemas import (
+    OpenWeatherMapRenderData, OpenWeatherMapRenderForecast,
+    OpenWeatherMapRenderGroup,
+)
+from src.exceptions import (
+    CircuitOpenError, ImageDownloadError, OpenWeatherMapAPIError,
+    WeatherDataDownloadError,
+)
+from src.services.icon_store import IconStore, KNOWN_ICONS
+from src.services.weather_cache import WeatherCache
+from src.utils import CircuitBreaker, CustomJSONLogger, Metrics, RetryPolicy
+
+
+T = TypeVar("T")
+
+# Maximum number of city IDs OpenWeatherMap group API accepts at once
+GROUP_REQUEST_LIMIT = 20
+# Response statuses which are worth retrying (other errors won't go away)
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def is_retryable(error: Exception) -> bool:
+    """ Checks if failed OpenWeatherMap request is worth retrying. """
+
+    if isinstance(error, ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (ClientError, ConnectionError, TimeoutError, ValidationError))
 
 
 class OpenWeatherMapAPI:
@@ -21,6 +47,13 @@ class OpenWeatherMapAPI:
             city_id: str,
             logger: CustomJSONLogger,
             client_session: ClientSession,
+            group_api_url: str | None = None,
+            icon_store: IconStore | None = None,
+            cache: WeatherCache | None = None,
+            metrics: Metrics | None = None,
+            retry_policy: RetryPolicy | None = None,
+            circuit_breaker: CircuitBreaker | None = None,
+            forecast_api_url: str | None = None,
     ):
         """
         Initializer.
@@ -29,133 +62,441 @@ class OpenWeatherMapAPI:
             api_url: OpenWeatherMap API URL.
             image_url_template: URL template for downloading weather image.
             cache_folder_path: path to folder where icons will be stored.
+            city_id: default city ID.
             logger: logger object.
             client_session: persistent client session.
+            group_api_url: OpenWeatherMap group API URL (weather for
+                several cities in one request), cities are requested
+                one by one if not set.
+            icon_store: store of weather icons (shared with avatar
+                generators), created for cache folder if not set.
+            cache: cache of weather observations (disabled if not set).
+            metrics: metrics of icon downloads and retries.
+            retry_policy: retries of weather and icon requests.
+            circuit_breaker: circuit breaker of OpenWeatherMap (requests
+                are rejected while it is open, stale cached weather is
+                served instead if possible).
+            forecast_api_url: OpenWeatherMap forecast API URL (forecast
+                isn't available if not set).
         """
 
         self._api_token = api_token
         self._api_url = api_url
+        self._api_group_url = group_api_url
+        self._api_forecast_url = forecast_api_url
         self._api_image_url = image_url_template
-        self._cache_folder_path = cache_folder_path
         self._city_id = city_id
         self._logger = logger
         self._client_session = client_session
+        self._icon_store = icon_store or IconStore(cache_folder_path)
+        self._cache = cache
+        self._metrics = metrics or Metrics(logger)
+        self._retry = retry_policy or RetryPolicy(logger=logger, metrics=self._metrics)
+        self._breaker = circuit_breaker or CircuitBreaker(
+            "openweathermap", logger=logger, metrics=self._metrics,
+        )
 
-    def _weather_image_exists(self, image_name: str) -> bool:
+    async def _download_weather_image(
+            self,
+            image_name: str,
+            deadline: float | None = None,
+    ) -> bytes:
         """
-        Check if weather image icon is exists in folder.
+        Method which downloads a weather icon from OpenWeatherMap API
+        (with retries).
         Args:
-            image_name: name of image (w/o extension).
+            image_name: name of weather icon (w/o extension).
+            deadline: deadline (monotonic time) of all attempts.
+        Raises:
+            ImageDownloadError: if icon can't be downloaded.
         Returns:
-            True if image is exist, else False.
+            Content of image file.
         """
 
-        img_path = os.path.join(self._cache_folder_path, image_name + ".png")
-        exists = os.path.exists(img_path)
+        url = self._api_image_url.format(image_name)
+        self._logger.info({
+            "event": "download_image",
+            "image_name": image_name,
+        })
+
+        async def attempt(timeout: float) -> bytes:
+            async with self._client_session.get(
+                    url=url,
+                    timeout=ClientTimeout(total=timeout),
+            ) as resp:
+                resp.raise_for_status()
+                return await resp.read()
+
+        with self._metrics.span("icon_download", image_name=image_name) as span:
+            try:
+                data = await self._retry.run(
+                    "icon", attempt, is_retryable, deadline, self._breaker,
+                )
+            except (CircuitOpenError, ClientError, ConnectionError, TimeoutError) as e:
+                self._logger.exception({
+                    "event": "error",
+                    "error": str(e),
+                    "traceback": format_exception(*exc_info()),
+                })
+                raise ImageDownloadError(f"Can't get image: {e!r}") from e
+            span.bytes = len(data)
         self._logger.info({
-            "event": "check_local_image",
+            "event": "load_complete",
             "image_name": image_name,
-            "image_path": img_path,
-            "is_exists": exists,
         })
-        return exists
+        return data
 
-    async def get_weather_image(self, image_name: str) -> str:
+    async def get_weather_image(
+            self,
+            image_name: str,
+            deadline: float | None = None,
+    ) -> str:
         """
-        Method which downloads a weather icon from OpenWeatherMap API.
+        Method which returns path to a weather icon, the icon is downloaded
+        from OpenWeatherMap API if it isn't stored yet (only once if it is
+        requested concurrently).
         Args:
             image_name: name of weather icon (w/o extension).
+            deadline: deadline (monotonic time) of download.
         Raises:
-            ImageDownloadError: if OpenWeatherMap API returns response
-                with status code different from 200 or request raises
-                aiohttp.ClientError.
+            ImageDownloadError: if icon can't be downloaded.
         Returns:
-            Path to new image.
+            Path to image.
+        """
+
+        return await self._icon_store.ensure(
+            image_name,
+            partial(self._download_weather_image, deadline=deadline),
+        )
+
+    async def prefetch_weather_images(self):
+        """
+        Downloads all known weather icons which aren't stored yet.
+        Raises:
+            ImageDownloadError: if some icon can't be downloaded.
+        """
+
+        await gather(*(self.get_weather_image(name) for name in KNOWN_ICONS))
+
+    async def _request(
+            self,
+            url: str,
+            payload: dict[str, Any],
+            parse: Callable[[bytes], Awaitable[T]],
+            deadline: float | None = None,
+    ) -> T:
+        """
+        Makes a GET request to OpenWeatherMap API with retries.
+        Args:
+            url: request URL.
+            payload: query string parameters.
+            parse: coroutine function which validates raw JSON response
+                body.
+            deadline: deadline (monotonic time) of all attempts.
+        Raises:
+            WeatherDataDownloadError: if OpenWeatherMap API doesn't
+                respond properly.
+        Returns:
+            Result of parse callable.
         """
 
-        url = self._api_image_url.format(image_name)
         self._logger.info({
-            "event": "download_image",
-            "image_name": image_name,
+            "event": "request_weather",
+            "payload": {k: v for k, v in payload.items() if k != "appid"},
+            "url": url,
         })
+
+        async def attempt(timeout: float) -> T:
+            async with self._client_session.get(
+                    url=url,
+                    params=payload,
+                    timeout=ClientTimeout(total=timeout),
+            ) as response:
+                response.raise_for_status()
+                response_body = await response.read()
+            return await parse(response_body)
+
         try:
-            resp = await self._client_session.get(url=url)
-        except (ConnectionResetError, ClientOSError) as e:
+            return await self._retry.run(
+                "weather", attempt, is_retryable, deadline, self._breaker,
+            )
+        except (
+                CircuitOpenError, ClientError, ConnectionError, TimeoutError,
+                ValidationError,
+        ) as request_error:
             self._logger.exception({
-                "event": "error",
-                "error": str(e),
+                "event": "exception",
+                "error": str(request_error),
                 "traceback": format_exception(*exc_info()),
             })
-            raise ImageDownloadError("Can't get image")
-        if resp.status != 200:
-            raise ImageDownloadError(f"Response status: {resp.status}")
-        data = await resp.read()
-        new_image_path = os.path.join(self._cache_folder_path, image_name + ".png")
-        with open(new_image_path, "wb") as image_file:
-            image_file.write(data)
-        self._logger.info({
-            "event": "load_complete",
-            "image_name": image_name,
-        })
-        return new_image_path
+            raise WeatherDataDownloadError(
+                "Couldn't update weather data from OpenWeatherMap..."
+            ) from request_error
+
+    async def _fetch_weather_data(
+            self,
+            city_id: int,
+            deadline: float | None = None,
+    ) -> OpenWeatherMapRenderData:
+        """
+        Requests current weather data for one city from OpenWeatherMap API.
+        """
+
+        async def parse(response_body: bytes) -> OpenWeatherMapRenderData:
+            # Raw bytes are validated into fields which are rendered only
+            validated_response_body = OpenWeatherMapRenderData.from_json(response_body)
+            self._logger.info({
+                "event": "response",
+                "city_id": validated_response_body.id,
+            })
+            # Full data is decoded only if debug level is enabled
+            self._logger.debug(lambda: {
+                "event": "response_data",
+                "data": loads(response_body),
+            })
+            return validated_response_body
 
-    async def get_weather_data(self) -> OpenWeatherMapResponse | None:
+        # Necessary information for request which loading in query string
+        payload = {
+            "id": city_id,
+            "appid": self._api_token,
+            "units": "metric",
+        }
+        return await self._request(self._api_url, payload, parse, deadline)
+
+    async def get_weather_data(
+            self,
+            city_id: int | None = None,
+    ) -> OpenWeatherMapRenderData:
         """
-        Method which makes a GET request to OpenWeatherMap API in order to
-        get current temperature and weather icon name to your city.
-        Returns the tuple of updated weather data (temperature
-        and weather icon name).
+        Method which gets current weather data to your city (from cache if
+        observation is still fresh, else from OpenWeatherMap API). Weather
+        icon is downloaded if necessary.
+        Args:
+            city_id: city ID (default city is used if not set).
         Raises:
             WeatherDataDownloadError: if OpenWeatherMap API returns
                 response with status code different from 200.
         Returns:
-            tuple with current weather icon name and all weather data from API.
+            Current weather data.
         """
 
-        # Necessary information for request which loading in query string
+        city_id = city_id or self._city_id
+        return (await self.get_weather_data_many([city_id]))[city_id]
+
+    async def _get_group_weather_data(
+            self,
+            city_ids: list[int],
+            deadline: float | None = None,
+    ) -> list[OpenWeatherMapRenderData]:
+        """
+        Requests weather data for several cities from OpenWeatherMap group
+        API in one request.
+        """
+
+        async def parse(response_body: bytes) -> list[OpenWeatherMapRenderData]:
+            validated_response_body = OpenWeatherMapRenderGroup.from_json(response_body)
+            self._logger.info({
+                "event": "response",
+                "city_ids": [item.id for item in validated_response_body.items],
+            })
+            self._logger.debug(lambda: {
+                "event": "response_data",
+                "data": loads(response_body),
+            })
+            return validated_response_body.items
+
         payload = {
-            "id": self._city_id,
+            "id": ",".join(str(city_id) for city_id in city_ids),
             "appid": self._api_token,
             "units": "metric",
         }
+        return await self._request(self._api_group_url, payload, parse, deadline)
+
+    async def get_weather_data_many(
+            self,
+            city_ids: Iterable[int],
+    ) -> dict[int, OpenWeatherMapRenderData]:
+        """
+        Method which gets current weather data for several cities with as
+        few requests as possible: fresh observations are taken from cache,
+        other cities are requested once, with group API if it is
+        configured (otherwise concurrently). Weather icons are downloaded
+        if necessary.
+        Args:
+            city_ids: city IDs.
+        Raises:
+            WeatherDataDownloadError: if weather data of some city can't
+                be got.
+        Returns:
+            Mapping of city ID to its current weather data.
+        """
+
+        ids = sorted(set(city_ids))
+        # All requests of this call (with retries) share one deadline
+        deadline = self._retry.new_deadline()
+        result = {}
+        # Take fresh observations from cache
+        if self._cache is not None:
+            for city_id in ids:
+                snapshot = self._cache.get(city_id)
+                if snapshot is not None:
+                    result[city_id] = snapshot
+        to_fetch = [city_id for city_id in ids if city_id not in result]
+        if to_fetch:
+            try:
+                fetched = await self._fetch_many(to_fetch, deadline)
+            except OpenWeatherMapAPIError as e:
+                fetched = self._get_stale(to_fetch, e)
+            else:
+                if self._cache is not None:
+                    for snapshot in fetched.values():
+                        self._cache.put(snapshot)
+            result.update(fetched)
+        icon_names = {item.weather[0].icon for item in result.values()}
+        await gather(*(self.get_weather_image(name, deadline) for name in icon_names))
+        return result
+
+    async def get_forecast(
+            self,
+            city_id: int | None = None,
+    ) -> list[OpenWeatherMapRenderData]:
+        """
+        Method which gets weather forecast (5 day / 3 hour) for city.
+        Weather icons of forecast are downloaded if necessary.
+        Args:
+            city_id: city ID (default city is used if not set).
+        Raises:
+            WeatherDataDownloadError: if forecast API URL isn't set or
+                forecast can't be got.
+        Returns:
+            Forecast items as weather data, ordered by time.
+        """
+
+        if not self._api_forecast_url:
+            raise WeatherDataDownloadError("Forecast API URL isn't set")
+        city_id = city_id or self._city_id
+        deadline = self._retry.new_deadline()
+
+        async def parse(response_body: bytes) -> list[OpenWeatherMapRenderData]:
+            snapshots = OpenWeatherMapRenderForecast.model_validate_json(
+                response_body
+            ).snapshots()
+            self._logger.info({
+                "event": "forecast_response",
+                "city_id": city_id,
+                "items": len(snapshots),
+            })
+            return snapshots
+
+        payload = {
+            "id": city_id,
+            "appid": self._api_token,
+            "units": "metric",
+        }
+        with self._metrics.span("forecast_fetch", city_id=city_id):
+            result = await self._request(
+                self._api_forecast_url, payload, parse, deadline,
+            )
+        icon_names = {item.weather[0].icon for item in result}
+        await gather(*(self.get_weather_image(name, deadline) for name in icon_names))
+        return sorted(result, key=lambda item: item.dt)
+
+    async def _fetch_many(
+            self,
+            city_ids: list[int],
+            deadline: float,
+    ) -> dict[int, OpenWeatherMapRenderData]:
+        """
+        Requests weather data for cities, with group API if it is
+        configured (otherwise concurrently).
+        """
+
+        if len(city_ids) == 1 or not self._api_group_url:
+            responses = await gather(
+                *(self._fetch_weather_data(i, deadline) for i in city_ids)
+            )
+            return dict(zip(city_ids, responses))
+        chunks = [
+            city_ids[i:i + GROUP_REQUEST_LIMIT]
+            for i in range(0, len(city_ids), GROUP_REQUEST_LIMIT)
+        ]
+        fetched = {}
+        for items in await gather(
+                *(self._get_group_weather_data(c, deadline) for c in chunks)
+        ):
+            for item in items:
+                fetched[item.id] = item
+        missing = [city_id for city_id in city_ids if city_id not in fetched]
+        if missing:
+            raise WeatherDataDownloadError(
+                f"No weather data for cities: {missing}"
+            )
+        return fetched
+
+    def get_last_known(
+            self,
+            city_ids: Iterable[int],
+    ) -> dict[int, OpenWeatherMapRenderData] | None:
+        """
+        Returns the last known weather of cities persisted by cache (no
+        network requests), so that avatars can be rendered at startup
+        while the current weather is being fetched.
+        Args:
+            city_ids: city IDs.
+        Returns:
+            Mapping of city ID to its last known weather (marked as
+            stale) or None if some city has no snapshot or icon on disk.
+        """
+
+        if self._cache is None:
+            return None
+        result = {}
+        for city_id in sorted(set(city_ids)):
+            snapshot = self._cache.get_stale(city_id)
+            if snapshot is None or not self._icon_store.exists(snapshot.weather[0].icon):
+                return None
+            result[city_id] = snapshot.as_stale()
         self._logger.info({
-            "event": "request_weather",
-            "payload": payload,
-            "url": self._api_url,
+            "event": "warm_start",
+            "observed_at": {
+                city_id: WeatherCache.observed_at(snapshot)
+                for city_id, snapshot in result.items()
+            },
         })
-        # Trying making request
-        attempts = 3
-        sleep_time = 5
-        validated_response_body = None
-        for i in range(attempts):
-            try:
-                response = await self._client_session.get(
-                    url=self._api_url,
-                    params=payload,
-                )
-                response_body = await response.json(encoding="utf-8")
-                validated_response_body = OpenWeatherMapResponse(**response_body)
-                self._logger.info({
-                    "event": "response",
-                    "data": validated_response_body.dict(),
-                })
-                icon_name = validated_response_body.weather[0].icon
-                if not self._weather_image_exists(icon_name):
-                    await self.get_weather_image(icon_name)
-                break
-            except (ConnectionResetError, ClientOSError, ValidationError) as request_error:
-                self._logger.exception({
-                    "event": "exception",
-                    "error": str(request_error),
-                    "traceback": format_exception(*exc_info()),
-                })
-                if i < attempts:
-                    await aio_sleep(sleep_time)
-                    continue
-                raise WeatherDataDownloadError(
-                    "Couldn't update weather data from OpenWeatherMap..."
-                )
-        return validated_response_body
+        return result
+
+    def _get_stale(
+            self,
+            city_ids: list[int],
+            error: OpenWeatherMapAPIError,
+    ) -> dict[int, OpenWeatherMapRenderData]:
+        """
+        Returns the last known weather of cities when OpenWeatherMap is
+        unavailable, so that current avatars are kept.
+        Raises:
+            OpenWeatherMapAPIError: the original error if some city has
+                no cached weather.
+        """
+
+        stale = {
+            city_id: self._cache.get_stale(city_id) if self._cache else None
+            for city_id in city_ids
+        }
+        if any(snapshot is None for snapshot in stale.values()):
+            raise error
+        stale = {city_id: snapshot.as_stale() for city_id, snapshot in stale.items()}
+        self._logger.warning({
+            "event": "serve_stale_weather",
+            "city_ids": city_ids,
+            "error": str(error),
+            "circuit": self._breaker.state,
+            "observed_at": {
+                city_id: WeatherCache.observed_at(snapshot)
+                for city_id, snapshot in stale.items()
+            },
+        })
+        return stale
 
 
 if __name__ == "__main__":
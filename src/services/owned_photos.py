@@ -0,0 +1,101 @@
+from telethon.tl.types import InputPhoto, Photo
+
+from src.utils import StateStore
+
+
+# Maximum number of photos deleted with one request
+DELETE_BATCH_SIZE = 100
+
+
+def _dump_photo(photo: InputPhoto) -> dict:
+    return {
+        "id": photo.id,
+        "access_hash": photo.access_hash,
+        "file_reference": photo.file_reference.hex(),
+    }
+
+
+def _load_photo(data: dict) -> InputPhoto:
+    return InputPhoto(
+        id=data["id"],
+        access_hash=data["access_hash"],
+        file_reference=bytes.fromhex(data["file_reference"]),
+    )
+
+
+class OwnedPhotos:
+    """
+    Profile photos of account which were uploaded by the application,
+    persisted in state file. Only these photos are ever deleted, so
+    profile photos uploaded by the user stay untouched and the photo list
+    doesn't have to be requested every cycle.
+    """
+
+    STATE_KEY = "owned_photos:{}"
+
+    def __init__(self, state: StateStore, account_name: str):
+        """
+        Initializer.
+        Args:
+            state: application state store.
+            account_name: account name.
+        """
+
+        self._state = state
+        self._key = self.STATE_KEY.format(account_name)
+        data = state.get(self._key) or {}
+        self.current: InputPhoto | None = (
+            _load_photo(data["current"]) if data.get("current") else None
+        )
+        # Photos which should have been deleted, but deletion has failed
+        self.leftovers: list[InputPhoto] = [
+            _load_photo(item) for item in data.get("leftovers", ())
+        ]
+
+    def to_delete(self) -> list[InputPhoto]:
+        """
+        Returns leftover photos which are deleted while new avatar is set
+        (the current photo is deleted only after it has been replaced).
+        """
+
+        return self.leftovers[:DELETE_BATCH_SIZE]
+
+    def replace(self, photo: Photo | None, deleted: list[InputPhoto] | None):
+        """
+        Records result of avatar update.
+        Args:
+            photo: new current photo (None if it hasn't been set).
+            deleted: photos which have been deleted (photos which haven't
+                been deleted are kept as leftovers, the current one stays
+                current if new photo hasn't been set).
+        """
+
+        previous = [self.current] if self.current else []
+        if photo is not None:
+            self.current = InputPhoto(
+                id=photo.id,
+                access_hash=photo.access_hash,
+                file_reference=photo.file_reference,
+            )
+            self.leftovers.extend(previous)
+        deleted_ids = {item.id for item in deleted or ()}
+        self.leftovers = [
+            item for item in self.leftovers if item.id not in deleted_ids
+        ]
+        if self.current is not None and self.current.id in deleted_ids:
+            self.current = None
+        self._save()
+
+    def forget(self, photo_ids: set[int]):
+        """ Stops tracking photos (e.g. deleted by cleanup). """
+
+        self.leftovers = [item for item in self.leftovers if item.id not in photo_ids]
+        if self.current is not None and self.current.id in photo_ids:
+            self.current = None
+        self._save()
+
+    def _save(self):
+        self._state.set(self._key, {
+            "current": _dump_photo(self.current) if self.current else None,
+            "leftovers": [_dump_photo(item) for item in self.leftovers],
+        })
@@ -0,0 +1,195 @@
+from asyncio import Event
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import TYPE_CHECKING, Iterator
+
+from src.exceptions import OpenWeatherMapAPIError
+from src.utils import CustomJSONLogger, Metrics
+
+if TYPE_CHECKING:
+    from src.schemas import AccountContext
+    from src.services.open_weather_map_api import OpenWeatherMapAPI
+
+
+# Step of OpenWeatherMap forecast items (seconds)
+FORECAST_STEP = 3 * 3600
+
+
+class PrerenderCache:
+    """
+    Bounded cache (LRU) of rendered avatars keyed by render key, so that
+    avatar which has been rendered beforehand is only uploaded.
+    """
+
+    def __init__(self, capacity: int = 16):
+        """
+        Initializer.
+        Args:
+            capacity: maximum number of kept avatars.
+        """
+
+        self._capacity = capacity
+        self._avatars: OrderedDict[str, tuple[bytes, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, render_key: str) -> bool:
+        return render_key in self._avatars
+
+    def __len__(self) -> int:
+        return len(self._avatars)
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def hit_rate(self) -> float:
+        """ Share of lookups which have found avatar. """
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, render_key: str) -> tuple[bytes, dict] | None:
+        """
+        Returns pre-rendered avatar (lookup is counted as hit or miss).
+        Args:
+            render_key: render key of avatar.
+        Returns:
+            Content of avatar file and its video encoding parameters (empty
+            for static avatars) or None.
+        """
+
+        item = self._avatars.get(render_key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._avatars.move_to_end(render_key)
+        return item
+
+    def put(self, render_key: str, avatar: bytes, encoding: dict | None = None):
+        """ Stores avatar, the least recently used one is evicted if full. """
+
+        self._avatars[render_key] = (avatar, encoding or {})
+        self._avatars.move_to_end(render_key)
+        while len(self._avatars) > self._capacity:
+            self._avatars.popitem(last=False)
+
+
+class Prerenderer:
+    """
+    Periodic job which requests weather forecast for cities of accounts
+    and renders upcoming avatars into cache while no avatar update is in
+    progress. An update whose weather matches forecast (equal render key)
+    takes avatar from cache and only uploads it.
+    """
+
+    def __init__(
+            self,
+            open_weather_map: "OpenWeatherMapAPI",
+            accounts: list["AccountContext"],
+            logger: CustomJSONLogger,
+            metrics: Metrics,
+            cache: PrerenderCache | None = None,
+            horizon: int = FORECAST_STEP,
+    ):
+        """
+        Initializer.
+        Args:
+            open_weather_map: OpenWeatherMap API service (forecast API URL
+                must be set).
+            accounts: accounts whose avatars are pre-rendered.
+            logger: logger object.
+            metrics: metrics object.
+            cache: cache of rendered avatars.
+            horizon: how far ahead (seconds) forecast is rendered.
+        """
+
+        self._open_weather_map = open_weather_map
+        self._accounts = accounts
+        self._logger = logger
+        self._metrics = metrics
+        self.cache = cache or PrerenderCache()
+        self._horizon = horizon
+        self._updates = 0
+        self._idle = Event()
+        self._idle.set()
+
+    @contextmanager
+    def pause(self) -> Iterator[None]:
+        """ Holds pre-rendering while code block (avatar update) runs. """
+
+        self._updates += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._updates -= 1
+            if not self._updates:
+                self._idle.set()
+
+    async def prerender(self, now: float | None = None) -> int:
+        """
+        Renders avatars of upcoming forecast which aren't cached yet
+        (the nearest first, at most cache capacity per account).
+        Args:
+            now: current time (UNIX timestamp).
+        Raises:
+            OpenWeatherMapAPIError: if forecast can't be got.
+        Returns:
+            Number of rendered avatars.
+        """
+
+        now = time() if now is None else now
+        rendered = 0
+        for city_id in sorted({account.city_id for account in self._accounts}):
+            started_at = perf_counter()
+            forecast = [
+                item
+                for item in await self._open_weather_map.get_forecast(city_id)
+                # The current forecast item is valid until the next one
+                if now - FORECAST_STEP < item.dt <= now + self._horizon
+            ]
+            city_rendered = 0
+            for account in self._accounts:
+                if account.city_id != city_id:
+                    continue
+                generator = account.avatar_generator
+                for item in forecast[:self.cache.capacity]:
+                    render_key = generator.render_key(item)
+                    if render_key in self.cache:
+                        continue
+                    # Avatar updates go first
+                    await self._idle.wait()
+                    encoding = {}
+                    with self._metrics.span("prerender", account=account.name) as span:
+                        avatar = await generator.generate_async(item, None, encoding)
+                        span.bytes = len(avatar)
+                    self.cache.put(render_key, avatar, encoding)
+                    city_rendered += 1
+            rendered += city_rendered
+            self._logger.info({
+                "event": "prerender",
+                "city_id": city_id,
+                "forecast_items": len(forecast),
+                "rendered": city_rendered,
+                "cached": len(self.cache),
+                "duration_ms": round((perf_counter() - started_at) * 1000, 3),
+            })
+        return rendered
+
+    async def refresh(self):
+        """
+        Pre-renders upcoming forecast (periodic job), unavailable forecast
+        is only logged.
+        """
+
+        try:
+            await self.prerender()
+        except OpenWeatherMapAPIError as e:
+            self._logger.warning({
+                "event": "prerender_failed",
+                "error": str(e),
+            })
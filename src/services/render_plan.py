@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from PIL import Image, ImageDraw, ImageFont
+
+from src.schemas import AvatarLayout, LayoutText
+from src.services.icon_store import IconStore
+
+
+# Fonts are shared between render plans
+_load_font = lru_cache(maxsize=None)(ImageFont.truetype)
+
+# Characters of drawn texts: temperature ("+23 C") and humidity with wind
+# speed ("46%   0.67 m/c"), their glyphs are rasterized beforehand
+GLYPH_VOCABULARY = "0123456789+-. %Cm/c"
+
+
+class TextRun:
+    """
+    Compiled text element of layout. Glyphs are rasterized once and texts
+    are assembled from cached glyph masks placed with font advances and
+    kerning, the result is identical to drawing text with ImageDraw.
+    """
+
+    def __init__(self, element: LayoutText, font_file: str, color: tuple[int, int, int]):
+        """
+        Initializer.
+        Args:
+            element: text element of layout.
+            font_file: font file (if element doesn't set its own).
+            color: text color (if element doesn't set its own).
+        """
+
+        self._xy = (element.x, element.y)
+        self._font = _load_font(element.font_file or font_file, element.font_size)
+        self._color = element.color or color
+        # Character -> (mask or None for blank, offset, advance)
+        self._glyphs: dict[str, tuple[Image.Image | None, tuple[int, int], float]] = {}
+        self._kerning: dict[str, float] = {}
+        for char in GLYPH_VOCABULARY:
+            self._glyph(char)
+
+    def _glyph(self, char: str) -> tuple[Image.Image | None, tuple[int, int], float]:
+        """ Returns rasterized glyph of character, rasterizing it once. """
+
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            left, top, right, bottom = self._font.getbbox(char)
+            mask = None
+            if right > left and bottom > top:
+                mask = Image.new("L", (right - left, bottom - top), 0)
+                ImageDraw.Draw(mask).text((-left, -top), char, font=self._font, fill=255)
+            glyph = (mask, (left, top), self._font.getlength(char))
+            self._glyphs[char] = glyph
+        return glyph
+
+    def _kern(self, pair: str) -> float:
+        """ Returns kerning between two characters. """
+
+        kerning = self._kerning.get(pair)
+        if kerning is None:
+            kerning = (
+                self._font.getlength(pair)
+                - self._glyph(pair[0])[2]
+                - self._glyph(pair[1])[2]
+            )
+            self._kerning[pair] = kerning
+        return kerning
+
+    def draw(self, canvas: Image.Image, text: str):
+        """ Draws text on canvas. """
+
+        x, y = self._xy
+        pen = 0.0
+        for index, char in enumerate(text):
+            if index:
+                pen += self._kern(text[index - 1:index + 1])
+            mask, (left, top), advance = self._glyph(char)
+            if mask is not None:
+                canvas.paste(self._color, (x + round(pen) + left, y + top), mask)
+            pen += advance
+
+
+class RenderPlan:
+    """
+    Layout compiled for rendering: fonts are loaded and glyphs are
+    rasterized once, fully rendered overlays (background, icon and texts)
+    are cached per drawn values (LRU).
+    """
+
+    def __init__(
+            self,
+            layout: AvatarLayout,
+            font_file: str,
+            icon_store: IconStore,
+            text_color: tuple[int, int, int] = (0, 0, 0),
+            bg_color: tuple[int, int, int] = (255, 255, 255),
+            transparent: bool = False,
+            cache_size: int = 32,
+    ):
+        """
+        Initializer.
+        Args:
+            layout: avatar layout.
+            font_file: font file of texts which don't set their own.
+            icon_store: store of weather icons.
+            text_color: color of texts which don't set their own.
+            bg_color: background color in RGB format.
+            transparent: if True, background is transparent (overlay is
+                composited onto GIF frames).
+            cache_size: maximum number of overlays kept in memory.
+        """
+
+        self.layout = layout
+        self._icons = icon_store
+        self._bg_color = bg_color + ((0,) if transparent else (255,))
+        self._temperature = TextRun(layout.temperature, font_file, text_color)
+        self._details = TextRun(layout.details, font_file, text_color)
+        self._cache_size = cache_size
+        self._overlays: OrderedDict[tuple[str, str, str], Image.Image] = OrderedDict()
+        # Icon name -> (source icon, icon resized for layout)
+        self._icons_resized: dict[str, tuple[Image.Image, Image.Image]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.layout.size, self.layout.size
+
+    def _icon(self, icon_name: str) -> Image.Image:
+        """ Returns weather icon of layout size (resized once). """
+
+        icon = self._icons.get(icon_name)
+        side = self.layout.icon.size
+        if icon.size == (side, side):
+            return icon
+        cached = self._icons_resized.get(icon_name)
+        # Icon may have been reloaded by store since it was resized
+        if cached is None or cached[0] is not icon:
+            cached = (icon, icon.resize((side, side), Image.Resampling.LANCZOS))
+            self._icons_resized[icon_name] = cached
+        return cached[1]
+
+    def _render(self, icon_name: str, temperature: str, details: str) -> Image.Image:
+        """ Renders overlay from scratch. """
+
+        overlay = Image.new(mode="RGBA", size=self.size, color=self._bg_color)
+        icon = self._icon(icon_name)
+        overlay.paste(im=icon, box=(self.layout.icon.x, self.layout.icon.y), mask=icon)
+        self._temperature.draw(overlay, temperature)
+        self._details.draw(overlay, details)
+        return overlay
+
+    def overlay(self, icon_name: str, temperature: str, details: str) -> Image.Image:
+        """
+        Returns overlay with weather icon and texts. The image is shared,
+        it must not be changed.
+        Args:
+            icon_name: name of weather icon.
+            temperature: temperature text.
+            details: humidity and wind speed text.
+        Returns:
+            RGBA image of avatar size.
+        """
+
+        key = (icon_name, temperature, details)
+        with self._lock:
+            overlay = self._overlays.get(key)
+            if overlay is not None:
+                self.hits += 1
+                self._overlays.move_to_end(key)
+                return overlay
+            self.misses += 1
+            # Glyph caches aren't thread-safe, so rendering holds the lock
+            overlay = self._render(icon_name, temperature, details)
+            self._overlays[key] = overlay
+            while len(self._overlays) > self._cache_size:
+                self._overlays.popitem(last=False)
+            return overlay
@@ -0,0 +1,411 @@
+import os
+import shutil
+from dataclasses import dataclass
+from fractions import Fraction
+from functools import reduce
+from math import gcd
+from subprocess import Popen, PIPE, DEVNULL
+from tempfile import mkstemp
+from time import perf_counter
+from typing import Callable, Iterable
+from PIL import Image
+
+from src.exceptions import VideoEncodingError
+
+
+def find_ffmpeg(ffmpeg_binary: str | None = None) -> str:
+    """
+    Looks for ffmpeg executable.
+    Args:
+        ffmpeg_binary: explicitly configured path to ffmpeg (if any).
+    Raises:
+        VideoEncodingError: if ffmpeg can't be found.
+    Returns:
+        Path to ffmpeg executable.
+    """
+
+    if ffmpeg_binary:
+        return ffmpeg_binary
+    binary = shutil.which("ffmpeg")
+    if binary:
+        return binary
+    # Fallback to the binary moviepy would use (optional dependency)
+    try:
+        from moviepy.config import get_setting
+    except ImportError:
+        raise VideoEncodingError(
+            "ffmpeg executable not found: install ffmpeg or set FFMPEG_BINARY"
+        )
+    return get_setting("FFMPEG_BINARY")
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """ Encoder speed and quality settings of animated avatars. """
+
+    name: str
+    # libx264 preset (encoding speed)
+    preset: str
+    # Constant rate factor (higher - smaller and worse)
+    crf: int
+    # Frame rate limit, frames are decimated to fit it
+    max_fps: int
+    # Keyframe interval in seconds
+    keyframe_interval: float
+
+
+ENCODING_PROFILES = {
+    profile.name: profile
+    for profile in (
+        EncodingProfile("fast", preset="veryfast", crf=26, max_fps=30, keyframe_interval=2),
+        EncodingProfile("balanced", preset="medium", crf=23, max_fps=50, keyframe_interval=5),
+        EncodingProfile("small", preset="slower", crf=30, max_fps=20, keyframe_interval=10),
+    )
+}
+
+# Order in which automatic selection tries profiles (by quality)
+AUTO_PROFILE_ORDER = ("balanced", "fast", "small")
+
+
+class EncodingSession:
+    """
+    Single ffmpeg process which receives raw RGBA frames through its stdin
+    and encodes them into MP4 file with constant frame rate.
+    Frames are repeated or dropped so that every frame stays on screen
+    for (approximately) its own duration.
+    """
+
+    def __init__(
+            self,
+            ffmpeg_binary: str,
+            size: tuple[int, int],
+            fps: Fraction,
+            profile: EncodingProfile = ENCODING_PROFILES["balanced"],
+            max_duration: int = 0,
+            on_finish: Callable[["EncodingSession", int], None] | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            ffmpeg_binary: path to ffmpeg executable.
+            size: size of frames.
+            fps: output frame rate.
+            profile: encoding profile.
+            max_duration: maximum video duration in milliseconds (0 -
+                unlimited), frames beyond it are dropped.
+            on_finish: called with session and video size when encoding
+                succeeds.
+        """
+
+        self._size = size
+        self._fps = fps
+        self._elapsed_ms = 0
+        self._written = 0
+        self._max_written = round(max_duration * fps / 1000) if max_duration else 0
+        self._on_finish = on_finish
+        self.profile = profile
+        self.frames = 0
+        # True if some frames were dropped because of maximum duration
+        self.trimmed = False
+        self._full = False
+        # Time spent in sending frames and waiting for ffmpeg
+        self.encode_time = 0.0
+        started_at = perf_counter()
+        fd, self._output_path = mkstemp(suffix=".mp4")
+        os.close(fd)
+        self._process = Popen(
+            [
+                ffmpeg_binary,
+                "-hide_banner",
+                "-loglevel", "error",
+                "-y",
+                "-f", "rawvideo",
+                "-pix_fmt", "rgba",
+                "-s", f"{size[0]}x{size[1]}",
+                "-r", str(fps),
+                "-i", "pipe:0",
+                "-an",
+                "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+                "-c:v", "libx264",
+                "-preset", profile.preset,
+                "-crf", str(profile.crf),
+                "-g", str(max(round(profile.keyframe_interval * fps), 1)),
+                "-pix_fmt", "yuv420p",
+                "-movflags", "+faststart",
+                self._output_path,
+            ],
+            stdin=PIPE,
+            stdout=DEVNULL,
+            stderr=PIPE,
+        )
+        self.encode_time += perf_counter() - started_at
+
+    @property
+    def fps(self) -> Fraction:
+        """ Output frame rate. """
+
+        return self._fps
+
+    def __enter__(self) -> "EncodingSession":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+
+    def add_frame(self, frame: Image.Image, duration: int):
+        """
+        Sends frame to encoder.
+        Args:
+            frame: frame image.
+            duration: frame duration in milliseconds.
+        """
+
+        if frame.size != self._size:
+            raise VideoEncodingError(
+                f"Frame size {frame.size} differs from {self._size}"
+            )
+        if frame.mode != "RGBA":
+            frame = frame.convert("RGBA")
+        self.add_raw_frame(frame.tobytes(), duration)
+
+    def add_raw_frame(self, data: bytes | memoryview, duration: int):
+        """
+        Sends raw RGBA frame to encoder.
+        Args:
+            data: frame pixels (any object supporting buffer protocol).
+            duration: frame duration in milliseconds.
+        """
+
+        expected = self._size[0] * self._size[1] * 4
+        if memoryview(data).nbytes != expected:
+            raise VideoEncodingError(
+                f"Raw frame has {memoryview(data).nbytes} bytes, expected {expected}"
+            )
+        if self._full:
+            self.trimmed = True
+            return
+        self.frames += 1
+        self._elapsed_ms += duration
+        target = round(self._elapsed_ms * self._fps / 1000)
+        # The very first frame is always shown
+        target = max(target, 1)
+        if self._max_written and target >= self._max_written:
+            self.trimmed = target > self._max_written
+            self._full = True
+            target = self._max_written
+        if target <= self._written:
+            return
+        started_at = perf_counter()
+        try:
+            for _ in range(target - self._written):
+                self._process.stdin.write(data)
+        except BrokenPipeError:
+            raise VideoEncodingError(self._read_error())
+        finally:
+            self.encode_time += perf_counter() - started_at
+        self._written = target
+
+    def finish(self) -> bytes:
+        """
+        Finishes encoding.
+        Raises:
+            VideoEncodingError: if ffmpeg fails.
+        Returns:
+            Encoded MP4 video.
+        """
+
+        started_at = perf_counter()
+        try:
+            self._process.stdin.close()
+            if self._process.wait() != 0:
+                raise VideoEncodingError(self._read_error())
+            with open(self._output_path, "rb") as video_file:
+                video = video_file.read()
+        finally:
+            self._process.stderr.close()
+            os.unlink(self._output_path)
+            self.encode_time += perf_counter() - started_at
+        if self._on_finish is not None:
+            self._on_finish(self, len(video))
+        return video
+
+    def abort(self):
+        """ Stops ffmpeg and removes output file. """
+
+        self._process.kill()
+        self._process.wait()
+        for stream in (self._process.stdin, self._process.stderr):
+            stream.close()
+        if os.path.exists(self._output_path):
+            os.unlink(self._output_path)
+
+    def _read_error(self) -> str:
+        self._process.wait()
+        error = self._process.stderr.read().decode(errors="replace").strip()
+        return f"ffmpeg failed ({self._process.returncode}): {error}"
+
+
+class VideoEncoder:
+    """
+    Class that encodes sequence of PIL frames into MP4 video without
+    intermediate files in working directory.
+    Encoding profile is either fixed or chosen automatically: the best
+    quality profile whose last result fitted target size and maximum
+    encoding time is used.
+    """
+
+    def __init__(
+            self,
+            ffmpeg_binary: str | None = None,
+            max_fps: int = 50,
+            profile: str = "balanced",
+            target_bytes: int = 0,
+            max_encode_time: float = 0,
+            max_duration: int = 0,
+    ):
+        """
+        Initializer.
+        Args:
+            ffmpeg_binary: path to ffmpeg executable (found automatically
+                if not set).
+            max_fps: upper limit of output frame rate.
+            profile: encoding profile name ("fast", "balanced", "small")
+                or "auto".
+            target_bytes: target video size for automatic profile
+                selection (0 - unlimited).
+            max_encode_time: maximum encoding time in seconds for
+                automatic profile selection (0 - unlimited).
+            max_duration: maximum video duration in milliseconds (0 -
+                unlimited).
+        Raises:
+            ValueError: if profile is unknown.
+        """
+
+        if profile != "auto" and profile not in ENCODING_PROFILES:
+            raise ValueError(f"Unknown encoding profile: {profile}")
+        self._ffmpeg_binary = ffmpeg_binary
+        self._max_fps = max_fps
+        self._profile = profile
+        self._target_bytes = target_bytes
+        self._max_encode_time = max_encode_time
+        self._max_duration = max_duration
+        # The last (video size, encoding time) of every profile per source
+        self._results: dict[tuple[str, object], tuple[int, float]] = {}
+
+    def pick_fps(self, durations: Iterable[int], max_fps: int | None = None) -> Fraction:
+        """
+        Selects the lowest frame rate which represents all frame durations
+        exactly (limited with max_fps).
+        Args:
+            durations: frame durations in milliseconds.
+            max_fps: frame rate limit (encoder's one if not set).
+        Returns:
+            Frame rate.
+        """
+
+        max_fps = min(max_fps or self._max_fps, self._max_fps)
+        step = reduce(gcd, (int(d) for d in durations if d > 0), 0)
+        if not step:
+            return Fraction(max_fps)
+        return min(Fraction(1000, step), Fraction(max_fps))
+
+    def _overrun(self, size: int, encode_time: float) -> float:
+        """ Returns the largest ratio of result to budget (<= 1 - fits). """
+
+        return max(
+            size / self._target_bytes if self._target_bytes else 0,
+            encode_time / self._max_encode_time if self._max_encode_time else 0,
+        )
+
+    def choose_profile(self, source: object = None) -> EncodingProfile:
+        """
+        Returns encoding profile.
+        Args:
+            source: key of encoded content (e.g. background GIF version),
+                results of other sources aren't considered.
+        """
+
+        if self._profile != "auto":
+            return ENCODING_PROFILES[self._profile]
+        for name in AUTO_PROFILE_ORDER:
+            result = self._results.get((name, source))
+            # Unknown profile is tried, then its result is known
+            if result is None or self._overrun(*result) <= 1:
+                return ENCODING_PROFILES[name]
+        # No profile fits: the one which exceeds budgets least
+        name = min(
+            AUTO_PROFILE_ORDER,
+            key=lambda n: self._overrun(*self._results[(n, source)]),
+        )
+        return ENCODING_PROFILES[name]
+
+    def session(
+            self,
+            size: tuple[int, int],
+            durations: Iterable[int],
+            source: object = None,
+    ) -> EncodingSession:
+        """
+        Starts new encoding process.
+        Args:
+            size: size of frames.
+            durations: frame durations in milliseconds.
+            source: key of encoded content for automatic profile selection.
+        Returns:
+            EncodingSession object.
+        """
+
+        self._ffmpeg_binary = find_ffmpeg(self._ffmpeg_binary)
+        profile = self.choose_profile(source)
+
+        def on_finish(session: EncodingSession, video_size: int):
+            self._results[(profile.name, source)] = (video_size, session.encode_time)
+
+        return EncodingSession(
+            self._ffmpeg_binary,
+            size,
+            self.pick_fps(durations, profile.max_fps),
+            profile=profile,
+            max_duration=self._max_duration,
+            on_finish=on_finish,
+        )
+
+    def describe(self, session: EncodingSession, video_size: int) -> dict:
+        """
+        Returns parameters and result of finished encoding (for logs).
+        Args:
+            session: finished session.
+            video_size: size of encoded video.
+        """
+
+        return {
+            "profile": session.profile.name,
+            "preset": session.profile.preset,
+            "crf": session.profile.crf,
+            "fps": float(session.fps),
+            "frames": session.frames,
+            "trimmed": session.trimmed,
+            "bytes": video_size,
+            "encode_ms": round(session.encode_time * 1000, 3),
+            "target_bytes": self._target_bytes,
+            "max_encode_ms": round(self._max_encode_time * 1000, 3),
+            "within_budget": self._overrun(video_size, session.encode_time) <= 1,
+        }
+
+    def encode(self, frames: list[Image.Image], durations: list[int]) -> bytes:
+        """
+        Encodes frames into MP4 video.
+        Args:
+            frames: frames to encode.
+            durations: frame durations in milliseconds.
+        Returns:
+            Encoded MP4 video.
+        """
+
+        with self.session(frames[0].size, durations) as session:
+            for frame, duration in zip(frames, durations):
+                session.add_frame(frame, duration)
+                if session.trimmed:
+                    break
+            return session.finish()
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+from pydantic import ValidationError
+from time import time
+
+from src.schemas import OpenWeatherMapRenderData
+from src.utils import CustomJSONLogger, StateStore
+
+
+class WeatherCache:
+    """
+    Cache of the last weather observation per city.
+    OpenWeatherMap publishes observations on its own cadence (TTL), so a
+    snapshot is served until the next observation is due ('dt' + TTL);
+    requests which can't return newer data are saved. Regular ticks are
+    not served from cache unless UPDATE_INTERVAL is shorter than TTL.
+    Snapshots are persisted in state file, after restart avatars are
+    rendered from them while the current weather is fetched.
+    """
+
+    STATE_KEY = "weather_snapshots"
+
+    def __init__(self, state: StateStore, logger: CustomJSONLogger, ttl: int = 600):
+        """
+        Initializer.
+        Args:
+            state: application state store.
+            logger: logger object.
+            ttl: cadence of observations (seconds since observation 'dt'
+                until the next one is due).
+        """
+
+        self._state = state
+        self._logger = logger
+        self._ttl = ttl
+        self._snapshots: dict[int, OpenWeatherMapRenderData] = {}
+        self.hits = 0
+        self.misses = 0
+        for city_id, snapshot in (state.get(self.STATE_KEY) or {}).items():
+            try:
+                self._snapshots[int(city_id)] = (
+                    OpenWeatherMapRenderData.model_validate(snapshot)
+                )
+            except (ValueError, ValidationError):
+                continue
+
+    @staticmethod
+    def observed_at(snapshot: OpenWeatherMapRenderData) -> str:
+        """ Returns observation time in city's local time zone. """
+
+        tz = timezone(timedelta(seconds=snapshot.timezone))
+        return datetime.fromtimestamp(snapshot.dt, tz).isoformat()
+
+    def is_fresh(self, snapshot: OpenWeatherMapRenderData, now: float | None = None) -> bool:
+        """ Checks if newer observation can't be published yet. """
+
+        now = time() if now is None else now
+        return now < snapshot.dt + self._ttl
+
+    def get(self, city_id: int) -> OpenWeatherMapRenderData | None:
+        """
+        Returns fresh snapshot of city weather.
+        Args:
+            city_id: city ID.
+        Returns:
+            Snapshot or None if there is no fresh one.
+        """
+
+        snapshot = self._snapshots.get(city_id)
+        hit = snapshot is not None and self.is_fresh(snapshot)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._logger.info({
+            "event": "weather_cache",
+            "city_id": city_id,
+            "hit": hit,
+            "observed_at": self.observed_at(snapshot) if snapshot else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        })
+        return snapshot if hit else None
+
+    def get_stale(self, city_id: int) -> OpenWeatherMapRenderData | None:
+        """ Returns the last known snapshot of city weather (if any). """
+
+        return self._snapshots.get(city_id)
+
+    def put(self, snapshot: OpenWeatherMapRenderData):
+        """ Stores snapshot and persists all snapshots. """
+
+        self._snapshots[snapshot.id] = snapshot
+        self._state.set(self.STATE_KEY, {
+            str(city_id): item.model_dump(mode="json", by_alias=True)
+            for city_id, item in self._snapshots.items()
+        })
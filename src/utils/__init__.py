@@ -1,6 +1,27 @@
+from .http import create_client_session, socks5_proxy_url
 from .logger import CustomJSONLogger
+from .loop_lag import LoopLagMonitor
+from .metrics import Metrics, MetricsServer
+from .rate_window import RateWindow
+from .retry import CircuitBreaker, RetryPolicy
+from .scheduler import ScheduledJob, Scheduler
+from .state import StateStore
+from .supervisor import SupervisedTask, Supervisor
 
 
 __all__ = [
+    "CircuitBreaker",
     "CustomJSONLogger",
+    "LoopLagMonitor",
+    "Metrics",
+    "MetricsServer",
+    "RateWindow",
+    "RetryPolicy",
+    "ScheduledJob",
+    "Scheduler",
+    "StateStore",
+    "SupervisedTask",
+    "Supervisor",
+    "create_client_session",
+    "socks5_proxy_url",
 ]
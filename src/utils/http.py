@@ -0,0 +1,119 @@
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from types import SimpleNamespace
+from urllib.parse import quote
+
+from src.utils.logger import CustomJSONLogger
+from src.utils.metrics import Metrics
+
+
+def socks5_proxy_url(host: str, port: int, username: str = "", password: str = "") -> str:
+    """ Returns SOCKS5 proxy URL (the same proxy as Telethon's tuple). """
+
+    auth = ""
+    if username or password:
+        auth = f"{quote(username, safe='')}:{quote(password, safe='')}@"
+    return f"socks5://{auth}{host}:{port}"
+
+
+def connection_trace_config(
+        metrics: Metrics,
+        logger: CustomJSONLogger | None = None,
+) -> TraceConfig:
+    """
+    Returns trace config which counts new and reused connections and DNS
+    cache hits by host, so that it can be checked that steady state
+    requests don't pay TCP/TLS setup.
+    Args:
+        metrics: metrics where connections and DNS lookups are counted.
+        logger: logger object (requests are logged at debug level).
+    """
+
+    async def on_request_start(session, context: SimpleNamespace, params):
+        context.host = params.url.host
+        context.connection = None
+
+    async def on_connection_create_end(session, context: SimpleNamespace, params):
+        context.connection = "create"
+        metrics.http_connections.inc(host=context.host, event="create")
+
+    async def on_connection_reuseconn(session, context: SimpleNamespace, params):
+        context.connection = "reuse"
+        metrics.http_connections.inc(host=context.host, event="reuse")
+
+    async def on_dns_cache_hit(session, context: SimpleNamespace, params):
+        metrics.http_dns_lookups.inc(host=params.host, result="hit")
+
+    async def on_dns_cache_miss(session, context: SimpleNamespace, params):
+        metrics.http_dns_lookups.inc(host=params.host, result="miss")
+
+    async def on_request_end(session, context: SimpleNamespace, params):
+        if logger is not None:
+            logger.debug(lambda: {
+                "event": "http_request",
+                "host": context.host,
+                "status": params.response.status,
+                "connection": context.connection,
+            })
+
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+    trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+def create_client_session(
+        limit: int = 10,
+        limit_per_host: int = 4,
+        dns_cache_ttl: int = 600,
+        keepalive_timeout: float = 630,
+        connect_timeout: float = 5,
+        proxy_url: str | None = None,
+        metrics: Metrics | None = None,
+        logger: CustomJSONLogger | None = None,
+) -> ClientSession:
+    """
+    Creates HTTP client session with pooled keep-alive connections.
+    Args:
+        limit: maximum number of connections.
+        limit_per_host: maximum number of connections to one host.
+        dns_cache_ttl: how long resolved addresses are cached (seconds).
+        keepalive_timeout: how long idle connection is kept (seconds),
+            it should outlive interval between updates to be reused.
+        connect_timeout: timeout of connecting (seconds).
+        proxy_url: proxy URL ("socks5://...", "http://..."), connections
+            are direct if not set. Requires aiohttp-socks package.
+        metrics: metrics where connection reuse is counted.
+        logger: logger object.
+    Raises:
+        ImportError: if proxy is set, but aiohttp-socks isn't installed.
+    Returns:
+        Client session (it must be closed by caller).
+    """
+
+    connector_kwargs = dict(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+        enable_cleanup_closed=True,
+    )
+    if proxy_url:
+        try:
+            from aiohttp_socks import ProxyConnector
+        except ImportError as e:
+            raise ImportError(
+                "aiohttp-socks package is required to use proxy for HTTP "
+                "requests, install \"proxy\" extra"
+            ) from e
+        connector = ProxyConnector.from_url(proxy_url, rdns=True, **connector_kwargs)
+    else:
+        connector = TCPConnector(**connector_kwargs)
+    return ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=None, connect=connect_timeout),
+        trace_configs=[connection_trace_config(metrics, logger)] if metrics else None,
+    )
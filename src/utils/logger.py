@@ -1,40 +1,201 @@
 """ Класс простого JSON-логгера """
 
 
+import atexit
 from contextvars import ContextVar
 from datetime import datetime
 from json import dumps
-from logging import Logger, StreamHandler, Formatter, INFO
+from logging import (
+    Logger, LogRecord, StreamHandler, Formatter, INFO,
+)
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
 from sys import stdout
+from typing import Any, Callable
 from uuid import uuid4
 
 
+def _get_serializer(name: str) -> Callable[[dict], str]:
+    """
+    Возвращает функцию сериализации словаря в JSON.
+    Args:
+        name: "json", "orjson" или "auto" (orjson, если он установлен).
+    """
+
+    if name in ("orjson", "auto"):
+        try:
+            from orjson import dumps as orjson_dumps, OPT_NON_STR_KEYS
+        except ImportError:
+            if name == "orjson":
+                raise
+        else:
+            return lambda msg: orjson_dumps(
+                msg, default=str, option=OPT_NON_STR_KEYS,
+            ).decode()
+    return lambda msg: dumps(msg, ensure_ascii=False)
+
+
+class JSONFormatter(Formatter):
+    """
+    Форматтер, сериализующий словарь из записи в JSON.
+    Временная метка и сессия добавляются здесь.
+    """
+
+    def __init__(self, serializer: Callable[[dict], str]):
+
+        super().__init__("")
+        self._serializer = serializer
+
+    def format(self, record: LogRecord) -> str:
+        msg = dict(record.msg)
+        msg["asctime"] = datetime.fromtimestamp(record.created).isoformat()
+        msg["session"] = getattr(record, "session", None)
+        result = self._serializer(msg)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            result += "\n" + record.exc_text
+        return result
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Обработчик, складывающий записи в ограниченную очередь.
+    Если очередь заполнена, запись отбрасывается (логгирование никогда
+    не блокирует вызывающий код), количество отброшенных записей
+    считается.
+    """
+
+    def __init__(self, queue: Queue):
+
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        # Сериализация выполняется в фоновом потоке
+        return record
+
+    def enqueue(self, record: LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class BlockingStopQueueListener(QueueListener):
+    """
+    Слушатель очереди, который при остановке ждёт места в очереди для
+    сигнала завершения, а не падает на переполненной очереди.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class DropReportingHandler(StreamHandler):
+    """
+    Обработчик фонового потока, который перед очередной записью сообщает
+    о записях, отброшенных с момента предыдущего сообщения.
+    """
+
+    def __init__(self, stream, queue_handler: DroppingQueueHandler):
+
+        super().__init__(stream)
+        self._queue_handler = queue_handler
+        self._reported = 0
+
+    def emit(self, record: LogRecord):
+        dropped = self._queue_handler.dropped
+        if dropped > self._reported:
+            self.stream.write(dumps({
+                "event": "log_records_dropped",
+                "count": dropped - self._reported,
+                "total": dropped,
+                "asctime": datetime.now().isoformat(),
+            }) + self.terminator)
+            self._reported = dropped
+        super().emit(record)
+
+
 class CustomJSONLogger(Logger):
 
-    def __init__(self, name: str, level: int = INFO):
+    def __init__(
+            self,
+            name: str,
+            level: int = INFO,
+            queue_size: int = 0,
+            serializer: str = "json",
+    ):
+        """
+        Инициализатор.
+        Args:
+            name: имя логгера;
+            level: уровень логгирования;
+            queue_size: размер очереди записей; если больше нуля,
+                сериализация и запись в stdout выполняются в фоновом
+                потоке, а записи сверх размера очереди отбрасываются;
+            serializer: сериализатор JSON ("json", "orjson" или "auto").
+        """
 
         super().__init__(name)
         handler = StreamHandler(stdout)
-        handler.setFormatter(Formatter(""))
+        formatter = JSONFormatter(_get_serializer(serializer))
+        handler.setFormatter(formatter)
         self.handlers.clear()
         self.setLevel(level)
-        self.addHandler(handler)
         self.propagate = False
         self.session = ContextVar("SESSION", default=str(uuid4()))
+        self._queue_handler: DroppingQueueHandler | None = None
+        self._listener: QueueListener | None = None
+        if queue_size > 0:
+            self._queue_handler = DroppingQueueHandler(Queue(queue_size))
+            handler = DropReportingHandler(stdout, self._queue_handler)
+            handler.setFormatter(formatter)
+            self._listener = BlockingStopQueueListener(
+                self._queue_handler.queue, handler,
+            )
+            self._listener.start()
+            atexit.register(self.close)
+            self.addHandler(self._queue_handler)
+        else:
+            self.addHandler(handler)
+
+    @property
+    def dropped(self) -> int:
+        """ Количество отброшенных из-за переполнения очереди записей. """
+
+        return self._queue_handler.dropped if self._queue_handler else 0
+
+    def close(self):
+        """ Останавливает фоновый поток, дописав записи из очереди. """
+
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
 
-    def _log(self, level: int, msg: dict, *args, **kwargs) -> None:
+    def _log(
+            self,
+            level: int,
+            msg: dict | Callable[[], dict],
+            *args,
+            **kwargs: Any,
+    ) -> None:
         """
         Переопределение метода родительского класса для логгирования
         словарей как JSON.
-        Временная метка ставится здесь.
+        Словарь вызывающего кода не изменяется. Вместо словаря можно
+        передать функцию без аргументов, которая его вернёт: она будет
+        вызвана, только если уровень логгирования включён.
         Args:
             level: уровень логгирования;
-            msg: словарь-представление логгируемого JSON;
+            msg: словарь-представление логгируемого JSON или функция,
+                возвращающая его;
         """
 
+        if callable(msg):
+            msg = msg()
         if not isinstance(msg, dict):
             raise RuntimeError("JSONLogger needs 'dict' object as a message")
-        msg["asctime"] = datetime.now().isoformat()
-        msg["session"] = self.session.get()
-        msg = dumps(msg, ensure_ascii=False)
-        super()._log(level, msg, *args, **kwargs)  # noqa
+        extra = kwargs.pop("extra", None) or {}
+        extra["session"] = self.session.get()
+        super()._log(level, dict(msg), *args, extra=extra, **kwargs)  # noqa
@@ -0,0 +1,87 @@
+from asyncio import CancelledError, Task, create_task, sleep as aio_sleep
+from time import monotonic
+
+from src.utils.logger import CustomJSONLogger
+from src.utils.metrics import Metrics
+
+
+class LoopLagMonitor:
+    """
+    Probe which measures event loop lag: how much later than requested
+    a short sleep wakes up. Long lag means something blocks the loop.
+    """
+
+    def __init__(
+            self,
+            logger: CustomJSONLogger,
+            interval: float = 0.1,
+            report_interval: float = 60,
+            metrics: Metrics | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            logger: logger object.
+            interval: probe sleep duration in seconds.
+            report_interval: how often statistics are logged (seconds).
+            metrics: metrics where lag samples are observed.
+        """
+
+        self._logger = logger
+        self._interval = interval
+        self._report_interval = report_interval
+        self._metrics = metrics
+        self._task: Task | None = None
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+
+    def reset(self):
+        """ Resets collected statistics. """
+
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+
+    def _report(self):
+        self._logger.info({
+            "event": "loop_lag",
+            "samples": self.samples,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "avg_lag_ms": round(self.total_lag / max(self.samples, 1) * 1000, 3),
+        })
+
+    async def run(self):
+        """ Probes event loop until cancelled. """
+
+        reported_at = monotonic()
+        try:
+            while True:
+                started_at = monotonic()
+                await aio_sleep(self._interval)
+                lag = max(monotonic() - started_at - self._interval, 0.0)
+                self.max_lag = max(self.max_lag, lag)
+                self.total_lag += lag
+                self.samples += 1
+                if self._metrics is not None:
+                    self._metrics.loop_lag.observe(lag)
+                if monotonic() - reported_at >= self._report_interval:
+                    self._report()
+                    self.reset()
+                    reported_at = monotonic()
+        except CancelledError:
+            self._report()
+            raise
+
+    def start(self):
+        """ Starts probing in background task. """
+
+        if self._task is None:
+            self._task = create_task(self.run())
+
+    def stop(self):
+        """ Stops background probing. """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,433 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Iterator
+from uuid import uuid4
+
+from src.utils.logger import CustomJSONLogger
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple, **extra: str) -> str:
+    pairs = list(zip(labelnames, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """ Prometheus counter with labels. """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """ Prometheus gauge with labels. """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels: str):
+        self._values[tuple(labels.get(name, "") for name in self.labelnames)] = value
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """ Prometheus histogram with labels. """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (bucket counts, sum, count)
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, le=str(bound))
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, le="+Inf")
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Span:
+    """ Mutable result of measured stage. """
+
+    def __init__(self):
+        self.bytes: int | None = None
+        self.outcome = "ok"
+
+
+class Metrics:
+    """
+    Per-stage timings of avatar update cycles. Every stage is logged as a
+    span (cycle ID, stage, duration, bytes, outcome) and aggregated into
+    Prometheus metrics.
+    """
+
+    def __init__(self, logger: CustomJSONLogger):
+        """
+        Initializer.
+        Args:
+            logger: logger object.
+        """
+
+        self._logger = logger
+        self._registry: dict[str, Counter | Gauge | Histogram] = {}
+        self.cycle_id: ContextVar[str | None] = ContextVar("CYCLE_ID", default=None)
+        self.stage_duration = self.histogram(
+            "tg_avatar_stage_duration_seconds",
+            "Duration of avatar update stages.",
+            ("stage", "outcome"),
+        )
+        self.stage_bytes = self.counter(
+            "tg_avatar_stage_bytes_total",
+            "Bytes produced or transferred by avatar update stages.",
+            ("stage",),
+        )
+        self.retries = self.counter(
+            "tg_avatar_retries_total",
+            "Retried requests.",
+            ("operation",),
+        )
+        self.attempts = self.counter(
+            "tg_avatar_request_attempts_total",
+            "Request attempts by outcome.",
+            ("operation", "outcome"),
+        )
+        self.backoff = self.counter(
+            "tg_avatar_backoff_seconds_total",
+            "Time spent in backoff between retries.",
+            ("operation",),
+        )
+        self.circuit_opened = self.counter(
+            "tg_avatar_circuit_opened_total",
+            "How many times circuit breaker has opened.",
+            ("circuit",),
+        )
+        self.http_connections = self.counter(
+            "tg_avatar_http_connections_total",
+            "HTTP connections taken for requests: created or reused from pool.",
+            ("host", "event"),
+        )
+        self.http_dns_lookups = self.counter(
+            "tg_avatar_http_dns_lookups_total",
+            "DNS lookups of HTTP client by DNS cache result.",
+            ("host", "result"),
+        )
+        self.telegram_calls = self.counter(
+            "tg_avatar_telegram_calls_total",
+            "Telegram API calls.",
+            ("account", "method"),
+        )
+        self.flood_waits = self.counter(
+            "tg_avatar_flood_waits_total",
+            "FloodWait errors returned by Telegram.",
+            ("account",),
+        )
+        self.flood_wait_seconds = self.counter(
+            "tg_avatar_flood_wait_seconds_total",
+            "Time spent waiting for FloodWait.",
+            ("account",),
+        )
+        self.coalesced_updates = self.counter(
+            "tg_avatar_coalesced_updates_total",
+            "Avatar updates replaced by newer ones before they started.",
+            ("account",),
+        )
+        self.dropped_updates = self.counter(
+            "tg_avatar_dropped_updates_total",
+            "Avatar updates dropped after all attempts failed.",
+            ("account",),
+        )
+        self.skipped_cycles = self.counter(
+            "tg_avatar_skipped_cycles_total",
+            "Avatar updates skipped because avatar wouldn't change.",
+            ("account",),
+        )
+        self.prerender_lookups = self.counter(
+            "tg_avatar_prerender_lookups_total",
+            "Lookups of pre-rendered avatars by result (hit or miss).",
+            ("account", "result"),
+        )
+        self.tick_latency = self.histogram(
+            "tg_avatar_tick_latency_seconds",
+            "Time from start of update cycle to avatar update, by whether "
+            "avatar was pre-rendered.",
+            ("account", "prerendered"),
+        )
+        self.tick_lateness = self.histogram(
+            "tg_avatar_tick_lateness_seconds",
+            "How much later than scheduled (with jitter) job ticks run.",
+            ("job",),
+            buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, 300),
+        )
+        self.coalesced_ticks = self.counter(
+            "tg_avatar_coalesced_ticks_total",
+            "Job ticks missed during a stall and coalesced into one run.",
+            ("job",),
+        )
+        self.skipped_ticks = self.counter(
+            "tg_avatar_skipped_ticks_total",
+            "Job ticks skipped because the previous run was in progress.",
+            ("job",),
+        )
+        self.task_restarts = self.counter(
+            "tg_avatar_task_restarts_total",
+            "Restarts of supervised tasks by reason (error, exit or stall).",
+            ("task", "reason"),
+        )
+        self.last_success = self.gauge(
+            "tg_avatar_last_success_timestamp_seconds",
+            "Time of the latest successful avatar update (or check that "
+            "avatar is up to date) of account.",
+            ("account",),
+        )
+        self.loop_lag = self.histogram(
+            "tg_avatar_event_loop_lag_seconds",
+            "Event loop lag measured by probe.",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+        )
+
+    def counter(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+    ) -> Counter:
+        """ Returns registered counter, registering it if necessary. """
+
+        if name not in self._registry:
+            self._registry[name] = Counter(name, documentation, labelnames)
+        return self._registry[name]
+
+    def gauge(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+    ) -> Gauge:
+        """ Returns registered gauge, registering it if necessary. """
+
+        if name not in self._registry:
+            self._registry[name] = Gauge(name, documentation, labelnames)
+        return self._registry[name]
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = Histogram.DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """ Returns registered histogram, registering it if necessary. """
+
+        if name not in self._registry:
+            self._registry[name] = Histogram(name, documentation, labelnames, buckets)
+        return self._registry[name]
+
+    def new_cycle(self) -> str:
+        """ Starts new cycle in current context, returns its ID. """
+
+        cycle_id = uuid4().hex[:12]
+        self.cycle_id.set(cycle_id)
+        return cycle_id
+
+    def record(
+            self,
+            stage: str,
+            duration: float,
+            outcome: str = "ok",
+            size: int | None = None,
+            **fields,
+    ):
+        """
+        Records measured stage.
+        Args:
+            stage: stage name.
+            duration: stage duration in seconds.
+            outcome: "ok", "error", "timeout" or "cancelled".
+            size: bytes produced or transferred by stage (if any).
+            fields: extra fields of log record.
+        """
+
+        self.stage_duration.observe(duration, stage=stage, outcome=outcome)
+        if size is not None:
+            self.stage_bytes.inc(size, stage=stage)
+        self._logger.info({
+            "event": "stage",
+            "cycle_id": self.cycle_id.get(),
+            "stage": stage,
+            "duration_ms": round(duration * 1000, 3),
+            "bytes": size,
+            "outcome": outcome,
+            **fields,
+        })
+
+    @contextmanager
+    def span(self, stage: str, **fields) -> Iterator[Span]:
+        """
+        Measures code block as stage.
+        Args:
+            stage: stage name.
+            fields: extra fields of log record.
+        """
+
+        span = Span()
+        started_at = perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            if isinstance(e, TimeoutError):
+                span.outcome = "timeout"
+            else:
+                span.outcome = "error" if isinstance(e, Exception) else "cancelled"
+            raise
+        finally:
+            self.record(
+                stage,
+                perf_counter() - started_at,
+                outcome=span.outcome,
+                size=span.bytes,
+                **fields,
+            )
+
+    def render(self) -> str:
+        """ Returns all metrics in Prometheus text format. """
+
+        lines = []
+        for metric in self._registry.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Local HTTP server which exposes metrics in Prometheus text format
+    on /metrics and health report as JSON on /health (status 503 if
+    application isn't healthy).
+    """
+
+    def __init__(
+            self,
+            metrics: Metrics,
+            host: str = "127.0.0.1",
+            port: int = 9100,
+            health: Callable[[], dict] | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            metrics: metrics to expose.
+            host: host to listen.
+            port: port to listen.
+            health: function which returns health report with "status"
+                ("ok" if healthy), /health isn't served if it isn't set.
+        """
+
+        self._metrics = metrics
+        self._host = host
+        self._port = port
+        self._health = health
+        self._runner: "web.AppRunner | None" = None
+
+    async def _handle_metrics(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+
+        return web.Response(
+            body=self._metrics.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def _handle_health(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+
+        report = self._health()
+        return web.json_response(report, status=200 if report["status"] == "ok" else 503)
+
+    async def start(self):
+        """ Starts server. """
+
+        # aiohttp.web is loaded only if metrics are exposed
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        if self._health is not None:
+            app.router.add_get("/health", self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+
+    async def stop(self):
+        """ Stops server. """
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,59 @@
+from collections import deque
+from time import monotonic
+
+
+class RateWindow:
+    """ Number of events (e.g. API calls) in sliding time window. """
+
+    def __init__(self, window: float = 3600):
+        """
+        Initializer.
+        Args:
+            window: window length in seconds.
+        """
+
+        self.window = window
+        self._events: deque[tuple[float, int]] = deque()
+        self._total = 0
+
+    def _expire(self, now: float):
+        while self._events and self._events[0][0] <= now - self.window:
+            _, amount = self._events.popleft()
+            self._total -= amount
+
+    def add(self, amount: int = 1):
+        """ Records events which happened now. """
+
+        now = monotonic()
+        self._expire(now)
+        self._events.append((now, amount))
+        self._total += amount
+
+    def count(self) -> int:
+        """ Returns number of events in window. """
+
+        self._expire(monotonic())
+        return self._total
+
+    def wait_time(self, limit: int, amount: int = 1) -> float:
+        """
+        Returns how long to wait until the given number of new events fits
+        in limit.
+        Args:
+            limit: maximum number of events in window.
+            amount: number of new events.
+        Returns:
+            Seconds to wait (0 if events fit now).
+        """
+
+        now = monotonic()
+        self._expire(now)
+        total = self._total
+        wait = 0.0
+        # Events leave window from the oldest one
+        for timestamp, count in self._events:
+            if total + amount <= limit:
+                break
+            total -= count
+            wait = timestamp + self.window - now
+        return max(wait, 0.0)
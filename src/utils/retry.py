@@ -0,0 +1,251 @@
+from asyncio import sleep as aio_sleep
+from random import uniform
+from time import monotonic
+from typing import Awaitable, Callable, TypeVar
+
+from src.exceptions import CircuitOpenError
+from src.utils.logger import CustomJSONLogger
+from src.utils.metrics import Metrics
+
+
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of remote service. After several consecutive failed
+    attempts the circuit opens and calls are rejected without touching
+    the service. When reset timeout passes, one probe call is let through:
+    its success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 5,
+            reset_timeout: float = 300,
+            logger: CustomJSONLogger | None = None,
+            metrics: Metrics | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            name: service name (used in logs and metrics).
+            failure_threshold: consecutive failures which open circuit.
+            reset_timeout: how long circuit stays open (seconds).
+            logger: logger object.
+            metrics: metrics where circuit openings are counted.
+        """
+
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._logger = logger
+        self._metrics = metrics
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """ Current state: "closed", "open" or "half_open". """
+
+        if self._state == self.OPEN and monotonic() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        """ Checks if call may be made now (reserves probe if half-open). """
+
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        """ Records successful call, closes circuit. """
+
+        self._failures = 0
+        self._probe_in_flight = False
+        if self._state != self.CLOSED:
+            self._state = self.CLOSED
+            self._log({"event": "circuit_closed", "circuit": self.name})
+
+    def record_failure(self):
+        """ Records failed call, opens circuit if necessary. """
+
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+            self._state = self.OPEN
+            self._opened_at = monotonic()
+            if self._metrics is not None:
+                self._metrics.circuit_opened.inc(circuit=self.name)
+            self._log({
+                "event": "circuit_open",
+                "circuit": self.name,
+                "failures": self._failures,
+                "reset_timeout": self._reset_timeout,
+            })
+
+    def release(self):
+        """ Releases probe of half-open circuit without result. """
+
+        self._probe_in_flight = False
+
+    def _log(self, msg: dict):
+        if self._logger is not None:
+            self._logger.warning(msg)
+
+
+class RetryPolicy:
+    """
+    Retries of async operation with jittered exponential backoff.
+    Every attempt gets its own timeout, all attempts and backoff sleeps
+    of one operation fit in the total deadline.
+    """
+
+    def __init__(
+            self,
+            attempts: int = 3,
+            base_delay: float = 1,
+            max_delay: float = 30,
+            deadline: float = 60,
+            request_timeout: float = 10,
+            logger: CustomJSONLogger | None = None,
+            metrics: Metrics | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            attempts: maximum number of attempts.
+            base_delay: backoff before the second attempt (seconds), it
+                doubles with every next attempt.
+            max_delay: maximum backoff (seconds).
+            deadline: default total time of operation (seconds).
+            request_timeout: maximum time of one attempt (seconds).
+            logger: logger object.
+            metrics: metrics where attempts and backoff time are counted.
+        """
+
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.request_timeout = request_timeout
+        self._logger = logger
+        self._metrics = metrics
+
+    def new_deadline(self) -> float:
+        """ Returns deadline (monotonic time) of operation started now. """
+
+        return monotonic() + self.deadline
+
+    def backoff(self, attempt: int) -> float:
+        """ Returns random backoff after failed attempt ("full jitter"). """
+
+        return uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(
+            self,
+            operation: str,
+            func: Callable[[float], Awaitable[T]],
+            is_retryable: Callable[[Exception], bool],
+            deadline: float | None = None,
+            breaker: CircuitBreaker | None = None,
+    ) -> T:
+        """
+        Runs operation with retries.
+        Args:
+            operation: operation name (used in logs and metrics).
+            func: coroutine function which makes one attempt, it gets
+                timeout of attempt in seconds.
+            is_retryable: checks if error of attempt is worth retrying.
+                Other errors are raised at once (service has responded,
+                so they aren't counted by circuit breaker).
+            deadline: deadline (monotonic time) of operation, new one
+                is started if not set.
+            breaker: circuit breaker of service.
+        Raises:
+            CircuitOpenError: if circuit breaker rejects attempt.
+            TimeoutError: if deadline passes before first attempt.
+            Exception: error of the last attempt.
+        Returns:
+            Result of func.
+        """
+
+        deadline = self.new_deadline() if deadline is None else deadline
+        last_error: Exception | None = None
+        backoff_total = 0.0
+        attempt = 0
+        try:
+            while attempt < self.attempts:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                if breaker is not None and not breaker.allow():
+                    raise CircuitOpenError(f"Circuit '{breaker.name}' is open")
+                attempt += 1
+                try:
+                    result = await func(min(self.request_timeout, remaining))
+                except Exception as e:
+                    if not is_retryable(e):
+                        if breaker is not None:
+                            breaker.record_success()
+                        self._count(operation, "error")
+                        raise
+                    if breaker is not None:
+                        breaker.record_failure()
+                    self._count(operation, "retryable_error")
+                    last_error = e
+                else:
+                    if breaker is not None:
+                        breaker.record_success()
+                    self._count(operation, "ok")
+                    return result
+                finally:
+                    # Cancelled attempt proves nothing about service
+                    if breaker is not None:
+                        breaker.release()
+                if attempt >= self.attempts:
+                    break
+                delay = self.backoff(attempt)
+                if monotonic() + delay >= deadline:
+                    break
+                if self._logger is not None:
+                    self._logger.warning({
+                        "event": "retry",
+                        "operation": operation,
+                        "attempt": attempt,
+                        "delay_ms": round(delay * 1000, 3),
+                        "error": str(last_error) or type(last_error).__name__,
+                    })
+                if self._metrics is not None:
+                    self._metrics.retries.inc(operation=operation)
+                    self._metrics.backoff.inc(delay, operation=operation)
+                backoff_total += delay
+                await aio_sleep(delay)
+        finally:
+            if attempt > 1 and self._logger is not None:
+                self._logger.info({
+                    "event": "retry_summary",
+                    "operation": operation,
+                    "attempts": attempt,
+                    "backoff_ms": round(backoff_total * 1000, 3),
+                })
+        if last_error is None:
+            raise TimeoutError(f"Deadline of '{operation}' has passed")
+        raise last_error
+
+    def _count(self, operation: str, outcome: str):
+        if self._metrics is not None:
+            self._metrics.attempts.inc(operation=operation, outcome=outcome)
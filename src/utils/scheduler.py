@@ -0,0 +1,231 @@
+from asyncio import Event, Task, TimeoutError as AioTimeoutError, create_task, wait_for
+from math import floor
+from random import uniform
+from time import monotonic, time
+from traceback import format_exception
+from typing import Awaitable, Callable
+
+from src.utils.logger import CustomJSONLogger
+from src.utils.metrics import Metrics
+
+
+class ScheduledJob:
+    """
+    Periodic job of scheduler. Ticks are aligned to a grid: anchor (UNIX
+    timestamp) + offset + k * period, so the period doesn't drift with job
+    duration.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            func: Callable[[], Awaitable[None]],
+            period: float,
+            offset: float = 0,
+            jitter: float = 0,
+            anchor: Callable[[], float | None] | None = None,
+            retry_delay: float | None = None,
+            run_at_start: bool = False,
+            timeout: float | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            name: job name (used in logs and metrics).
+            func: coroutine function called on every tick.
+            period: period of ticks (seconds).
+            offset: shift of ticks from anchor (seconds).
+            jitter: maximum random delay of every tick (seconds), spreads
+                load of jobs with the same schedule.
+            anchor: function which returns UNIX timestamp ticks are
+                aligned to (e.g. time of the last weather observation);
+                ticks are aligned to wall clock (multiples of period since
+                epoch) if it isn't set or returns None.
+            retry_delay: if set, the next tick after failed one comes no
+                later than this (seconds).
+            run_at_start: if True, the first tick runs at once.
+            timeout: if set, run which takes longer (seconds) is cancelled
+                and counts as failed.
+        """
+
+        if period <= 0:
+            raise ValueError(f"Period of job {name} must be positive")
+        self.name = name
+        self.func = func
+        self.period = period
+        self.offset = offset
+        self.jitter = jitter
+        self.anchor = anchor
+        self.retry_delay = retry_delay
+        self.run_at_start = run_at_start
+        self.timeout = timeout
+        # Scheduled tick and wake up time with jitter (monotonic)
+        self.due = 0.0
+        self.wake_at = 0.0
+        self.task: Task | None = None
+        self.ticks = 0
+        self.coalesced = 0
+        self.overlapped = 0
+
+
+class Scheduler:
+    """
+    Scheduler of periodic jobs driven by monotonic clock: one loop sleeps
+    until the nearest tick of all jobs. Ticks missed during a stall are
+    coalesced into one run, a tick which comes while the previous run of
+    the job is still in progress is skipped. Lateness of every tick is
+    logged and observed in metrics.
+    """
+
+    def __init__(
+            self,
+            logger: CustomJSONLogger,
+            metrics: Metrics | None = None,
+            clock: Callable[[], float] = monotonic,
+            wall_clock: Callable[[], float] = time,
+            heartbeat: Callable[[], None] | None = None,
+            heartbeat_interval: float = 5,
+    ):
+        """
+        Initializer.
+        Args:
+            logger: logger object.
+            metrics: metrics where tick lateness is observed.
+            clock: monotonic clock (seconds).
+            wall_clock: wall clock (UNIX timestamp) alignment is computed
+                with.
+            heartbeat: function which is called on every wake up of
+                scheduler loop (at least every heartbeat interval).
+            heartbeat_interval: the longest sleep of scheduler loop
+                (seconds) if heartbeat is set.
+        """
+
+        self._logger = logger
+        self._metrics = metrics
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._heartbeat = heartbeat
+        self._heartbeat_interval = heartbeat_interval
+        self._jobs: list[ScheduledJob] = []
+        self._changed = Event()
+        self._task: Task | None = None
+
+    @property
+    def jobs(self) -> list[ScheduledJob]:
+        return list(self._jobs)
+
+    def add(self, job: ScheduledJob) -> ScheduledJob:
+        """ Adds job, its first tick is scheduled at once. """
+
+        now = self._clock()
+        job.due = now if job.run_at_start else self._next_due(job, now)
+        job.wake_at = job.due + uniform(0, job.jitter)
+        self._jobs.append(job)
+        self._changed.set()
+        return job
+
+    def _next_due(self, job: ScheduledJob, after: float) -> float:
+        """ Returns the first tick of job later than given moment (monotonic). """
+
+        now = self._clock()
+        # Grid is aligned in wall clock time, sleeping uses monotonic one
+        wall_after = self._wall_clock() + (after - now)
+        anchor = job.anchor() if job.anchor is not None else None
+        base = (anchor or 0.0) + job.offset
+        k = floor((wall_after - base) / job.period) + 1
+        return now + (base + k * job.period - self._wall_clock())
+
+    def _tick(self, job: ScheduledJob, now: float):
+        """ Starts run of job and schedules its next tick. """
+
+        lateness = max(now - job.wake_at, 0.0)
+        # Ticks between scheduled one and now are coalesced into this run
+        missed = max(floor((now - job.due) / job.period), 0)
+        overlapped = job.task is not None and not job.task.done()
+        job.coalesced += missed
+        if overlapped:
+            job.overlapped += 1
+        else:
+            job.ticks += 1
+            job.task = create_task(self._run_job(job))
+            job.task.add_done_callback(lambda task: self._on_done(job, task))
+        self._logger.info({
+            "event": "tick",
+            "job": job.name,
+            "lateness_ms": round(lateness * 1000, 3),
+            "jitter_ms": round((job.wake_at - job.due) * 1000, 3),
+            "coalesced": missed,
+            "skipped": overlapped,
+        })
+        if self._metrics is not None:
+            self._metrics.tick_lateness.observe(lateness, job=job.name)
+            if missed:
+                self._metrics.coalesced_ticks.inc(missed, job=job.name)
+            if overlapped:
+                self._metrics.skipped_ticks.inc(job=job.name)
+        job.due = self._next_due(job, max(job.due, now))
+        job.wake_at = job.due + uniform(0, job.jitter)
+
+    @staticmethod
+    async def _run_job(job: ScheduledJob):
+        """ Runs job once within its timeout. """
+
+        if job.timeout is None:
+            await job.func()
+        else:
+            await wait_for(job.func(), job.timeout)
+
+    def _on_done(self, job: ScheduledJob, task: Task):
+        """ Logs failed run and brings the next tick closer if necessary. """
+
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        self._logger.error({
+            "event": "error",
+            "job": job.name,
+            "error": str(error) or type(error).__name__,
+            "traceback": format_exception(error),
+        })
+        if job.retry_delay is not None:
+            retry_at = self._clock() + job.retry_delay
+            if retry_at < job.due:
+                job.due = job.wake_at = retry_at
+                self._changed.set()
+
+    async def run(self):
+        """ Runs ticks of jobs until cancelled. """
+
+        while True:
+            if self._heartbeat is not None:
+                self._heartbeat()
+            self._changed.clear()
+            job = min(self._jobs, key=lambda item: item.wake_at, default=None)
+            delay = job.wake_at - self._clock() if job is not None else None
+            if self._heartbeat is not None and (delay is None or delay > self._heartbeat_interval):
+                # Sleeping is split so that heartbeat keeps coming
+                delay = self._heartbeat_interval
+            if delay is None or delay > 0:
+                try:
+                    # Added jobs and retries may need earlier wake up
+                    await wait_for(self._changed.wait(), delay)
+                except AioTimeoutError:
+                    pass
+                continue
+            self._tick(job, self._clock())
+
+    def start(self):
+        """ Starts scheduler in background task. """
+
+        if self._task is None:
+            self._task = create_task(self.run())
+
+    def stop(self):
+        """ Stops scheduler and cancels running jobs. """
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for job in self._jobs:
+            if job.task is not None:
+                job.task.cancel()
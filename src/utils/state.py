@@ -0,0 +1,51 @@
+import os
+from json import dump, load
+from tempfile import NamedTemporaryFile
+from typing import Any
+
+
+class StateStore:
+    """
+    Small JSON file which keeps application state between restarts.
+    File is rewritten atomically on every change.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializer.
+        Args:
+            path: path to state file.
+        """
+
+        self._path = path
+        self._data: dict[str, Any] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as state_file:
+                    self._data = load(state_file)
+            except ValueError:
+                # Broken state is not a reason to fail startup
+                self._data = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """ Returns stored value for key. """
+
+        return self._data.get(key, default)
+
+    def set(self, key: str, value: Any):
+        """ Stores value for key and saves state to disk. """
+
+        self._data[key] = value
+        self._save()
+
+    def _save(self):
+        folder = os.path.dirname(os.path.abspath(self._path))
+        with NamedTemporaryFile(
+                "w",
+                encoding="utf-8",
+                dir=folder,
+                prefix=".state-",
+                delete=False,
+        ) as tmp_file:
+            dump(self._data, tmp_file, ensure_ascii=False)
+        os.replace(tmp_file.name, self._path)
@@ -0,0 +1,293 @@
+from asyncio import Future, Task, create_task, get_running_loop, sleep as aio_sleep, wait
+from time import monotonic, time
+from traceback import format_exception
+from typing import Awaitable, Callable
+
+from src.utils.logger import CustomJSONLogger
+from src.utils.metrics import Metrics
+from src.utils.retry import RetryPolicy
+
+
+class SupervisedTask:
+    """ Long-running task of supervisor, restarted whenever it ends. """
+
+    def __init__(
+            self,
+            name: str,
+            factory: Callable[[], Awaitable[None]],
+            stall_timeout: float | None = None,
+    ):
+        """
+        Initializer.
+        Args:
+            name: task name (used in logs, metrics and health).
+            factory: coroutine function which runs task forever.
+            stall_timeout: if set, task must beat at least that often
+                (seconds), otherwise it is considered stalled and restarted.
+        """
+
+        self.name = name
+        self.factory = factory
+        self.stall_timeout = stall_timeout
+        self.task: Task | None = None
+        self.started_at = 0.0
+        self.beat_at = 0.0
+        self.stalled = False
+        self.restarts = 0
+        # Restarts in a row which haven't been followed by a stable run
+        self.failures = 0
+
+
+class Supervisor:
+    """
+    Supervisor of long-running tasks of the application. A task which
+    fails or exits is restarted with backoff, a watchdog restarts tasks
+    whose heartbeat is late. After too many failed restarts in a row the
+    supervisor gives up, so the process exits and can be restarted from
+    outside. Health report (liveness and the latest successful update of
+    every account) is served by metrics server.
+    """
+
+    def __init__(
+            self,
+            logger: CustomJSONLogger,
+            metrics: Metrics | None = None,
+            retry_policy: RetryPolicy | None = None,
+            max_restarts: int = 5,
+            stable_after: float = 60,
+            max_staleness: float = 0,
+            watchdog_interval: float = 5,
+            clock: Callable[[], float] = monotonic,
+            wall_clock: Callable[[], float] = time,
+    ):
+        """
+        Initializer.
+        Args:
+            logger: logger object.
+            metrics: metrics where restarts and successes are recorded.
+            retry_policy: backoff between restarts.
+            max_restarts: failed restarts of task in a row after which the
+                supervisor gives up (0 - never).
+            stable_after: run of task longer than this (seconds) resets
+                its failed restarts.
+            max_staleness: health is reported as stale if avatar of some
+                account hasn't been updated successfully for longer than
+                this (seconds, 0 - never).
+            watchdog_interval: how often heartbeats are checked (seconds).
+            clock: monotonic clock (seconds).
+            wall_clock: wall clock (UNIX timestamp) of reported times.
+        """
+
+        self._logger = logger
+        self._metrics = metrics
+        self._retry = retry_policy or RetryPolicy(base_delay=1, max_delay=60)
+        self._max_restarts = max_restarts
+        self._stable_after = stable_after
+        self._max_staleness = max_staleness
+        self._watchdog_interval = watchdog_interval
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._tasks: dict[str, SupervisedTask] = {}
+        self._runners: list[Task] = []
+        self._failed: Future | None = None
+        self._started_at = wall_clock()
+        # Account -> time of the latest success (None - not yet)
+        self._last_success: dict[str, float | None] = {}
+        self._stale: set[str] = set()
+
+    @property
+    def tasks(self) -> list[SupervisedTask]:
+        return list(self._tasks.values())
+
+    def add(
+            self,
+            name: str,
+            factory: Callable[[], Awaitable[None]],
+            stall_timeout: float | None = None,
+    ) -> SupervisedTask:
+        """ Adds task, it runs once supervisor is started. """
+
+        supervised = SupervisedTask(name, factory, stall_timeout)
+        self._tasks[name] = supervised
+        return supervised
+
+    def beat(self, name: str):
+        """ Records heartbeat of task. """
+
+        self._tasks[name].beat_at = self._clock()
+
+    def expect(self, account: str):
+        """ Tracks successes of account (it is stale until the first one). """
+
+        self._last_success.setdefault(account, None)
+
+    def success(self, account: str):
+        """ Records successful update of account. """
+
+        now = self._wall_clock()
+        self._last_success[account] = now
+        if self._metrics is not None:
+            self._metrics.last_success.set(now, account=account)
+
+    def _stale_for(self, now: float) -> dict[str, float]:
+        """ Returns seconds since the latest success of every account. """
+
+        return {
+            account: now - (last_success or self._started_at)
+            for account, last_success in self._last_success.items()
+        }
+
+    def health(self) -> dict:
+        """
+        Returns health report.
+        Returns:
+            Status ("ok", "stale" or "failed"), the latest successes of
+            accounts and state of tasks.
+        """
+
+        now, clock = self._wall_clock(), self._clock()
+        stale_for = self._stale_for(now)
+        if self._failed is not None and self._failed.done():
+            status = "failed"
+        elif self._max_staleness and any(
+                seconds > self._max_staleness for seconds in stale_for.values()
+        ):
+            status = "stale"
+        else:
+            status = "ok"
+        return {
+            "status": status,
+            "accounts": {
+                account: {
+                    "last_success": self._last_success[account],
+                    "stale_for": round(seconds, 3),
+                }
+                for account, seconds in stale_for.items()
+            },
+            "tasks": {
+                task.name: {
+                    "running": task.task is not None and not task.task.done(),
+                    "restarts": task.restarts,
+                    "heartbeat_age": (
+                        round(clock - task.beat_at, 3)
+                        if task.stall_timeout is not None else None
+                    ),
+                }
+                for task in self._tasks.values()
+            },
+        }
+
+    async def _supervise(self, supervised: SupervisedTask):
+        """ Runs task and restarts it whenever it ends. """
+
+        while True:
+            supervised.started_at = supervised.beat_at = self._clock()
+            supervised.stalled = False
+            supervised.task = create_task(supervised.factory())
+            # Waiting doesn't raise if task is cancelled by watchdog
+            await wait([supervised.task])
+            task = supervised.task
+            if supervised.stalled:
+                reason, error = "stall", None
+            elif task.cancelled():
+                return
+            else:
+                error = task.exception()
+                reason = "exit" if error is None else "error"
+            if self._clock() - supervised.started_at >= self._stable_after:
+                supervised.failures = 0
+            supervised.failures += 1
+            supervised.restarts += 1
+            if self._metrics is not None:
+                self._metrics.task_restarts.inc(task=supervised.name, reason=reason)
+            if self._max_restarts and supervised.failures > self._max_restarts:
+                self._logger.critical({
+                    "event": "supervisor_gave_up",
+                    "task": supervised.name,
+                    "failures": supervised.failures - 1,
+                    "error": str(error) if error is not None else reason,
+                })
+                if not self._failed.done():
+                    self._failed.set_exception(RuntimeError(
+                        f"Task {supervised.name} has failed "
+                        f"{supervised.failures - 1} times in a row"
+                    ))
+                return
+            delay = self._retry.backoff(supervised.failures)
+            self._logger.error({
+                "event": "task_restart",
+                "task": supervised.name,
+                "reason": reason,
+                "restarts": supervised.restarts,
+                "delay_ms": round(delay * 1000, 3),
+                "error": str(error) if error is not None else None,
+                "traceback": format_exception(error) if error is not None else None,
+            })
+            await aio_sleep(delay)
+
+    async def _watchdog(self):
+        """ Restarts tasks with late heartbeat and logs stale accounts. """
+
+        while True:
+            await aio_sleep(self._watchdog_interval)
+            now = self._clock()
+            for supervised in self._tasks.values():
+                task = supervised.task
+                if (
+                        supervised.stall_timeout is None
+                        or task is None
+                        or task.done()
+                        or now - supervised.beat_at <= supervised.stall_timeout
+                ):
+                    continue
+                self._logger.error({
+                    "event": "task_stalled",
+                    "task": supervised.name,
+                    "heartbeat_age": round(now - supervised.beat_at, 3),
+                })
+                supervised.stalled = True
+                task.cancel()
+            if not self._max_staleness:
+                continue
+            # Staleness is logged once per stale period of account
+            for account, seconds in self._stale_for(self._wall_clock()).items():
+                if seconds <= self._max_staleness:
+                    self._stale.discard(account)
+                elif account not in self._stale:
+                    self._stale.add(account)
+                    self._logger.warning({
+                        "event": "avatar_stale",
+                        "account": account,
+                        "stale_for": round(seconds, 3),
+                    })
+
+    def start(self):
+        """ Starts supervised tasks and watchdog. """
+
+        if self._runners:
+            return
+        self._failed = get_running_loop().create_future()
+        self._runners = [
+            create_task(self._supervise(supervised))
+            for supervised in self._tasks.values()
+        ]
+        self._runners.append(create_task(self._watchdog()))
+
+    async def wait(self):
+        """
+        Waits until supervisor gives up.
+        Raises:
+            RuntimeError: when some task has failed too many times in a row.
+        """
+
+        await self._failed
+
+    def stop(self):
+        """ Stops watchdog and supervised tasks. """
+
+        for runner in self._runners:
+            runner.cancel()
+        self._runners = []
+        for supervised in self._tasks.values():
+            if supervised.task is not None:
+                supervised.task.cancel()